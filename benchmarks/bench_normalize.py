@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the domain lookup done by normalize_url: the original linear
+loop over DOMAIN_MAPPINGS against the compiled DomainIndex.
+
+Usage: python benchmarks/bench_normalize.py [--mappings 500] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mappings import load_mappings, DomainIndex
+
+def linear_rewrite_hostname(hostname, mappings):
+    """The lookup normalize_url used before the index: one endswith pass per mapping."""
+    for original_domain, replacement_domain in mappings.items():
+        if hostname.endswith(original_domain) and not hostname.endswith(replacement_domain):
+            if hostname == original_domain:
+                return replacement_domain
+            elif hostname.endswith('.' + original_domain):
+                return hostname[:-len(original_domain)-1] + '.' + replacement_domain
+    return None
+
+def build_mappings(size):
+    """Real mappings padded with synthetic mirror and regional domains."""
+    mappings = load_mappings()
+    for i in range(size - len(mappings)):
+        mappings[f"mirror{i}.example{i % 7}.net"] = f"fixed{i}.example.org"
+    return mappings
+
+def build_hostnames(mappings, count=1000):
+    """Mix of mapped hosts, subdomains of mapped hosts and unrelated hosts."""
+    rng = random.Random(0)
+    domains = list(mappings)
+    hostnames = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            hostnames.append(rng.choice(domains))
+        elif kind == 1:
+            hostnames.append("www." + rng.choice(domains))
+        else:
+            hostnames.append(f"news{i}.unrelated-site.com")
+    return hostnames
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mappings", type=int, default=500, help="number of mappings to benchmark with")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    mappings = build_mappings(args.mappings)
+    index = DomainIndex(mappings)
+    hostnames = build_hostnames(mappings)
+
+    # Both lookups must agree before their speed is worth comparing
+    for hostname in hostnames:
+        assert index.rewrite_hostname(hostname) == linear_rewrite_hostname(hostname, mappings), hostname
+
+    linear = min(timeit.repeat(lambda: [linear_rewrite_hostname(h, mappings) for h in hostnames], number=1, repeat=args.repeat))
+    indexed = min(timeit.repeat(lambda: [index.rewrite_hostname(h) for h in hostnames], number=1, repeat=args.repeat))
+
+    print(f"mappings: {len(mappings)}, hostnames: {len(hostnames)}")
+    print(f"linear loop:  {linear / len(hostnames) * 1e6:8.2f} us/lookup")
+    print(f"domain index: {indexed / len(hostnames) * 1e6:8.2f} us/lookup")
+    print(f"speedup:      {linear / indexed:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Micro-benchmark of building a correction for long messages: the original
+character-by-character escaping and per-URL str.replace against the
+single-pass renderers (MarkdownV2 and plain text with entities).
+
+Usage: python benchmarks/bench_render.py [--length 4096] [--links 20] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import User
+
+from message_renderer import LinkSpan, render_entities, render_markdown
+
+def original_escape_markdown_v2(text):
+    """The escaping the handlers used before the renderer."""
+    escape_chars = '_*[]()~`>#+-=|{}.!'
+    result = ""
+    for char in text:
+        if char in escape_chars:
+            result += "\\" + char
+        else:
+            result += char
+    return result
+
+def original_render(text, url_mappings, sender):
+    """The message building the handlers used before the renderer."""
+    clean_text = text
+    for old_url in url_mappings:
+        clean_text = clean_text.replace(old_url, '').strip()
+    escaped_text = original_escape_markdown_v2(clean_text)
+    quoted_text = f'"{escaped_text}"' if clean_text else ''
+    links_text = '\n'.join(f"[Modified link]({new_url})" for new_url in url_mappings.values())
+    parts = [f"Sent by [{original_escape_markdown_v2(sender.first_name)}](tg://user?id={sender.id})"]
+    if quoted_text:
+        parts.append(quoted_text)
+    if links_text:
+        parts.append(links_text)
+    return '\n\n'.join(parts)
+
+def build_message(length, link_count):
+    """Punctuation-heavy text of about `length` characters with `link_count` distinct links."""
+    rng = random.Random(0)
+    words = ["look", "at", "this!", "(really)", "it's_great", "#1", "a.b", "-", "ok?", "*wow*"]
+    links = [f"https://x.com/user{i}/status/{rng.randrange(10 ** 12)}" for i in range(link_count)]
+    budget = length - sum(len(link) + 1 for link in links)
+    filler = []
+    while sum(len(word) + 1 for word in filler) < budget:
+        filler.append(rng.choice(words))
+    step = max(1, len(filler) // (link_count + 1))
+    pieces = []
+    for i, word in enumerate(filler):
+        pieces.append(word)
+        if i % step == step - 1 and len(pieces) - i - 1 < link_count:
+            pieces.append(links[len(pieces) - i - 1])
+    text = " ".join(pieces)[:length]
+
+    spans = []
+    position = 0
+    for link in links:
+        start = text.find(link, position)
+        if start < 0:
+            break
+        spans.append(LinkSpan(start, start + len(link), link))
+        position = start + len(link)
+    url_mappings = {span.url: span.url.replace("https://x.com", "https://fixupx.com") for span in spans}
+    return text, spans, url_mappings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--length", type=int, default=4096, help="message length in characters")
+    parser.add_argument("--links", type=int, default=20, help="links in the message")
+    parser.add_argument("--number", type=int, default=200, help="renders per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    text, spans, url_mappings = build_message(args.length, args.links)
+    sender = User(id=1, first_name="Some_User", is_bot=False)
+
+    # The renderers must produce the same message before their speed is worth comparing
+    assert render_markdown(text, spans, url_mappings, sender) == original_render(text, url_mappings, sender)
+
+    def timed(func):
+        return min(timeit.repeat(func, number=args.number, repeat=args.repeat)) / args.number * 1e6
+
+    original = timed(lambda: original_render(text, url_mappings, sender))
+    markdown = timed(lambda: render_markdown(text, spans, url_mappings, sender))
+    entities = timed(lambda: render_entities(text, spans, url_mappings, sender))
+
+    print(f"message: {len(text)} chars, {len(spans)} links")
+    print(f"original:          {original:8.1f} us/message")
+    print(f"single-pass md:    {markdown:8.1f} us/message ({original / markdown:.1f}x)")
+    print(f"plain + entities:  {entities:8.1f} us/message ({original / entities:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Startup-time benchmark: how long importing the bot takes in a fresh interpreter,
+and how long the warm-up takes when its tasks (database ping, index creation,
+mapping compile, group registry load) run one after another versus concurrently,
+with injected database latency. No token or database is needed.
+
+Usage: python benchmarks/bench_startup.py [--imports 5] [--db-latency 50] [--groups 5000] [--repeat 3]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import db
+import handlers
+from main import warm_up
+from mappings import MappingsWatcher
+from storage import MemoryStorage
+
+class SlowStorage(MemoryStorage):
+    """In-memory storage whose every call takes the injected database latency."""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def ping(self):
+        time.sleep(self.latency)
+
+    def create_database(self):
+        time.sleep(self.latency)
+
+    def load_groups(self):
+        time.sleep(self.latency)
+        return super().load_groups()
+
+def import_time():
+    """Seconds a fresh interpreter needs to import the bot's entry point."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], check=True, env={**os.environ, "DB_NAME": "benchmark"})
+    return time.perf_counter() - start
+
+async def sequential_warm_up(app):
+    """The warm-up tasks awaited one at a time, as startup used to do them."""
+    await db.ping_async()
+    await db.create_database_async()
+    await app.bot_data["mappings_watcher"].load()
+    await db.load_allowed_groups_async()
+
+async def timed(warm):
+    app = SimpleNamespace(bot_data={"mappings_watcher": MappingsWatcher(handlers.apply_mappings)})
+    start = time.perf_counter()
+    await warm(app)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imports", type=int, default=5, help="fresh-interpreter imports to time (median is reported)")
+    parser.add_argument("--db-latency", type=float, default=50, help="milliseconds each database call takes")
+    parser.add_argument("--groups", type=int, default=5000, help="authorized groups to load")
+    parser.add_argument("--repeat", type=int, default=3, help="warm-up repetitions (best is reported)")
+    args = parser.parse_args()
+    latency = args.db_latency / 1000
+
+    imports = statistics.median(import_time() for _ in range(args.imports))
+
+    storage = SlowStorage(latency)
+    for i in range(args.groups):
+        storage.add_group(str(-1000 - i), f"Group {i}")
+    with patch.object(db, "storage", storage):
+        sequential = min(asyncio.run(timed(sequential_warm_up)) for _ in range(args.repeat))
+        concurrent = min(asyncio.run(timed(warm_up)) for _ in range(args.repeat))
+
+    print(f"import main:        {imports * 1000:8.1f} ms (median of {args.imports})")
+    print(f"warm-up sequential: {sequential * 1000:8.1f} ms ({args.db_latency:.0f} ms per database call, {args.groups} groups)")
+    print(f"warm-up concurrent: {concurrent * 1000:8.1f} ms ({sequential / concurrent:.1f}x)")
+
+if __name__ == "__main__":
+    main()
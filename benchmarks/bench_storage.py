@@ -0,0 +1,89 @@
+"""
+Throughput of the storage backends on the hot calls: `is_group_allowed` (served
+from the registry db.py loads from the backend, so the backend only matters for
+the load) and logging unauthorized attempts, written one per call (from one
+thread and from the db executor's threads at once) and in the batches
+db.log_unauthorized_group queues them in. MongoDB is included when --mongo-uri is given.
+
+Usage: python benchmarks/bench_storage.py [--groups 500] [--attempts 2000] [--batch-size 100] [--mongo-uri mongodb://localhost:27017]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import db
+from storage import MemoryStorage, MongoStorage, SQLiteStorage
+
+def attempt(i):
+    return {"chat_id": -1000 - i, "chat_name": f"Spam {i}", "added_by_id": i % 50, "added_by_name": "Spammer", "timestamp": datetime.now(timezone.utc)}
+
+def measure(storage, groups, attempts, threads, batch_size):
+    """
+    Returns (registry load seconds, is_group_allowed calls/s, attempts/s written one per
+    call, the same from `threads` threads, attempts/s written in batches).
+    """
+    storage.create_database()
+    for i in range(groups):
+        storage.add_group(str(-100 - i), f"Group {i}")
+
+    with patch.object(db, "storage", storage):
+        start = time.perf_counter()
+        db.load_allowed_groups()
+        load = time.perf_counter() - start
+
+        chat_ids = [str(-100 - i % (groups * 2)) for i in range(100000)]
+        start = time.perf_counter()
+        for chat_id in chat_ids:
+            db.is_group_allowed(chat_id)
+        lookups = len(chat_ids) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(attempts):
+        storage.log_unauthorized_groups([attempt(i)])
+    sequential = attempts / (time.perf_counter() - start)
+
+    with ThreadPoolExecutor(threads) as executor:
+        start = time.perf_counter()
+        list(executor.map(lambda i: storage.log_unauthorized_groups([attempt(i)]), range(attempts)))
+        concurrent = attempts / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for first in range(0, attempts, batch_size):
+        storage.log_unauthorized_groups([attempt(i) for i in range(first, min(first + batch_size, attempts))])
+    batched = attempts / (time.perf_counter() - start)
+    return load, lookups, sequential, concurrent, batched
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, default=500, help="authorized groups stored")
+    parser.add_argument("--attempts", type=int, default=2000, help="unauthorized attempts logged per run")
+    parser.add_argument("--threads", type=int, default=db.DB_MAX_WORKERS, help="threads logging at once")
+    parser.add_argument("--batch-size", type=int, default=db.ATTEMPT_BATCH_SIZE, help="attempts per bulk write")
+    parser.add_argument("--mongo-uri", help="also benchmark MongoDB at this URI (uses the smartsociallinkbot_bench database)")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    backends = {"memory": MemoryStorage(), "sqlite": SQLiteStorage(os.path.join(directory.name, "bench.db"))}
+    if args.mongo_uri:
+        mongo = MongoStorage(args.mongo_uri, "smartsociallinkbot_bench")
+        mongo.db.groups.delete_many({})
+        mongo.db.unauthorized_groups.delete_many({})
+        backends["mongodb"] = mongo
+
+    print(f"{args.groups} groups, {args.attempts} attempts, {args.threads} threads, batches of {args.batch_size}")
+    print(f"{'backend':<8} {'load ms':>9} {'allowed/s':>12} {'log/s':>10} {'log/s (threads)':>16} {'log/s (batched)':>16}")
+    for name, storage in backends.items():
+        load, lookups, sequential, concurrent, batched = measure(storage, args.groups, args.attempts, args.threads, args.batch_size)
+        print(f"{name:<8} {load * 1000:9.2f} {lookups:12,.0f} {sequential:10,.0f} {concurrent:16,.0f} {batched:16,.0f}")
+        storage.close()
+    directory.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Offline replay benchmark for the message pipeline.
+
+Replays a JSONL corpus of Telegram updates through the real handlers against a
+fake Bot and the in-memory storage backend, with injected
+API and database latency. No network, token or database is needed.
+
+Usage:
+    python benchmarks/replay.py --generate 5000 --corpus benchmarks/corpus.jsonl
+    python benchmarks/replay.py --corpus benchmarks/corpus.jsonl --api-latency 30 --db-latency 5 --output results.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from telegram import Update
+
+import db
+import handlers
+from mappings import load_mappings
+from storage import MemoryStorage
+
+ADMIN_ID = 1000
+BOT_ID = 1
+
+LINK_SAMPLES = [
+    "https://x.com/user/status/{n}",
+    "https://twitter.com/user/status/{n}",
+    "https://www.instagram.com/p/{n}/",
+    "https://vm.tiktok.com/{n}/",
+    "x.com/user/status/{n}",
+    "https://www.youtube.com/watch?v={n}",
+    "https://example.org/article/{n}",
+]
+WORDS = "lol check this out look at that one wow again nice thread video photo".split()
+
+def generate_corpus(count, chats=50, link_ratio=0.2, join_ratio=0.01, seed=0):
+    """Builds synthetic Telegram updates: plain chatter, link-bearing messages and group joins."""
+    rng = random.Random(seed)
+    chat_ids = [-1000000000000 - i for i in range(chats)]
+    updates = []
+    for update_id in range(1, count + 1):
+        chat_id = rng.choice(chat_ids)
+        chat = {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"}
+        user = {"id": rng.randint(10, 10000), "is_bot": False, "first_name": rng.choice(["Ana", "Bob", "Chen", "Dee"])}
+
+        if rng.random() < join_ratio:
+            # The admin adds the bot to a new group, which registers it in the database
+            chat = {"id": -2000000000000 - update_id, "type": "supergroup", "title": f"New group {update_id}"}
+            updates.append({
+                "update_id": update_id,
+                "my_chat_member": {
+                    "chat": chat,
+                    "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"},
+                    "date": int(time.time()),
+                    "old_chat_member": {"user": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}, "status": "left"},
+                    "new_chat_member": {"user": {"id": BOT_ID, "is_bot": True, "first_name": "Bot"}, "status": "member"},
+                },
+            })
+            continue
+
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+        entities = []
+        if rng.random() < link_ratio:
+            link = rng.choice(LINK_SAMPLES).format(n=rng.randint(1, 10 ** 9))
+            text += " "
+            # Corpus text is ASCII, so UTF-16 offsets equal string offsets
+            entities.append({"type": "url", "offset": len(text), "length": len(link)})
+            text += link
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": chat,
+            "from": user,
+            "text": text,
+        }
+        if entities:
+            message["entities"] = entities
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+def load_corpus(path):
+    """Reads one update per line from a JSONL file."""
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class FakeBot:
+    """Bot stand-in that counts API calls and sleeps for the injected latency."""
+
+    def __init__(self, api_latency):
+        self.id = BOT_ID
+        self.api_latency = api_latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(10 ** 9)
+
+    async def _call(self, method):
+        self.calls[method] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    async def get_chat_member(self, chat_id, user_id, **kwargs):
+        await self._call("get_chat_member")
+        return SimpleNamespace(status="administrator", can_delete_messages=True)
+
+    async def delete_message(self, chat_id, message_id, **kwargs):
+        await self._call("delete_message")
+        return True
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._call("delete_messages")
+        return True
+
+    def _sent(self):
+        return SimpleNamespace(message_id=next(self._message_ids))
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await self._call("send_message")
+        return self._sent()
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._call("copy_message")
+        return self._sent()
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._call("send_media_group")
+        return [self._sent() for _ in media]
+
+    async def leave_chat(self, chat_id, **kwargs):
+        await self._call("leave_chat")
+        return True
+
+class LatencyStorage(MemoryStorage):
+    """In-memory storage that counts calls and blocks for the injected database latency."""
+
+    def __init__(self, db_latency):
+        super().__init__()
+        self.db_latency = db_latency
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        if self.db_latency:
+            time.sleep(self.db_latency)
+
+    def add_group(self, chat_id, chat_name):
+        self._wait()
+        super().add_group(chat_id, chat_name)
+
+    def remove_group(self, chat_id):
+        self._wait()
+        return super().remove_group(chat_id)
+
+    def load_groups(self):
+        self._wait()
+        return super().load_groups()
+
+    def log_unauthorized_groups(self, attempts):
+        self._wait()
+        super().log_unauthorized_groups(attempts)
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+async def replay(raw_updates, api_latency=0.0, db_latency=0.0, concurrency=1):
+    """Runs every update through the handlers and returns the measured results."""
+    bot = FakeBot(api_latency)
+    context = SimpleNamespace(bot=bot, bot_data={"admin_id": ADMIN_ID})
+    storage = LatencyStorage(db_latency)
+
+    # Every chat seen in message updates is authorized; joins exercise the database path
+    for raw in raw_updates:
+        if "message" in raw:
+            chat_id = str(raw["message"]["chat"]["id"])
+            MemoryStorage.add_group(storage, chat_id, raw["message"]["chat"]["title"])
+
+    updates = [Update.de_json(raw, bot) for raw in raw_updates]
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(update):
+        handler = handlers.handle_group_join if update.my_chat_member else handlers.process_message
+        async with semaphore:
+            start = time.perf_counter()
+            await handler(update, context)
+            latencies.append(time.perf_counter() - start)
+
+    with patch.object(db, "storage", storage):
+        db.load_allowed_groups()
+        handlers.apply_mappings(load_mappings())
+        handlers._bot_permissions.clear()
+        storage.calls = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(run_one(update) for update in updates))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    api_calls = sum(bot.calls.values())
+    return {
+        "updates": len(updates),
+        "concurrency": concurrency,
+        "api_latency_ms": api_latency * 1000,
+        "db_latency_ms": db_latency * 1000,
+        "elapsed_s": round(elapsed, 4),
+        "messages_per_s": round(len(updates) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "api_calls": dict(bot.calls),
+        "api_calls_per_message": round(api_calls / len(updates), 4) if updates else 0.0,
+        "db_calls": storage.calls,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="JSONL file with one Telegram update per line")
+    parser.add_argument("--generate", type=int, metavar="N", help="generate N synthetic updates (written to --corpus if given)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="injected Telegram API latency in ms")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="injected database latency in ms")
+    parser.add_argument("--concurrency", type=int, default=1, help="updates processed at the same time")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--log-level", default="ERROR", help="log level for the handlers while replaying")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level)
+
+    if args.generate:
+        raw_updates = generate_corpus(args.generate)
+        if args.corpus:
+            with open(args.corpus, "w") as f:
+                f.writelines(json.dumps(update) + "\n" for update in raw_updates)
+            print(f"Wrote {len(raw_updates)} updates to {args.corpus}", file=sys.stderr)
+            return
+    elif args.corpus:
+        raw_updates = load_corpus(args.corpus)
+    else:
+        raw_updates = generate_corpus(2000)
+
+    results = asyncio.run(replay(raw_updates, args.api_latency / 1000, args.db_latency / 1000, args.concurrency))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,69 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import CallbackContext
 from telegram.error import TelegramError
-from db import get_all_groups, add_group as db_add_group, remove_group as db_remove_group, is_group_allowed, get_unauthorized_attempts
+from outbound_scheduler import PRIORITY_ADMIN
+from metrics import HANDLED_UPDATES, HANDLER_LATENCY, HANDLERS_IN_FLIGHT, UPDATES_RECEIVED, STAGE_LATENCY, EVENT_LOOP_LAG
+from diagnostics import SamplingProfiler
+import handlers
+from db import get_groups_async, add_groups_async as db_add_groups, remove_groups_async as db_remove_groups, is_group_allowed, get_unauthorized_attempts_async, count_unauthorized_attempts_async
+from db import get_group_overrides, set_group_override_async, clear_group_override_async
+from mappings import is_valid_domain
+import asyncio
+import io
 import logging
+import time
+from datetime import datetime
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
+# Unauthorized attempts shown per page, and users or groups per top list
+ATTEMPTS_PAGE_SIZE = 10
+
+# Groups listed per page, and Telegram calls made at once by the bulk group commands
+GROUPS_PAGE_SIZE = 20
+BULK_CONCURRENCY = 5
+
+# Longest response sent in one message (Telegram allows 4096 characters)
+MAX_RESPONSE_LENGTH = 4000
+
+# Seconds /stats measures by default and at most, and the same for /profile
+STATS_SECONDS = 5
+STATS_MAX_SECONDS = 60
+PROFILE_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+
+# Pipeline stages shown by /stats: title -> which STAGE_LATENCY stages it covers
+STATS_STAGES = {
+    "Database": lambda labels: labels["stage"].startswith("db."),
+    "Telegram API": lambda labels: labels["stage"].startswith("telegram."),
+    "Normalization": lambda labels: labels["stage"] == "normalize_url",
+}
+
 async def send_response(update: Update, text: str, reply_markup=None, parse_mode=None):
     """Helper function to send responses for both callback queries and regular messages."""
+    # Calls go through the bot (not the message shortcuts) so admin responses can skip
+    # ahead of queued link corrections in the outbound scheduler
+    bot = update.get_bot()
     if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        message = update.callback_query.message
+        await bot.edit_message_text(
+            text,
+            chat_id=message.chat_id,
+            message_id=message.message_id,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode,
+            rate_limit_args=PRIORITY_ADMIN
+        )
     else:
-        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        await bot.send_message(
+            update.message.chat_id,
+            text,
+            message_thread_id=update.message.message_thread_id if update.message.is_topic_message else None,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode,
+            rate_limit_args=PRIORITY_ADMIN
+        )
 
 def validate_chat_id(chat_id: str) -> tuple[bool, str]:
     """Validates and normalizes a chat ID."""
@@ -37,15 +88,26 @@ def admin_only(func):
     """Decorator for commands and callbacks that only the admin can use."""
     @wraps(func)
     async def wrapper(update: Update, context: CallbackContext, *args, **kwargs):
-        user_id = update.effective_user.id
-        if user_id != context.bot_data["admin_id"]:
-            if update.callback_query:
-                await update.callback_query.answer("You do not have permission to use this option.", show_alert=True)
-            else:
-                await update.message.reply_text("You do not have permission to use this command.")
-            logger.warning(f"Unauthorized user {user_id} attempted to use {func.__name__}")
-            return
-        return await func(update, context, *args, **kwargs)
+        start = time.perf_counter()
+        outcome = "error"
+        HANDLERS_IN_FLIGHT.inc(handler=func.__name__)
+        try:
+            user_id = update.effective_user.id
+            if user_id != context.bot_data["admin_id"]:
+                if update.callback_query:
+                    await update.callback_query.answer("You do not have permission to use this option.", show_alert=True)
+                else:
+                    await update.message.reply_text("You do not have permission to use this command.")
+                logger.warning("Unauthorized user %s attempted to use %s", user_id, func.__name__, extra={"chat_id": getattr(update.effective_chat, "id", None), "handler": func.__name__, "rate_limited": True})
+                outcome = "unauthorized"
+                return
+            result = await func(update, context, *args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            HANDLERS_IN_FLIGHT.dec(handler=func.__name__)
+            HANDLED_UPDATES.inc(handler=func.__name__, outcome=outcome)
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=func.__name__, outcome=outcome)
     return wrapper
 
 @admin_only
@@ -64,151 +126,525 @@ async def menu(update: Update, context: CallbackContext):
 async def button_handler(update: Update, context: CallbackContext):
     """Handles the menu buttons."""
     query = update.callback_query
-    await query.answer()
+    await context.bot.answer_callback_query(query.id, rate_limit_args=PRIORITY_ADMIN)
     data = query.data
 
     if data == "list_groups":
         await list_groups(update, context)
     elif data == "add_group_prompt":
-        await query.edit_message_text(
+        await send_response(
+            update,
             "Send the group ID to add using the format:\n`/add_group <GROUP_ID>`",
             parse_mode="Markdown"
         )
     elif data == "remove_group_prompt":
         await remove_group(update, context)
+    elif data.startswith("rmpage:"):
+        await _send_group_picker(update, data[len("rmpage:"):])
+    elif data.startswith("groups:"):
+        await list_groups(update, context, data[len("groups:"):])
     elif data.startswith("remove_"):
         # Extract chat_id from callback data (remove_CHAT_ID)
         chat_id_to_remove = data[7:]  # Remove "remove_" prefix
         await remove_group(update, context, chat_id_to_remove)
     elif data == "list_attempts":
         await list_unauthorized_attempts(update, context)
+    elif data.startswith("attempts:"):
+        await list_unauthorized_attempts(update, context, data[len("attempts:"):])
+    elif data == "attempt_stats":
+        await unauthorized_attempt_stats(update, context)
+
+def _join_lines(lines: list) -> str:
+    """Joins response lines, leaving out the last ones if they would not fit in one message."""
+    text = ""
+    for shown, line in enumerate(lines):
+        if len(text) + len(line) + 40 > MAX_RESPONSE_LENGTH:
+            return text + f"...and {len(lines) - shown} more."
+        text += line + "\n"
+    return text
+
+async def _call_bounded(func, chat_ids: list) -> list:
+    """Calls func(chat_id) for every chat, BULK_CONCURRENCY at a time; returns the results or exceptions in order."""
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def call(chat_id):
+        async with semaphore:
+            return await func(chat_id, rate_limit_args=PRIORITY_ADMIN)
+
+    return await asyncio.gather(*(call(chat_id) for chat_id in chat_ids), return_exceptions=True)
 
 @admin_only
-async def list_groups(update: Update, context: CallbackContext):
-    """Lists authorized groups."""
+async def list_groups(update: Update, context: CallbackContext, cursor: str = None):
+    """Lists authorized groups a page at a time; /list_groups <TEXT> lists those whose name or ID contains TEXT."""
     try:
-        groups = get_all_groups()
+        # A new listing starts a new search; the page buttons keep it
+        if cursor is None:
+            context.user_data["group_search"] = " ".join(context.args or []) or None
+        search = context.user_data.get("group_search")
+
+        groups, next_cursor = await get_groups_async(GROUPS_PAGE_SIZE, cursor, search)
         if not groups:
-            response = "The bot is not in any authorized group."
+            if search:
+                response = f"No authorized group matches \"{search}\"."
+            else:
+                response = "The bot is not in any authorized group." if not cursor else "No more authorized groups."
         else:
-            response = "Currently authorized groups:\n"
+            response = f"Authorized groups matching \"{search}\":\n" if search else "Currently authorized groups:\n"
             response += "\n".join([f"- {group.get('name', 'N/A')} (ID: {group['_id']})" for group in groups])
-        
-        await send_response(update, response)
+
+        keyboard = []
+        if next_cursor:
+            keyboard.append([InlineKeyboardButton("Next page »", callback_data=f"groups:{next_cursor}")])
+        if cursor:
+            keyboard.append([InlineKeyboardButton("« First page", callback_data="groups:")])
+        await send_response(update, response, reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None)
     except Exception as e:
-        logger.error(f"Error listing groups: {e}")
+        logger.error("Error listing groups: %s", e)
         error_message = "An error occurred while listing the groups."
         await send_response(update, error_message)
 
 @admin_only
 async def add_group(update: Update, context: CallbackContext):
-    """Adds a group to the authorized list."""
+    """Adds one or more groups to the authorized list."""
     if not context.args:
-        await send_response(update, "Usage: /add_group <GROUP_ID>")
+        await send_response(update, "Usage: /add_group <GROUP_ID> [GROUP_ID ...]")
         return
 
-    # Validate and normalize chat_id
-    is_valid, result = validate_chat_id(context.args[0])
-    if not is_valid:
-        await send_response(update, result)
-        return
-    
-    chat_id = result
+    lines = []
+    rejected = []
+    # Valid IDs, normalized and without repeats: the ones the summary counts
+    valid_ids = []
+    chat_ids = []
+    for arg in context.args:
+        # Validate and normalize chat_id
+        is_valid, result = validate_chat_id(arg)
+        if not is_valid:
+            rejected.append(arg)
+        elif result in valid_ids:
+            continue
+        elif is_group_allowed(result):
+            valid_ids.append(result)
+            lines.append(f"The group with ID {result} is already authorized.")
+        else:
+            valid_ids.append(result)
+            chat_ids.append(result)
 
-    if is_group_allowed(chat_id):
-        await send_response(update, f"The group with ID {chat_id} is already authorized.")
-        return
+    # The chats are looked up a few at a time, then saved with a single write
+    added = {}
+    for chat_id, chat in zip(chat_ids, await _call_bounded(context.bot.get_chat, chat_ids)):
+        if isinstance(chat, TelegramError):
+            logger.error("Error adding group %s: %s", chat_id, chat)
+            lines.append(f"Could not add group {chat_id}. Reason: {chat.message}")
+        elif isinstance(chat, Exception):
+            logger.error("An unexpected error occurred while adding group %s: %s", chat_id, chat)
+            lines.append(f"Could not add group {chat_id}: an unexpected error occurred.")
+        else:
+            added[chat_id] = chat.title or "Unknown"
 
-    try:
-        chat = await context.bot.get_chat(chat_id)
-        chat_name = chat.title or "Unknown"
-        db_add_group(chat_id, chat_name)
-        logger.info(f"Group added by admin: {chat_name} (ID: {chat_id})")
-        await send_response(update, f"Group added: {chat_name} (ID: {chat_id})")
-    except TelegramError as e:
-        logger.error(f"Error adding group {chat_id}: {e}")
-        await send_response(update, f"Could not add group. Reason: {e.message}")
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while adding group {chat_id}: {e}")
-        await send_response(update, "An unexpected error occurred.")
+    if added:
+        try:
+            await db_add_groups(added)
+        except Exception as e:
+            logger.error("An unexpected error occurred while adding groups %s: %s", ", ".join(added), e)
+            await send_response(update, "An unexpected error occurred.")
+            return
+        for chat_id, chat_name in added.items():
+            logger.info("Group added by admin: %s (ID: %s)", chat_name, chat_id)
+        lines[:0] = [f"Group added: {chat_name} (ID: {chat_id})" for chat_id, chat_name in added.items()]
+
+    if rejected:
+        lines.append(f"Not valid group IDs: {', '.join(rejected)}")
+    if len(context.args) > 1:
+        lines.insert(0, f"Added {len(added)} of {len(valid_ids)} groups.")
+    await send_response(update, _join_lines(lines))
+
+async def _send_group_picker(update: Update, cursor: str = None):
+    """Shows a page of authorized groups as buttons that remove them."""
+    groups, next_cursor = await get_groups_async(GROUPS_PAGE_SIZE, cursor)
+    if not groups:
+        await send_response(update, "No authorized groups to display.")
+        return
+    keyboard = [
+        [InlineKeyboardButton(group.get('name', 'N/A'), callback_data=f"remove_{group['_id']}")]
+        for group in groups
+    ]
+    if next_cursor:
+        keyboard.append([InlineKeyboardButton("Next page »", callback_data=f"rmpage:{next_cursor}")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await send_response(update, "Select a group to remove:", reply_markup=reply_markup)
 
 @admin_only
 async def remove_group(update: Update, context: CallbackContext, chat_id_to_remove: str = None):
-    """Removes an authorized group and makes the bot leave it."""
-    if not chat_id_to_remove and context.args:
-        chat_id_to_remove = context.args[0]
-        if not chat_id_to_remove.startswith("-"):
-            chat_id_to_remove = f"-{chat_id_to_remove}"
-
-    if not chat_id_to_remove:
-        groups = get_all_groups()
-        if not groups:
-            await send_response(update, "No authorized groups to display.")
-            return
-        keyboard = [
-            [InlineKeyboardButton(group.get('name', 'N/A'), callback_data=f"remove_{group['_id']}")]
-            for group in groups
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await send_response(update, "Select a group to remove:", reply_markup=reply_markup)
-        return
+    """Removes one or more authorized groups and makes the bot leave them."""
+    rejected = []
+    if chat_id_to_remove:
+        chat_ids = [chat_id_to_remove]
+    else:
+        chat_ids = []
+        for arg in context.args or []:
+            is_valid, result = validate_chat_id(arg)
+            if is_valid:
+                chat_ids.append(result)
+            else:
+                rejected.append(arg)
+        # Repeats are removed (and counted) once
+        chat_ids = list(dict.fromkeys(chat_ids))
 
-    if not is_group_allowed(chat_id_to_remove):
-        await send_response(update, f"The group with ID {chat_id_to_remove} is not authorized.")
+    if not chat_ids and not rejected:
+        await _send_group_picker(update)
         return
 
-    try:
-        db_remove_group(chat_id_to_remove)
-        logger.info(f"Group removed: ID {chat_id_to_remove}")
-        message = f"The group with ID {chat_id_to_remove} has been removed from the authorized list."
-        
-        await send_response(update, message)
+    lines = []
+    to_remove = []
+    for chat_id in chat_ids:
+        if is_group_allowed(chat_id):
+            to_remove.append(chat_id)
+        else:
+            lines.append(f"The group with ID {chat_id} is not authorized.")
 
+    if to_remove:
         try:
-            await context.bot.leave_chat(chat_id_to_remove)
-            logger.info(f"The bot left the group with ID {chat_id_to_remove}.")
-        except TelegramError as e:
-            logger.error(f"Error leaving group {chat_id_to_remove}: {e}")
-            error_message = f"Could not leave group. Reason: {e.message}"
-            if update.callback_query:
-                await update.callback_query.edit_message_text(f"{message}\n\n{error_message}")
+            await db_remove_groups(to_remove)
+        except Exception as e:
+            logger.error("An unexpected error occurred while removing groups %s: %s", ", ".join(to_remove), e)
+            await send_response(update, "An unexpected error occurred.")
+            return
+
+        removed_lines = []
+        for chat_id, result in zip(to_remove, await _call_bounded(context.bot.leave_chat, to_remove)):
+            logger.info("Group removed: ID %s", chat_id)
+            line = f"The group with ID {chat_id} has been removed from the authorized list."
+            if isinstance(result, TelegramError):
+                logger.error("Error leaving group %s: %s", chat_id, result)
+                line += f" Could not leave group. Reason: {result.message}"
+            elif isinstance(result, Exception):
+                logger.error("An unexpected error occurred while leaving group %s: %s", chat_id, result)
+                line += " Could not leave group."
             else:
-                await update.message.reply_text(error_message)
+                logger.info("The bot left the group with ID %s.", chat_id)
+            removed_lines.append(line)
+        lines[:0] = removed_lines
 
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while removing group {chat_id_to_remove}: {e}")
-        await send_response(update, "An unexpected error occurred.")
+    if rejected:
+        lines.append(f"Not valid group IDs: {', '.join(rejected)}")
+    if len(chat_ids) + len(rejected) > 1:
+        lines.insert(0, f"Removed {len(to_remove)} of {len(chat_ids)} groups.")
+    await send_response(update, _join_lines(lines))
 
 @admin_only
-async def list_unauthorized_attempts(update: Update, context: CallbackContext):
-    """Lists unauthorized attempts to add the bot to groups."""
+async def list_unauthorized_attempts(update: Update, context: CallbackContext, cursor: str = None):
+    """Lists unauthorized attempts to add the bot to groups, newest first, a page at a time."""
     try:
-        attempts = get_unauthorized_attempts()
+        attempts, next_cursor = await get_unauthorized_attempts_async(ATTEMPTS_PAGE_SIZE, cursor)
         if not attempts:
-            response = "No unauthorized attempts have been recorded."
+            response = "No unauthorized attempts have been recorded." if not cursor else "No more unauthorized attempts."
         else:
-            response = "Unauthorized attempts (max 10 shown):\n\n"
-            for attempt in attempts[:10]:
+            response = "Unauthorized attempts, newest first:\n\n"
+            for attempt in attempts:
                 response += (
                     f"- Group: {attempt.get('chat_name', 'N/A')} (ID: {attempt['chat_id']})\n"
                     f"  Added by: {attempt.get('added_by_name', 'N/A')} (ID: {attempt['added_by_id']})\n"
-                    f"  Date: {attempt.get('timestamp', 'N/A')}\n\n"
+                    f"  Date: {attempt['timestamp'].strftime('%Y-%m-%d %H:%M:%S')} UTC\n\n"
                 )
-        
-        await send_response(update, response)
+
+        keyboard = []
+        if next_cursor:
+            keyboard.append([InlineKeyboardButton("Next page »", callback_data=f"attempts:{next_cursor}")])
+        if cursor:
+            keyboard.append([InlineKeyboardButton("« First page", callback_data="list_attempts")])
+        if attempts or cursor:
+            keyboard.append([InlineKeyboardButton("Top adders and groups", callback_data="attempt_stats")])
+        await send_response(update, response, reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None)
     except Exception as e:
-        logger.error(f"Error listing unauthorized attempts: {e}")
+        logger.error("Error listing unauthorized attempts: %s", e)
         await send_response(update, "An error occurred while listing unauthorized attempts.")
 
+@admin_only
+async def unauthorized_attempt_stats(update: Update, context: CallbackContext):
+    """Shows who added the bot to unauthorized groups most often, and which groups it was added to most."""
+    try:
+        adders, chats = await asyncio.gather(
+            count_unauthorized_attempts_async("added_by", ATTEMPTS_PAGE_SIZE),
+            count_unauthorized_attempts_async("chat", ATTEMPTS_PAGE_SIZE),
+        )
+        if not adders:
+            await send_response(update, "No unauthorized attempts have been recorded.")
+            return
+        response = "Users adding the bot most often:\n"
+        response += "\n".join(f"- {row['name'] or 'N/A'} (ID: {row['id']}): {row['count']}" for row in adders)
+        response += "\n\nGroups the bot was added to most often:\n"
+        response += "\n".join(f"- {row['name'] or 'N/A'} (ID: {row['id']}): {row['count']}" for row in chats)
+        await send_response(update, response)
+    except Exception as e:
+        logger.error("Error counting unauthorized attempts: %s", e)
+        await send_response(update, "An error occurred while counting unauthorized attempts.")
+
+@admin_only
+async def queue_stats(update: Update, context: CallbackContext):
+    """Shows the state of the incoming update queue and the outbound message scheduler."""
+    response = ""
+    processor = context.application.update_processor
+    if hasattr(processor, "stats"):
+        stats = processor.stats()
+        waiting = ", ".join(f"{count} {name}" for name, count in stats["waiting"].items())
+        shed = ", ".join(f"{count} {reason}" for reason, count in sorted(stats["shed"].items())) or "none"
+        response += (
+            "Incoming updates:\n"
+            f"- Being handled: {stats['active']}\n"
+            f"- Waiting: {stats['pending']} ({waiting})\n"
+            f"- Shed: {shed}\n\n"
+        )
+
+    scheduler = context.bot_data.get("scheduler")
+    if not scheduler:
+        response += "The outbound scheduler is not enabled."
+    else:
+        stats = scheduler.stats()
+        response += (
+            "Outbound queue:\n"
+            f"- Waiting requests: {stats['queue_depth']}\n"
+            f"- Requests sent: {stats['requests']}\n"
+            f"- Average wait: {stats['avg_wait']:.3f}s\n"
+            f"- Max wait: {stats['max_wait']:.3f}s\n"
+            f"- Flood-control retries: {stats['retries']}\n"
+        )
+    await send_response(update, response)
+
+@admin_only
+async def cache_stats(update: Update, context: CallbackContext):
+    """Shows the state of the normalized URL cache."""
+    stats = handlers.URL_CACHE.stats()
+    response = (
+        "URL cache:\n"
+        f"- Entries: {stats['size']}/{stats['maxsize']}\n"
+        f"- Hits: {stats['hits']}\n"
+        f"- Misses: {stats['misses']}\n"
+        f"- Hit rate: {stats['hit_rate']:.1%}\n"
+    )
+    resolver = context.bot_data.get("link_resolver")
+    if resolver:
+        stats = resolver.stats()
+        response += (
+            "\nShort links:\n"
+            f"- Resolved targets cached: {stats['size']}/{stats['maxsize']}\n"
+            f"- Hits: {stats['hits']}\n"
+            f"- Misses: {stats['misses']}\n"
+            f"- Requests in flight: {stats['pending']}\n"
+        )
+    await send_response(update, response)
+
+@admin_only
+async def mappings_status(update: Update, context: CallbackContext):
+    """Shows which domain mappings are active and whether the last file change was rejected."""
+    if handlers.MAPPINGS_LOADED_AT is None:
+        loaded_at = "not loaded yet"
+    else:
+        loaded_at = datetime.fromtimestamp(handlers.MAPPINGS_LOADED_AT).strftime("%Y-%m-%d %H:%M:%S")
+    response = (
+        "Domain mappings:\n"
+        f"- Version: {handlers.MAPPINGS_VERSION}\n"
+        f"- Domains: {len(handlers.DOMAIN_MAPPINGS)}\n"
+        f"- Loaded at: {loaded_at}\n"
+    )
+    watcher = context.bot_data.get("mappings_watcher")
+    if not context.bot_data.get("mappings_task"):
+        response += "- Hot reload: disabled\n"
+    elif watcher.last_error:
+        response += f"- Last change rejected: {watcher.last_error}\n"
+    await send_response(update, response)
+
+async def _authorized_chat_id(update: Update, context: CallbackContext, usage: str, min_args: int):
+    """Validates the group ID argument of a mapping command; replies and returns None on failure."""
+    if len(context.args) < min_args:
+        await send_response(update, usage)
+        return None
+    is_valid, result = validate_chat_id(context.args[0])
+    if not is_valid:
+        await send_response(update, result)
+        return None
+    if not is_group_allowed(result):
+        await send_response(update, f"The group with ID {result} is not authorized.")
+        return None
+    return result
+
+@admin_only
+async def group_mappings(update: Update, context: CallbackContext):
+    """Shows a group's mapping overrides."""
+    chat_id = await _authorized_chat_id(update, context, "Usage: /group_mappings <GROUP_ID>", 1)
+    if not chat_id:
+        return
+    overrides = get_group_overrides(chat_id)
+    if not overrides:
+        await send_response(update, f"The group with ID {chat_id} uses the global mappings.")
+        return
+    response = f"Mapping overrides for group {chat_id}:\n"
+    response += "\n".join(f"- {domain} -> {replacement or 'off'}" for domain, replacement in sorted(overrides.items()))
+    await send_response(update, response)
+
+@admin_only
+async def set_mapping(update: Update, context: CallbackContext):
+    """Overrides where a domain is rewritten to in one group, or turns its rewriting off there."""
+    usage = "Usage: /set_mapping <GROUP_ID> <DOMAIN> <REPLACEMENT|off>"
+    chat_id = await _authorized_chat_id(update, context, usage, 3)
+    if not chat_id:
+        return
+    domain, replacement = context.args[1].lower(), context.args[2].lower()
+    if replacement == "off":
+        replacement = None
+    if not is_valid_domain(domain) or (replacement is not None and not is_valid_domain(replacement)):
+        await send_response(update, f"Invalid domain. {usage}")
+        return
+    try:
+        await set_group_override_async(chat_id, domain, replacement)
+        logger.info("Mapping override set in group %s: %s -> %s", chat_id, domain, replacement or "off")
+        await send_response(update, f"In group {chat_id}, {domain} now maps to {replacement or 'nothing (rewriting off)'}.")
+    except Exception as e:
+        logger.error("Error setting mapping override in group %s: %s", chat_id, e)
+        await send_response(update, "An error occurred while saving the override.")
+
+@admin_only
+async def reset_mapping(update: Update, context: CallbackContext):
+    """Removes one or all of a group's mapping overrides."""
+    chat_id = await _authorized_chat_id(update, context, "Usage: /reset_mapping <GROUP_ID> [DOMAIN]", 1)
+    if not chat_id:
+        return
+    domain = context.args[1].lower() if len(context.args) > 1 else None
+    try:
+        await clear_group_override_async(chat_id, domain)
+        logger.info("Mapping override reset in group %s: %s", chat_id, domain or "all domains")
+        await send_response(update, f"In group {chat_id}, {domain or 'every domain'} uses the global mappings again.")
+    except Exception as e:
+        logger.error("Error resetting mapping override in group %s: %s", chat_id, e)
+        await send_response(update, "An error occurred while removing the override.")
+
+def _parse_seconds(args, default: float, maximum: float):
+    """The number of seconds given as first argument, or default; None if it is not valid."""
+    try:
+        seconds = float(args[0]) if args else default
+    except ValueError:
+        return None
+    return seconds if 0 < seconds <= maximum else None
+
+def _format_duration(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+def _format_summary(histogram, before, after, unit: str = "calls") -> str:
+    summary = histogram.summarize(before, after)
+    if not summary["count"]:
+        return f"no {unit}"
+    return f"{summary['count']} {unit}, mean {_format_duration(summary['mean'])}, p99 {_format_duration(summary['quantile'])}"
+
+def _stats_snapshot() -> dict:
+    return {
+        "time": time.monotonic(),
+        "updates": UPDATES_RECEIVED.value(),
+        "handlers": HANDLER_LATENCY.snapshot(),
+        "lag": EVENT_LOOP_LAG.snapshot(),
+        "stages": {title: STAGE_LATENCY.snapshot(predicate) for title, predicate in STATS_STAGES.items()},
+    }
+
+@admin_only
+async def live_stats(update: Update, context: CallbackContext):
+    """Measures the bot for a few seconds (/stats [SECONDS]) and shows throughput, load and where time goes."""
+    seconds = _parse_seconds(context.args, STATS_SECONDS, STATS_MAX_SECONDS)
+    if seconds is None:
+        await send_response(update, f"Usage: /stats [SECONDS] (at most {STATS_MAX_SECONDS}).")
+        return
+
+    await send_response(update, f"Measuring for {seconds:g} seconds; the results will be sent here.")
+    # The wait runs in the background so other commands are answered meanwhile
+    context.application.create_task(_finish_live_stats(context, update.effective_chat.id, seconds))
+
+async def _finish_live_stats(context: CallbackContext, chat_id: int, seconds: float):
+    before = _stats_snapshot()
+    await asyncio.sleep(seconds)
+    after = _stats_snapshot()
+
+    elapsed = after["time"] - before["time"]
+    in_flight = {key[0]: count for key, count in HANDLERS_IN_FLIGHT.values().items()}
+    running = ", ".join(f"{name} {count}" for name, count in sorted(in_flight.items()) if count > 0)
+    monitor = context.bot_data.get("loop_monitor")
+
+    lines = [
+        f"Live stats over {elapsed:.1f}s:",
+        f"- Updates: {(after['updates'] - before['updates']) / elapsed:.1f}/s",
+        f"- Handlers in flight: {sum(count for count in in_flight.values() if count > 0)}" + (f" ({running})" if running else ""),
+        f"- Handler time: {_format_summary(HANDLER_LATENCY, before['handlers'], after['handlers'])}",
+    ]
+    if monitor:
+        lines.append(f"- Event-loop lag: {_format_summary(EVENT_LOOP_LAG, before['lag'], after['lag'], 'checks')}, worst since start {_format_duration(monitor.max_lag)}")
+    else:
+        lines.append("- Event-loop lag: monitor disabled")
+    for title in STATS_STAGES:
+        lines.append(f"- {title}: {_format_summary(STAGE_LATENCY, before['stages'][title], after['stages'][title])}")
+    try:
+        await context.bot.send_message(chat_id, "\n".join(lines), rate_limit_args=PRIORITY_ADMIN)
+    except Exception as e:
+        logger.error("Error sending the live stats: %s", e)
+
+@admin_only
+async def profile(update: Update, context: CallbackContext):
+    """
+    Samples the running bot for N seconds (/profile [SECONDS] [file]) and sends the
+    busiest functions, plus the sampled stacks as a file when asked.
+    """
+    args = list(context.args or [])
+    with_file = "file" in args
+    if with_file:
+        args.remove("file")
+    seconds = _parse_seconds(args, PROFILE_SECONDS, PROFILE_MAX_SECONDS)
+    if seconds is None:
+        await send_response(update, f"Usage: /profile [SECONDS] [file] (at most {PROFILE_MAX_SECONDS} seconds).")
+        return
+    if context.bot_data.get("profiler"):
+        await send_response(update, "A profile is already being taken.")
+        return
+
+    # Created here, on the event loop's thread, which is the one it samples
+    profiler = context.bot_data["profiler"] = SamplingProfiler()
+    profiler.start()
+    logger.info("Profiling the bot for %g seconds.", seconds)
+    await send_response(update, f"Profiling for {seconds:g} seconds; the results will be sent here.")
+    # The wait runs in the background so other commands are answered meanwhile
+    context.application.create_task(_finish_profile(context, update.effective_chat.id, profiler, seconds, with_file))
+
+async def _finish_profile(context: CallbackContext, chat_id: int, profiler: SamplingProfiler, seconds: float, with_file: bool):
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+        context.bot_data.pop("profiler", None)
+    try:
+        await context.bot.send_message(chat_id, profiler.report()[:MAX_RESPONSE_LENGTH], rate_limit_args=PRIORITY_ADMIN)
+        if with_file:
+            document = InputFile(io.BytesIO(profiler.folded().encode()), filename="profile.folded")
+            await context.bot.send_document(
+                chat_id, document,
+                caption="Sampled stacks, for flamegraph.pl or speedscope.app.",
+                rate_limit_args=PRIORITY_ADMIN,
+            )
+    except Exception as e:
+        logger.error("Error sending the profile: %s", e)
+
 @admin_only
 async def admin_help(update: Update, context: CallbackContext):
     """Displays available commands."""
     response = (
         "Available commands:\n"
         "/menu - Displays an interactive menu to manage groups.\n"
-        "/list_groups - Lists all authorized groups.\n"
-        "/add_group <GROUP_ID> - Adds an authorized group.\n"
-        "/remove_group <GROUP_ID> - Removes an authorized group.\n"
+        "/list_groups [TEXT] - Lists authorized groups, or those whose name or ID contains TEXT.\n"
+        "/add_group <GROUP_ID> [GROUP_ID ...] - Adds authorized groups.\n"
+        "/remove_group <GROUP_ID> [GROUP_ID ...] - Removes authorized groups.\n"
+        "/list_attempts - Lists unauthorized attempts, newest first.\n"
+        "/attempt_stats - Shows who adds the bot to unauthorized groups most often.\n"
+        "/queue - Shows incoming update and outbound message queue statistics.\n"
+        "/cache - Shows URL cache statistics.\n"
+        "/stats [SECONDS] - Measures throughput, handlers in flight, event-loop lag and time spent per stage.\n"
+        "/profile [SECONDS] [file] - Profiles the running bot and sends the busiest functions.\n"
+        "/mappings - Shows the active domain mappings version.\n"
+        "/group_mappings <GROUP_ID> - Shows a group's mapping overrides.\n"
+        "/set_mapping <GROUP_ID> <DOMAIN> <REPLACEMENT|off> - Overrides a mapping in one group.\n"
+        "/reset_mapping <GROUP_ID> [DOMAIN] - Removes a group's overrides.\n"
         "/help - Displays this help message.\n"
     )
     await send_response(update, response)
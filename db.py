@@ -1,54 +1,392 @@
-from pymongo import MongoClient
 import os
+import asyncio
 import logging
-from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from lru_cache import LRUCache
+from metrics import STAGE_LATENCY
+from storage import create_storage
 
 logger = logging.getLogger(__name__)
 
-# MongoDB connection
-client = MongoClient(os.getenv("MONGO_URI"))
-db = client[os.getenv("DB_NAME")]
+# Number of threads (and pooled connections) available for database calls
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+
+# Where groups and attempts are kept: "mongodb" (default), "sqlite" or "memory"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongodb").lower()
+
+# The storage backend, created by get_storage on first use so importing this module does no I/O
+storage = None
+_storage_lock = threading.Lock()
+
+# Blocking storage calls run here instead of on the event loop
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="db")
+
+# In-memory registry of authorized group IDs, so the per-message check needs no I/O
+_allowed_groups = set()
+
+# Per-group mapping overrides, also kept in memory: chat_id -> {domain: replacement, or None
+# to turn rewriting of that domain off}. A group's dict is replaced, never mutated, on change
+_group_overrides = {}
+
+# Guards registry updates. Changes this process makes while load_allowed_groups is reading
+# the database are also recorded in each reload's list and replayed over what it read
+_registry_lock = threading.Lock()
+_reloads = []
+_UNCHANGED = object()
+
+# Serializes the read-modify-write of a group's overrides, so concurrent edits are not lost
+_overrides_lock = threading.Lock()
+
+# Users seen posting in authorized groups, for features open to their members (inline mode):
+# user_id -> set of chat_ids. Kept in memory only, for the MEMBER_CACHE_SIZE most recent users
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", "100000"))
+MEMBER_CACHE_TTL = int(float(os.getenv("MEMBER_CACHE_TTL_DAYS", "30")) * 86400)
+_known_members = LRUCache(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL)
+
+# Unauthorized attempts are queued here and written in bulk: every ATTEMPT_FLUSH_INTERVAL
+# seconds, once ATTEMPT_BATCH_SIZE are waiting, before they are read and at shutdown.
+# If writes keep failing, at most ATTEMPT_BUFFER_MAX are kept (the oldest are dropped)
+ATTEMPT_FLUSH_INTERVAL = float(os.getenv("ATTEMPT_FLUSH_INTERVAL", "5"))
+ATTEMPT_BATCH_SIZE = int(os.getenv("ATTEMPT_BATCH_SIZE", "100"))
+ATTEMPT_BUFFER_MAX = 10000
+_pending_attempts = []
+_pending_lock = threading.Lock()
+
+# Background flushes started by full batches, kept referenced until they finish
+_flush_tasks = set()
+
+# Seconds unauthorized attempts are kept (0 keeps them forever)
+ATTEMPTS_RETENTION = int(float(os.getenv("ATTEMPTS_RETENTION_DAYS", "90")) * 86400)
+
+# Callbacks run after this process changes the authorized groups (e.g. to notify other workers)
+_group_listeners = []
+
+# Callbacks run with (chat_id, user_id) when this process sees a user in a group for the first time
+_member_listeners = []
+
+def get_storage():
+    """Returns the storage backend selected by STORAGE_BACKEND, creating it the first time."""
+    global storage
+    if storage is None:
+        with _storage_lock:
+            if storage is None:
+                options = {"attempts_retention": ATTEMPTS_RETENTION}
+                if STORAGE_BACKEND == "mongodb":
+                    options.update(uri=os.getenv("MONGO_URI"), db_name=os.getenv("DB_NAME"), max_pool_size=DB_MAX_WORKERS)
+                elif STORAGE_BACKEND == "sqlite":
+                    options.update(path=os.getenv("SQLITE_PATH", "data/bot.db"))
+                storage = create_storage(STORAGE_BACKEND, **options)
+                logger.info("Using the %s storage backend.", STORAGE_BACKEND)
+    return storage
+
+def ping():
+    """Checks that the storage backend answers; raises otherwise."""
+    get_storage().ping()
 
 def create_database():
-    """Ensures the collection exists."""
-    if "groups" not in db.list_collection_names():
-        db.create_collection("groups")
-        logger.info("Database initialized.")
+    """Creates the tables and indexes the bot relies on."""
+    get_storage().create_database()
+    logger.info("Database initialized.")
+
+def close_storage():
+    """Closes the storage backend's connections, if it was ever opened."""
+    if storage is not None:
+        storage.close()
+
+def _apply_change(allowed_groups, group_overrides, chat_id, allowed, overrides):
+    if allowed is True:
+        allowed_groups.add(chat_id)
+    elif allowed is False:
+        allowed_groups.discard(chat_id)
+        group_overrides.pop(chat_id, None)
+    if overrides is not _UNCHANGED:
+        if overrides:
+            group_overrides[chat_id] = overrides
+        else:
+            group_overrides.pop(chat_id, None)
+
+def _update_registry(chat_ids, allowed=None, overrides=_UNCHANGED):
+    """Applies a change this process wrote to the database to the registry, and to any reload in progress."""
+    with _registry_lock:
+        for chat_id in chat_ids:
+            change = (chat_id, allowed, overrides)
+            for changes in _reloads:
+                changes.append(change)
+            _apply_change(_allowed_groups, _group_overrides, *change)
 
 def add_group(chat_id, chat_name):
     """Adds a group to the database."""
-    db.groups.update_one(
-        {"_id": str(chat_id)},
-        {"$set": {"name": chat_name}},
-        upsert=True
-    )
+    get_storage().add_group(str(chat_id), chat_name)
+    _update_registry([str(chat_id)], allowed=True)
+    _notify_group_listeners()
 
 def remove_group(chat_id):
     """Removes a group from the database."""
-    result = db.groups.delete_one({"_id": str(chat_id)})
-    if result.deleted_count > 0:
-        logger.info(f"Group removed from the database: {chat_id}")
+    deleted = get_storage().remove_group(str(chat_id))
+    _update_registry([str(chat_id)], allowed=False)
+    _notify_group_listeners()
+    if deleted:
+        logger.info("Group removed from the database: %s", chat_id)
     else:
-        logger.warning(f"Group with ID {chat_id} not found in the database.")
+        logger.warning("Group with ID %s not found in the database.", chat_id)
+
+def add_groups(groups):
+    """Adds many groups ({chat_id: name}) to the database in one bulk write."""
+    groups = {str(chat_id): chat_name for chat_id, chat_name in groups.items()}
+    get_storage().add_groups(groups)
+    _update_registry(groups, allowed=True)
+    _notify_group_listeners()
+
+def remove_groups(chat_ids):
+    """Removes many groups from the database in one bulk write; returns how many were found."""
+    chat_ids = [str(chat_id) for chat_id in chat_ids]
+    removed = get_storage().remove_groups(chat_ids)
+    _update_registry(chat_ids, allowed=False)
+    _notify_group_listeners()
+    logger.info("Removed %s of %s groups from the database.", removed, len(chat_ids))
+    return removed
 
 def get_all_groups():
     """Retrieves all groups from the database."""
-    return list(db.groups.find({}, {"_id": 1, "name": 1}))
+    return get_storage().get_all_groups()
+
+def get_groups(limit=20, cursor=None, search=None):
+    """Returns a page of groups ordered by ID, optionally filtered by name or ID, and the cursor of the next page (or None)."""
+    return get_storage().get_groups(limit, cursor, search)
+
+def add_group_listener(callback):
+    """Registers a callback to run whenever add_group or remove_group changes the groups."""
+    _group_listeners.append(callback)
+
+def _notify_group_listeners():
+    for callback in _group_listeners:
+        try:
+            callback()
+        except Exception as e:
+            logger.error("Error notifying group listener: %s", e)
+
+def load_allowed_groups():
+    """Loads the authorized group IDs and their mapping overrides from the database into memory."""
+    global _allowed_groups, _group_overrides
+    changes = []
+    with _registry_lock:
+        _reloads.append(changes)
+    try:
+        groups = get_storage().load_groups()
+        # Build the new registry first and swap it in, so readers never see a partial one.
+        # Groups added or removed here during the read may be missing from it: replay them
+        allowed_groups = set(groups)
+        group_overrides = {chat_id: overrides for chat_id, overrides in groups.items() if overrides}
+        with _registry_lock:
+            for change in changes:
+                _apply_change(allowed_groups, group_overrides, *change)
+            _allowed_groups = allowed_groups
+            _group_overrides = group_overrides
+    finally:
+        with _registry_lock:
+            _reloads.remove(changes)
+    return len(allowed_groups)
+
+async def resync_allowed_groups(interval):
+    """Periodically reloads the registry to pick up changes made outside the bot."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            count = await _run_in_executor(load_allowed_groups)
+            logger.debug("Authorized groups resynced: %s groups.", count)
+        except Exception as e:
+            logger.error("Error resyncing authorized groups: %s", e)
 
 def is_group_allowed(chat_id):
-    """Checks if a group is in the database."""
-    return db.groups.count_documents({"_id": str(chat_id)}) > 0
+    """Checks if a group is authorized using the in-memory registry."""
+    return str(chat_id) in _allowed_groups
+
+def add_member_listener(callback):
+    """Registers a callback to run whenever remember_member records a new membership."""
+    _member_listeners.append(callback)
+
+def remember_member(chat_id, user_id, notify=True):
+    """
+    Records that a user posted in an authorized group. Member listeners are told
+    about memberships not known yet, unless notify is False (e.g. for one
+    received from another worker).
+    """
+    chats = _known_members.get(user_id)
+    if chats is None:
+        _known_members.set(user_id, {str(chat_id)})
+    elif str(chat_id) in chats:
+        return
+    else:
+        chats.add(str(chat_id))
+    if notify:
+        for callback in _member_listeners:
+            try:
+                callback(chat_id, user_id)
+            except Exception as e:
+                logger.error("Error notifying member listener: %s", e)
+
+def is_known_member(user_id) -> bool:
+    """Checks, without I/O, whether a user was seen in a group that is still authorized."""
+    chats = _known_members.get(user_id)
+    return bool(chats) and not _allowed_groups.isdisjoint(chats)
+
+def get_group_overrides(chat_id):
+    """Returns a group's mapping overrides from memory, or None if it has none."""
+    return _group_overrides.get(str(chat_id))
+
+def _save_group_overrides(chat_id, overrides):
+    get_storage().save_group_overrides(str(chat_id), overrides)
+    _update_registry([str(chat_id)], overrides=overrides)
+    _notify_group_listeners()
+
+def set_group_override(chat_id, domain, replacement):
+    """Maps a domain to a different replacement in one group; None turns its rewriting off there."""
+    with _overrides_lock:
+        overrides = dict(_group_overrides.get(str(chat_id), {}))
+        overrides[domain.lower()] = replacement.lower() if replacement else None
+        _save_group_overrides(chat_id, overrides)
+
+def clear_group_override(chat_id, domain=None):
+    """Removes one domain's override in a group, or all of them if no domain is given."""
+    with _overrides_lock:
+        overrides = dict(_group_overrides.get(str(chat_id), {}))
+        if domain is None:
+            overrides.clear()
+        else:
+            overrides.pop(domain.lower(), None)
+        _save_group_overrides(chat_id, overrides)
 
 def log_unauthorized_group(chat_id, chat_name, added_by_id, added_by_name):
-    """Logs an unauthorized attempt to add the bot to a group."""
-    db.unauthorized_groups.insert_one({
-        "chat_id": chat_id,
-        "chat_name": chat_name,
-        "added_by_id": added_by_id,
-        "added_by_name": added_by_name,
-        "timestamp": datetime.now()
-    })
-
-def get_unauthorized_attempts():
-    """Retrieves all logged unauthorized attempts."""
-    return list(db.unauthorized_groups.find({}, {"_id": 0}))
+    """Queues an unauthorized attempt to add the bot to a group; returns whether a full batch is waiting."""
+    with _pending_lock:
+        _pending_attempts.append({
+            "chat_id": chat_id,
+            "chat_name": chat_name,
+            "added_by_id": added_by_id,
+            "added_by_name": added_by_name,
+            "timestamp": datetime.now(timezone.utc)
+        })
+        del _pending_attempts[:-ATTEMPT_BUFFER_MAX]
+        return len(_pending_attempts) >= ATTEMPT_BATCH_SIZE
+
+def flush_unauthorized_attempts():
+    """Writes the queued unauthorized attempts in one bulk insert; returns how many were written."""
+    global _pending_attempts
+    with _pending_lock:
+        batch, _pending_attempts = _pending_attempts, []
+    if not batch:
+        return 0
+    try:
+        get_storage().log_unauthorized_groups(batch)
+    except Exception:
+        # Put them back in front of any queued meanwhile, for the next flush to retry
+        with _pending_lock:
+            _pending_attempts[:0] = batch
+            del _pending_attempts[:-ATTEMPT_BUFFER_MAX]
+        raise
+    return len(batch)
+
+async def flush_unauthorized_attempts_periodically(interval):
+    """Flushes the queued unauthorized attempts every `interval` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        await _flush_in_background()
+
+async def _flush_in_background():
+    try:
+        count = await flush_unauthorized_attempts_async()
+        if count:
+            logger.debug("Wrote %s unauthorized attempts.", count)
+    except Exception as e:
+        logger.error("Error writing unauthorized attempts: %s", e)
+
+def get_unauthorized_attempts(limit=10, cursor=None):
+    """Returns a page of unauthorized attempts, newest first, and the cursor of the next page (or None)."""
+    flush_unauthorized_attempts()
+    return get_storage().get_unauthorized_attempts(limit, cursor)
+
+def count_unauthorized_attempts(by, limit=10):
+    """Counts unauthorized attempts per adder ("added_by") or per group ("chat"), computed by the database."""
+    flush_unauthorized_attempts()
+    return get_storage().count_unauthorized_attempts(by, limit)
+
+async def _run_in_executor(func, *args, **kwargs):
+    """Runs a blocking database function in the bounded executor."""
+    loop = asyncio.get_running_loop()
+    with STAGE_LATENCY.time(stage=f"db.{func.__name__}"):
+        return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+async def ping_async():
+    """Awaitable version of ping."""
+    return await _run_in_executor(ping)
+
+async def create_database_async():
+    """Awaitable version of create_database."""
+    return await _run_in_executor(create_database)
+
+async def close_storage_async():
+    """Awaitable version of close_storage."""
+    return await _run_in_executor(close_storage)
+
+async def load_allowed_groups_async():
+    """Awaitable version of load_allowed_groups."""
+    return await _run_in_executor(load_allowed_groups)
+
+async def add_group_async(chat_id, chat_name):
+    """Awaitable version of add_group."""
+    return await _run_in_executor(add_group, chat_id, chat_name)
+
+async def remove_group_async(chat_id):
+    """Awaitable version of remove_group."""
+    return await _run_in_executor(remove_group, chat_id)
+
+async def add_groups_async(groups):
+    """Awaitable version of add_groups."""
+    return await _run_in_executor(add_groups, groups)
+
+async def remove_groups_async(chat_ids):
+    """Awaitable version of remove_groups."""
+    return await _run_in_executor(remove_groups, chat_ids)
+
+async def get_all_groups_async():
+    """Awaitable version of get_all_groups."""
+    return await _run_in_executor(get_all_groups)
+
+async def get_groups_async(limit=20, cursor=None, search=None):
+    """Awaitable version of get_groups."""
+    return await _run_in_executor(get_groups, limit, cursor, search)
+
+async def set_group_override_async(chat_id, domain, replacement):
+    """Awaitable version of set_group_override."""
+    return await _run_in_executor(set_group_override, chat_id, domain, replacement)
+
+async def clear_group_override_async(chat_id, domain=None):
+    """Awaitable version of clear_group_override."""
+    return await _run_in_executor(clear_group_override, chat_id, domain)
+
+async def log_unauthorized_group_async(chat_id, chat_name, added_by_id, added_by_name):
+    """Queues the attempt without waiting for the database; a full batch is written in the background."""
+    if log_unauthorized_group(chat_id, chat_name, added_by_id, added_by_name):
+        task = asyncio.create_task(_flush_in_background())
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+
+async def flush_unauthorized_attempts_async():
+    """Awaitable version of flush_unauthorized_attempts."""
+    return await _run_in_executor(flush_unauthorized_attempts)
+
+async def wait_for_background_flushes():
+    """Waits for the batch writes started by log_unauthorized_group_async (at shutdown, before closing the storage)."""
+    if _flush_tasks:
+        await asyncio.gather(*list(_flush_tasks), return_exceptions=True)
+
+async def get_unauthorized_attempts_async(limit=10, cursor=None):
+    """Awaitable version of get_unauthorized_attempts."""
+    return await _run_in_executor(get_unauthorized_attempts, limit, cursor)
+
+async def count_unauthorized_attempts_async(by, limit=10):
+    """Awaitable version of count_unauthorized_attempts."""
+    return await _run_in_executor(count_unauthorized_attempts, by, limit)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from metrics import EVENT_LOOP_LAG, HANDLERS_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up from a short sleep every `interval`
+    seconds. The delay is time the loop spent blocked by some callback (a handler
+    doing CPU-heavy or blocking work), so every other update waited that long too.
+    Lags over `threshold` seconds are logged as warnings with the handlers running.
+    """
+
+    def __init__(self, interval: float = 0.5, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            EVENT_LOOP_LAG.observe(lag)
+            if lag > self.threshold:
+                running = ", ".join(f"{key[0]} x{count}" for key, count in sorted(HANDLERS_IN_FLIGHT.values().items())) or "none"
+                logger.warning(
+                    "Event loop blocked for %.3fs (threshold %.3fs); handlers running: %s.", lag, self.threshold, running,
+                    extra={"latency": round(lag, 6), "rate_limited": True},
+                )
+
+def _is_idle(frame) -> bool:
+    # An idle event loop sits in the selector waiting for I/O
+    filename, _, name = frame
+    return name == "select" and filename.endswith("selectors.py")
+
+def _label(frame) -> str:
+    filename, line, name = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the running bot: a background thread records the
+    stack of one thread (by default the one creating the profiler, i.e. the event
+    loop's) every `interval` seconds. Nothing is instrumented, so handlers run at
+    full speed apart from the brief sampling pauses. Samples taken while the loop
+    waits for I/O are counted as idle.
+    """
+
+    def __init__(self, interval: float = 0.01, thread_id: int = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples = 0
+        self.idle = 0
+        self.started_at = None
+        self.duration = 0.0
+        # Stack as (filename, first line, function) frames, outermost first -> samples
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self.duration = time.monotonic() - self.started_at
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            self.samples += 1
+            if _is_idle(stack[0]):
+                self.idle += 1
+            else:
+                self._stacks[tuple(reversed(stack))] += 1
+
+    def top(self, limit: int = 15, cumulative: bool = False) -> list:
+        """
+        The functions seen most often as (label, samples): where the thread was
+        running, or with cumulative=True, also those waiting on their callees.
+        """
+        counts = Counter()
+        for stack, samples in self._stacks.items():
+            if cumulative:
+                for frame in set(stack):
+                    counts[frame] += samples
+            else:
+                counts[stack[-1]] += samples
+        return [(_label(frame), samples) for frame, samples in counts.most_common(limit)]
+
+    def report(self, limit: int = 15) -> str:
+        """The busiest functions, as text for the admin chat."""
+        busy = self.samples - self.idle
+        lines = [f"Profile of {self.duration:.1f}s: {self.samples} samples, {self.idle / self.samples:.0%} idle." if self.samples else "Profile: no samples taken."]
+        if busy:
+            for title, cumulative in (("Busiest functions (own time):", False), ("Including the functions they call:", True)):
+                lines.append("")
+                lines.append(title)
+                lines.extend(f"{samples / busy:6.1%} {label}" for label, samples in self.top(limit, cumulative))
+        return "\n".join(lines)
+
+    def folded(self) -> str:
+        """Busy stacks in the folded format read by flamegraph.pl and speedscope."""
+        return "".join(
+            ";".join(f"{os.path.basename(filename)}:{name}" for filename, _, name in stack) + f" {samples}\n"
+            for stack, samples in self._stacks.most_common()
+        )
@@ -0,0 +1,48 @@
+import time
+from collections import deque
+
+class DuplicateWindow:
+    """
+    Remembers which links were corrected in each chat during the last `window`
+    seconds. Entries are grouped in time buckets, so expiring them means dropping
+    whole buckets instead of scanning every entry, and memory stays bounded by
+    `max_entries` however many groups are active.
+    """
+
+    def __init__(self, window: float, buckets: int = 6, max_entries: int = 100000):
+        self.window = window
+        self._width = window / buckets
+        self._bucket_capacity = max(1, max_entries // buckets)
+        # (bucket number, {(chat_id, url): (message_id, timestamp)}), oldest first
+        self._buckets = deque()
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self._buckets)
+
+    def _expire(self, now):
+        oldest_live = int((now - self.window) // self._width)
+        while self._buckets and self._buckets[0][0] < oldest_live:
+            self._buckets.popleft()
+
+    def get(self, chat_id, url, now=None):
+        """Returns the ID of the message that corrected this link in the chat within the window, or None."""
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        key = (chat_id, url)
+        for _, entries in reversed(self._buckets):
+            entry = entries.get(key)
+            if entry is not None:
+                return entry[0] if now - entry[1] <= self.window else None
+        return None
+
+    def add(self, chat_id, url, message_id, now=None):
+        """Records that a message corrected this link in the chat."""
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        number = int(now // self._width)
+        if not self._buckets or self._buckets[-1][0] != number:
+            self._buckets.append((number, {}))
+        entries = self._buckets[-1][1]
+        # A full bucket drops new entries: those links just are not deduplicated
+        if len(entries) < self._bucket_capacity:
+            entries[(chat_id, url)] = (message_id, now)
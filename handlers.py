@@ -1,101 +1,242 @@
 import logging
+import os
 import re
-import json
+import time
 from urllib.parse import urlparse, urlunparse
-from telegram import Update, Chat, MessageEntity
+from telegram import Update, Chat, MessageEntity, ReplyParameters, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
 from telegram.ext import CallbackContext
-from db import is_group_allowed, add_group, log_unauthorized_group, remove_group
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from mappings import merge_mappings, DomainIndex
+from lru_cache import LRUCache
+from duplicate_window import DuplicateWindow
+from media_groups import MediaGroupBuffer
+from metrics import instrument_handler, STAGE_LATENCY, REWRITES
+from message_renderer import LinkSpan, utf16_len, utf16_to_index, render_markdown, render_entities, replace_links
+from db import is_group_allowed, remember_member, get_group_overrides, add_group_listener, add_group_async, log_unauthorized_group_async, remove_group_async
 
 logger = logging.getLogger(__name__)
 
-# Load domain mappings from the configuration file
-with open("config/mappings.json", "r") as f:
-    DOMAIN_MAPPINGS = json.load(f)
+# Domain mappings compiled for fast lookups. Empty until the application loads
+# config/mappings.json at startup (see MappingsWatcher.load) and calls apply_mappings
+DOMAIN_MAPPINGS = {}
+DOMAIN_INDEX = DomainIndex(DOMAIN_MAPPINGS)
+MAPPINGS_VERSION = DOMAIN_INDEX.version
+MAPPINGS_LOADED_AT = None
 
-def escape_markdown_v2(text: str) -> str:
+# Fallback scanner for messages that arrive without entities
+URL_PATTERN = re.compile(r"(https?://[^\s]+)")
+
+# Entity types that carry links: visible URLs and links hidden behind text
+LINK_ENTITY_TYPES = [MessageEntity.URL, MessageEntity.TEXT_LINK]
+
+# How corrections are formatted: "markdown" (MarkdownV2) or "entities" (plain text with
+# explicit entities, which Telegram never has to parse)
+MESSAGE_FORMAT = os.getenv("MESSAGE_FORMAT", "markdown").lower()
+
+# Cache of normalized URLs: entries kept, seconds each stays valid, and the longest URL worth caching
+URL_CACHE_SIZE = int(os.getenv("URL_CACHE_SIZE", "4096"))
+URL_CACHE_TTL = int(os.getenv("URL_CACHE_TTL", "3600"))
+URL_CACHE_MAX_LENGTH = int(os.getenv("URL_CACHE_MAX_LENGTH", "512"))
+URL_CACHE = LRUCache(URL_CACHE_SIZE, URL_CACHE_TTL)
+
+# Longest a message waits for its short links to be resolved, in seconds
+SHORT_LINK_BUDGET = float(os.getenv("SHORT_LINK_BUDGET", "1.5"))
+
+# Repeats of a link corrected in the same chat less than DUPLICATE_WINDOW seconds ago (0 turns
+# this off) are not re-posted: DUPLICATE_ACTION "reply" answers the repeat with a pointer to the earlier
+# correction (one API call), "replace" deletes the repeat and replies to the earlier correction, "skip" ignores it
+DUPLICATE_ACTIONS = ("reply", "replace", "skip")
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", "0"))
+DUPLICATE_ACTION = os.getenv("DUPLICATE_ACTION", "reply").lower()
+DUPLICATE_MAX_ENTRIES = int(os.getenv("DUPLICATE_MAX_ENTRIES", "100000"))
+RECENT_LINKS = DuplicateWindow(DUPLICATE_WINDOW, max_entries=DUPLICATE_MAX_ENTRIES) if DUPLICATE_WINDOW > 0 else None
+
+# Seconds to wait for more parts of an album before correcting it as a whole (0 handles each part alone)
+MEDIA_GROUP_DELAY = float(os.getenv("MEDIA_GROUP_DELAY", "1.0"))
+
+# Telegram's limit for media captions, in UTF-16 units of the text shown; longer corrections
+# are sent as a reply instead
+MAX_CAPTION_LENGTH = 1024
+
+# Seconds a cached bot permission is trusted before asking Telegram again
+PERMISSION_CACHE_TTL = int(os.getenv("PERMISSION_CACHE_TTL", "600"))
+
+# Compiled mappings of groups with overrides: chat_id -> (overrides, global index, merged index)
+_chat_indexes = {}
+
+# Cache of whether the bot can delete messages, per chat: chat_id -> (can_delete, expires_at)
+_bot_permissions = {}
+
+def apply_mappings(mappings: dict, index: DomainIndex = None):
     """
-    Escape special characters for MarkdownV2 in Telegram.
+    Replaces the domain mappings in use, dropping URLs normalized with the old ones.
+    Pass a prebuilt index to keep compiling it off the event loop.
     """
-    # Characters that need to be escaped in MarkdownV2
-    escape_chars = '_*[]()~`>#+-=|{}.!'
-    
-    result = ""
-    for char in text:
-        if char in escape_chars:
-            result += "\\" + char
-        else:
-            result += char
-    
-    return result
-
-def format_message_with_links(text: str, url_mappings: dict) -> tuple:
-    """
-    Format message with proper MarkdownV2 escaping, separating text from links.
-    Returns a tuple of (quoted_text, links_text)
-    """
-    # Remove URLs from the text to get just the message
-    clean_text = text
-    for old_url in url_mappings:
-        clean_text = clean_text.replace(old_url, '').strip()
-    
-    # Escape and quote the clean text
-    escaped_text = escape_markdown_v2(clean_text)
-    quoted_text = f'"{escaped_text}"' if clean_text else ''
-    
-    # Create the links part
-    links = []
-    for old_url, new_url in url_mappings.items():
-        links.append(f"[Modified link]({new_url})")
-    
-    links_text = '\n'.join(links)
-    
-    return quoted_text, links_text
-
-def normalize_url(url: str) -> str:
-    """
-    Normalizes a URL by replacing its domain with a preferred one from the DOMAIN_MAPPINGS.
-    It handles subdomains and preserves the rest of the URL structure.
+    global DOMAIN_MAPPINGS, DOMAIN_INDEX, MAPPINGS_VERSION, MAPPINGS_LOADED_AT
+    # Plain assignments with no await in between: a message is always handled with one table
+    DOMAIN_MAPPINGS = mappings
+    DOMAIN_INDEX = index if index is not None else DomainIndex(mappings)
+    MAPPINGS_VERSION = DOMAIN_INDEX.version
+    MAPPINGS_LOADED_AT = time.time()
+    URL_CACHE.clear()
+    _chat_indexes.clear()
+    logger.info("Domain mappings loaded: %s domains, version %s.", len(mappings), MAPPINGS_VERSION)
+
+def mappings_for_chat(chat_id) -> DomainIndex:
+    """
+    Returns the compiled mappings to use in a chat: DOMAIN_INDEX, or the global mappings
+    merged with the group's overrides, compiled once and kept in _chat_indexes.
+    """
+    overrides = get_group_overrides(chat_id)
+    if not overrides:
+        _chat_indexes.pop(chat_id, None)
+        return DOMAIN_INDEX
+    entry = _chat_indexes.get(chat_id)
+    # Entries are keyed on the overrides' content: a resync replaces every group's dict
+    # with an equal one, which must not recompile them all
+    if entry is None or entry[1] is not DOMAIN_INDEX or (entry[0] is not overrides and entry[0] != overrides):
+        entry = (overrides, DOMAIN_INDEX, DomainIndex(merge_mappings(DOMAIN_MAPPINGS, overrides)))
+        _chat_indexes[chat_id] = entry
+    return entry[2]
+
+def forget_chat_indexes():
+    """Drops the compiled mappings of groups that were removed or lost their overrides."""
+    # Listeners run in database threads while the event loop may be adding entries
+    for chat_id in list(_chat_indexes):
+        if not get_group_overrides(chat_id):
+            _chat_indexes.pop(chat_id, None)
+
+# Runs after this process removes a group or changes its overrides
+add_group_listener(forget_chat_indexes)
+
+def normalize_url(url: str, index: DomainIndex = None) -> str:
+    """
+    Normalizes a URL by replacing its domain with a preferred one from the DOMAIN_MAPPINGS
+    (or the given index, for groups with their own mappings). It handles subdomains and
+    preserves the rest of the URL structure. The longest registered domain wins. Results
+    are kept in URL_CACHE, since the same links are often posted in many groups.
     """
+    if index is None:
+        index = DOMAIN_INDEX
+    if len(url) > URL_CACHE_MAX_LENGTH:
+        new_url, matched_domain = _normalize_url(url, index)
+    else:
+        key = url if index is DOMAIN_INDEX else (index.version, url)
+        cached = URL_CACHE.get(key)
+        if cached is None:
+            cached = _normalize_url(url, index)
+            URL_CACHE.set(key, cached)
+        new_url, matched_domain = cached
+    if matched_domain:
+        REWRITES.inc(domain=matched_domain)
+    return new_url
+
+def _normalize_url(url: str, index: DomainIndex) -> tuple:
+    """Does the work of normalize_url; returns (normalized URL, mapped domain that matched or None)."""
     try:
-        parsed_url = urlparse(url)
+        # Scheme-less links such as "x.com/foo" are marked as url entities by Telegram too
+        parsed_url = urlparse(url if "://" in url else "https://" + url)
         hostname = parsed_url.hostname
 
         if not hostname:
-            return url
-
-        for original_domain, replacement_domain in DOMAIN_MAPPINGS.items():
-            if hostname.endswith(original_domain) and not hostname.endswith(replacement_domain):
-                # Replace the domain and keep subdomains
-                # Check if hostname is exactly the original domain or has a subdomain
-                if hostname == original_domain:
-                    new_hostname = replacement_domain
-                elif hostname.endswith('.' + original_domain):
-                    # Extract subdomain and append to replacement domain
-                    subdomain = hostname[:-len(original_domain)-1]
-                    new_hostname = subdomain + '.' + replacement_domain
-                else:
-                    # This means the domain is part of a larger domain name (e.g., "x.com" in "dominiox.com")
-                    # So we skip this mapping
-                    continue
-                # Reconstruct the netloc to include credentials or port if they exist
-                netloc_parts = [new_hostname]
-                if parsed_url.port:
-                    netloc_parts.append(str(parsed_url.port))
-                new_netloc = ":".join(netloc_parts)
-                if parsed_url.username:
-                    userinfo = parsed_url.username
-                    if parsed_url.password:
-                        userinfo += ":" + parsed_url.password
-                    new_netloc = f"{userinfo}@{new_netloc}"
-                
-                return urlunparse(parsed_url._replace(netloc=new_netloc))
-
-        return url  # Return original URL if no mapping is found
+            return url, None
+
+        new_hostname, matched_domain = index.lookup(hostname)
+        if new_hostname:
+            # Reconstruct the netloc to include credentials or port if they exist
+            netloc_parts = [new_hostname]
+            if parsed_url.port:
+                netloc_parts.append(str(parsed_url.port))
+            new_netloc = ":".join(netloc_parts)
+            if parsed_url.username:
+                userinfo = parsed_url.username
+                if parsed_url.password:
+                    userinfo += ":" + parsed_url.password
+                new_netloc = f"{userinfo}@{new_netloc}"
+
+            return urlunparse(parsed_url._replace(netloc=new_netloc)), matched_domain
+
+        return url, None  # Return original URL if no mapping is found
 
     except Exception as e:
-        logger.error(f"Error normalizing URL {url}: {e}")
-        return url
+        logger.error("Error normalizing URL %s: %s", url, e)
+        return url, None
+
+def message_content(message) -> tuple:
+    """The text of a message, or the caption of a media message, with its entities."""
+    if message.text is not None:
+        return message.text, message.entities
+    return message.caption, message.caption_entities
+
+def extract_links(message, index: DomainIndex = None, resolver=None) -> list:
+    """
+    Returns the links in a message (or its caption) as LinkSpans. Telegram already
+    delivers them as url and text_link entities; the URL_PATTERN scanner is only used
+    for messages without entities. Messages whose text (and hidden text_link URLs)
+    mention no mapped domain, nor a short-link host when a resolver is given, are
+    skipped before any UTF-16 conversion or scanning.
+    """
+    text, message_entities = message_content(message)
+    if not text:
+        return []
+    if index is None:
+        index = DOMAIN_INDEX
+    candidates = [text] + [entity.url for entity in message_entities or () if entity.type == MessageEntity.TEXT_LINK]
+    if not any(index.mentions_mapped_domain(candidate) or (resolver and resolver.mentions_short_link(candidate)) for candidate in candidates):
+        return []
+    if message_entities:
+        entities = sorted((entity for entity in message_entities if entity.type in LINK_ENTITY_TYPES), key=lambda entity: entity.offset)
+        bounds = utf16_to_index(text, [point for entity in entities for point in (entity.offset, entity.offset + entity.length)])
+        links = []
+        for i, entity in enumerate(entities):
+            start, end = bounds[2 * i], bounds[2 * i + 1]
+            if entity.type == MessageEntity.TEXT_LINK:
+                links.append(LinkSpan(start, end, entity.url, inline=False))
+            else:
+                links.append(LinkSpan(start, end, text[start:end]))
+        return links
+    return [LinkSpan(match.start(), match.end(), match.group()) for match in URL_PATTERN.finditer(text)]
+
+def render_correction(text: str, links: list, url_mappings: dict, sender=None) -> dict:
+    """Keyword arguments for sending a correction, formatted according to MESSAGE_FORMAT."""
+    if MESSAGE_FORMAT == "entities":
+        corrected_text, entities = render_entities(text, links, url_mappings, sender)
+        return {"text": corrected_text, "entities": entities}
+    return {"text": render_markdown(text, links, url_mappings, sender), "parse_mode": "MarkdownV2"}
+
+def caption_length(text: str, links: list, url_mappings: dict, sender=None) -> int:
+    """Length of a correction as Telegram counts it against the caption limit: without markup, in UTF-16 units."""
+    visible_text, _ = render_entities(text, links, url_mappings, sender)
+    return utf16_len(visible_text)
+
+def cache_bot_permissions(chat_id: str, chat_member) -> bool:
+    """Stores the bot's delete permission for a chat from a ChatMember object."""
+    # Only administrators expose can_delete_messages; plain members cannot delete
+    can_delete = bool(getattr(chat_member, "can_delete_messages", False))
+    _bot_permissions[str(chat_id)] = (can_delete, time.monotonic() + PERMISSION_CACHE_TTL)
+    return can_delete
+
+def invalidate_bot_permissions(chat_id: str):
+    """Forgets the cached permissions for a chat."""
+    _bot_permissions.pop(str(chat_id), None)
+
+def is_permission_error(error: Exception) -> bool:
+    """Tells whether a Telegram error means the bot is not allowed to delete a message."""
+    return isinstance(error, Forbidden) or "not enough rights" in str(error).lower()
+
+def is_undeletable_error(error: Exception) -> bool:
+    """Tells whether Telegram refused to delete this one message (older than 48 hours, or a service message)."""
+    return "can't be deleted" in str(error).lower()
 
+async def bot_can_delete_messages(context: CallbackContext, chat_id: str) -> bool:
+    """Returns whether the bot can delete messages in a chat, calling Telegram only on a cache miss."""
+    entry = _bot_permissions.get(str(chat_id))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    chat_member = await context.bot.get_chat_member(chat_id, context.bot.id)
+    return cache_bot_permissions(chat_id, chat_member)
+
+@instrument_handler
 async def handle_group_join(update: Update, context: CallbackContext):
     """Handles the bot being added or removed from a group."""
     chat = update.effective_chat
@@ -106,109 +247,273 @@ async def handle_group_join(update: Update, context: CallbackContext):
     new_status = update.my_chat_member.new_chat_member.status
     old_status = update.my_chat_member.old_chat_member.status
 
+    # Promotions and demotions arrive here, so keep the permission cache current
+    if new_status in ["kicked", "left"]:
+        invalidate_bot_permissions(chat_id)
+    else:
+        cache_bot_permissions(chat_id, update.my_chat_member.new_chat_member)
+
     if new_status == "member":  # Bot added
         if is_group_allowed(chat_id):
-            logger.info(f"Bot is already authorized in group: {chat_name} (ID: {chat_id}).")
+            logger.info("Bot is already authorized in group: %s (ID: %s).", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "handle_group_join"})
         else:
             if added_or_removed_by.id == context.bot_data["admin_id"]:
-                logger.info(f"Admin added bot to group: {chat_name} (ID: {chat_id}). Automatically registering...")
-                add_group(chat_id, chat_name)
+                logger.info("Admin added bot to group: %s (ID: %s). Automatically registering...", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "handle_group_join"})
+                await add_group_async(chat_id, chat_name)
                 await context.bot.send_message(
                     chat_id=chat_id,
                     text=f"The group '{chat_name}' (ID: {chat_id}) has been automatically registered."
                 )
+                return "registered"
             else:
-                log_unauthorized_group(
+                await log_unauthorized_group_async(
                     chat_id=chat_id,
                     chat_name=chat_name,
                     added_by_id=added_or_removed_by.id,
                     added_by_name=f"{added_or_removed_by.first_name} {added_or_removed_by.last_name or ''}".strip()
                 )
-                logger.warning(f"Bot was added to an unauthorized group: {chat_name} (ID: {chat_id}). Leaving...")
+                logger.warning("Bot was added to an unauthorized group: %s (ID: %s). Leaving...", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "handle_group_join", "rate_limited": True})
                 await context.bot.leave_chat(chat_id)
+                return "unauthorized"
     elif new_status in ["kicked", "left"]:
         if is_group_allowed(chat_id):
-            logger.info(f"Bot was removed from an authorized group: {chat_name} (ID: {chat_id}). Removing from database...")
-            remove_group(chat_id)
-            logger.info(f"Group '{chat_name}' (ID: {chat_id}) has been removed from the authorized list.")
+            logger.info("Bot was removed from an authorized group: %s (ID: %s). Removing from database...", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "handle_group_join"})
+            await remove_group_async(chat_id)
+            logger.info("Group '%s' (ID: %s) has been removed from the authorized list.", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "handle_group_join"})
+            return "removed"
+    return "untouched"
+
+def _message_link(chat_id, message_id):
+    """Link to a message in a supergroup, or None for chats t.me/c links do not cover."""
+    chat_id = str(chat_id)
+    if not chat_id.startswith("-100") or len(chat_id) <= 4:
+        return None
+    return f"https://t.me/c/{chat_id[4:]}/{message_id}"
 
+async def handle_duplicate(message, context: CallbackContext, chat_id: str, chat_name: str, earlier_message_id: int) -> str:
+    """
+    Handles a message whose links were all corrected in the chat moments ago, according to
+    DUPLICATE_ACTION. With "reply", a single message answers the repeat with a link to the
+    earlier correction. With "replace", the repeat is deleted and the earlier correction is
+    replied to; if the bot cannot delete it, it answers the repeat as with "reply".
+    """
+    if DUPLICATE_ACTION == "skip":
+        return "duplicate"
+    link = _message_link(chat_id, earlier_message_id)
+    reply_to = message.message_id
+    text = "This link was just shared and corrected" + (f": {link}" if link else ", see the earlier message.")
+    try:
+        if DUPLICATE_ACTION == "replace" and await bot_can_delete_messages(context, chat_id):
+            try:
+                await context.bot.delete_message(chat_id, message.message_id)
+                reply_to, text = earlier_message_id, "This link was just shared, see the corrected version here."
+            except (BadRequest, Forbidden) as e:
+                if is_permission_error(e):
+                    invalidate_bot_permissions(chat_id)
+                elif not is_undeletable_error(e):
+                    raise
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            message_thread_id=message.message_thread_id,
+            reply_parameters=ReplyParameters(reply_to, allow_sending_without_reply=True),
+        )
+    except TelegramError as e:
+        logger.warning("Could not answer a repeated link in %s (ID: %s): %s", chat_name, chat_id, e, extra={"chat_id": chat_id, "handler": "process_message", "rate_limited": True})
+        return "error"
+    return "duplicate"
+
+@instrument_handler
 async def process_message(update: Update, context: CallbackContext):
     """
-    Processes messages in authorized groups. It finds all URLs in the message,
-    normalizes them (ensuring correct domain names), and if any corrections are made,
-    either deletes the original message (if the bot has admin permissions) and sends a new one
-    with a "Sent by" attribution, or replies to the message without the attribution.
+    Processes messages in authorized groups. It finds all URLs in the message (or in
+    the caption of a media message), normalizes them (ensuring correct domain names),
+    and if any corrections are made, either deletes the original message (if the bot
+    has admin permissions) and sends a new one with a "Sent by" attribution, or replies
+    to the message without the attribution. Parts of an album are collected first and
+    corrected together by process_album. Returns the outcome recorded in the metrics.
     """
     chat = update.effective_chat
     if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
-        return
+        return "untouched"
 
     chat_id = str(chat.id)
     chat_name = chat.title or "Unknown"
 
-    if not is_group_allowed(chat_id):
-        logger.warning(f"Message received from unauthorized group: {chat_name} (ID: {chat_id}).")
-        return
+    with STAGE_LATENCY.time(stage="is_group_allowed"):
+        allowed = is_group_allowed(chat_id)
+    if not allowed:
+        logger.warning("Message received from unauthorized group: %s (ID: %s).", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "process_message", "rate_limited": True})
+        return "unauthorized"
+
+    if update.effective_user:
+        remember_member(chat_id, update.effective_user.id)
+
+    if update.message and update.message.media_group_id and MEDIA_GROUP_DELAY > 0:
+        MEDIA_GROUPS.add(update.message, context)
+        return "buffered"
+
+    if not update.message or not message_content(update.message)[0]:
+        logger.warning("Ignored update: not a valid message in %s (ID: %s).", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "process_message", "rate_limited": True})
+        return "untouched"
+
+    return await correct_message(context, chat_id, chat_name, update.message)
+
+@instrument_handler
+async def process_album(messages: list, context: CallbackContext):
+    """Corrects the links in an album's caption once, for all the messages of the album."""
+    captioned = [message for message in messages if message.caption]
+    if not captioned:
+        return "untouched"
+    chat = messages[0].chat
+    return await correct_message(context, str(chat.id), chat.title or "Unknown", captioned[0], messages)
+
+def _album_media(messages: list):
+    """The album's photos, videos, documents or audio files to re-send, or None if one cannot be re-sent."""
+    media = []
+    for message in messages:
+        if message.photo:
+            media.append(InputMediaPhoto(message.photo[-1].file_id))
+        elif message.video:
+            media.append(InputMediaVideo(message.video.file_id))
+        elif message.document:
+            media.append(InputMediaDocument(message.document.file_id))
+        elif message.audio:
+            media.append(InputMediaAudio(message.audio.file_id))
+        else:
+            return None
+    return media
+
+def _as_caption(correction: dict) -> dict:
+    """Turns render_correction's message arguments into caption arguments."""
+    return {
+        "caption": correction["text"],
+        "parse_mode": correction.get("parse_mode"),
+        "caption_entities": correction.get("entities"),
+    }
+
+async def _repost_media(context: CallbackContext, chat_id: str, message, album, correction: dict) -> int:
+    """
+    Posts the media again with the corrected caption, then deletes the originals.
+    Returns the ID of the new (first) message. The copy is made first, so the media
+    survives if it fails. If Telegram refuses to delete the originals, the copy is
+    removed again; if the delete's outcome is unknown (a timeout or network error),
+    the copy is kept, since the originals may be gone.
+    """
+    caption = _as_caption(correction)
+    if album:
+        sent = await context.bot.send_media_group(chat_id, _album_media(album), message_thread_id=message.message_thread_id, **caption)
+        sent_ids = [part.message_id for part in sent]
+        original_ids = [part.message_id for part in album]
+    else:
+        sent = await context.bot.copy_message(chat_id, chat_id, message.message_id, message_thread_id=message.message_thread_id, **caption)
+        sent_ids = [sent.message_id]
+        original_ids = [message.message_id]
+    try:
+        await context.bot.delete_messages(chat_id, original_ids)
+    except (BadRequest, Forbidden):
+        try:
+            await context.bot.delete_messages(chat_id, sent_ids)
+        except TelegramError as e:
+            logger.error("Could not remove the corrected copy in chat %s: %s", chat_id, e, extra={"chat_id": chat_id, "handler": "process_message"})
+        raise
+    except TelegramError as e:
+        logger.warning("Deleting the originals in chat %s may have failed, keeping the corrected copy: %s", chat_id, e, extra={"chat_id": chat_id, "handler": "process_message"})
+    return sent_ids[0]
+
+async def correct_message(context: CallbackContext, chat_id: str, chat_name: str, message, album=None) -> str:
+    """
+    Corrects the links of one message, or of the captioned message of an album (with
+    all its messages in `album`). Returns the outcome recorded in the metrics.
+    """
+    text, _ = message_content(message)
+    is_media = message.text is None
 
-    if not update.message or not update.message.text:
-        logger.warning(f"Ignored update: not a valid message in {chat_name} (ID: {chat_id}).")
-        return
+    # Skip messages without rewritable links before doing any parsing or string building
+    with STAGE_LATENCY.time(stage="extract_urls"):
+        index = mappings_for_chat(chat_id)
+        resolver = context.bot_data.get("link_resolver")
+        links = [
+            link for link in extract_links(message, index, resolver)
+            if index.mentions_mapped_domain(link.url) or (resolver and resolver.is_short_link(link.url))
+        ]
+    if not links:
+        return "untouched"
 
-    message_text = update.message.text.strip()
-    user_name_escaped = escape_markdown_v2(update.message.from_user.first_name)
-    user_mention = f"[{user_name_escaped}](tg://user?id={update.message.from_user.id})"
+    # Expand short links (t.co, vm.tiktok.com...) first, without waiting past the budget
+    resolved = {}
+    if resolver:
+        short_urls = [link.url for link in links if resolver.is_short_link(link.url)]
+        if short_urls:
+            resolved = await resolver.resolve_all(short_urls, SHORT_LINK_BUDGET)
 
-    url_pattern = re.compile(r"(https?://[^\s]+)")
-    found_urls = url_pattern.findall(message_text)
-    
     # Create a mapping of original URLs to their normalized versions
     url_mappings = {}
     has_changes = False
-    for url in found_urls:
-        new_url = normalize_url(url)
-        if new_url != url:
+    for link in links:
+        if link.url in url_mappings:
+            continue
+        target = resolved.get(link.url, link.url)
+        with STAGE_LATENCY.time(stage="normalize_url"):
+            new_url = normalize_url(target, index)
+        if new_url == target:
+            # Unmapped destinations keep the link the user posted
+            new_url = link.url
+        if new_url != link.url:
             has_changes = True
-        url_mappings[url] = new_url
+        url_mappings[link.url] = new_url
 
-    if has_changes:
-        try:
-            chat_member = await context.bot.get_chat_member(chat_id, context.bot.id)
-            if chat_member.can_delete_messages:
-                # Store the original message's topic ID before deleting
-                original_thread_id = update.message.message_thread_id
-                
-                await context.bot.delete_message(chat_id, update.message.message_id)
-                logger.info(f"Message deleted in group {chat_name} (ID: {chat_id}).")
-                # Format the message with escaped text and clickable links
-                quoted_text, links_text = format_message_with_links(message_text, url_mappings)
-                message_parts = [f"Sent by {user_mention}"]
-                if quoted_text:
-                    message_parts.append(quoted_text)
-                if links_text:
-                    message_parts.append(links_text)
-                new_message = '\n\n'.join(message_parts)
-                
-                # Send the new message with the same topic as the original
-                await context.bot.send_message(
-                    chat_id=chat_id, 
-                    text=new_message,
-                    message_thread_id=original_thread_id,
-                    parse_mode="MarkdownV2"
-                )
-            else:
-                logger.warning(f"Bot lacks permissions to delete messages in {chat_name} (ID: {chat_id}).")
-                quoted_text, links_text = format_message_with_links(message_text, url_mappings)
-                message_parts = []
-                if quoted_text:
-                    message_parts.append(quoted_text)
-                if links_text:
-                    message_parts.append(links_text)
-                reply_message = '\n\n'.join(message_parts)
-                await update.message.reply_text(reply_message, parse_mode="MarkdownV2")
-        except Exception as e:
-            logger.error(f"Error processing message in {chat_name} (ID: {chat_id}): {e}")
-            # Try without markdown as fallback
-            corrected_text = message_text
+    if not has_changes:
+        return "untouched"
+
+    if RECENT_LINKS is not None:
+        corrected_urls = [new_url for url, new_url in url_mappings.items() if new_url != url]
+        earlier_posts = [RECENT_LINKS.get(chat_id, url) for url in corrected_urls]
+        if all(earlier_posts):
+            return await handle_duplicate(message, context, chat_id, chat_name, earlier_posts[0])
+
+    try:
+        sent_id = None
+        can_delete = await bot_can_delete_messages(context, chat_id)
+        if can_delete:
+            correction = render_correction(text, links, url_mappings, message.from_user)
+            try:
+                if not is_media:
+                    await context.bot.delete_message(chat_id, message.message_id)
+                    logger.info("Message deleted in group %s (ID: %s).", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "process_message"})
+                    # Send the new message, with a "Sent by" attribution, in the same topic as the original
+                    sent = await context.bot.send_message(chat_id=chat_id, message_thread_id=message.message_thread_id, **correction)
+                    sent_id = sent.message_id
+                elif caption_length(text, links, url_mappings, message.from_user) <= MAX_CAPTION_LENGTH and (not album or _album_media(album)):
+                    sent_id = await _repost_media(context, chat_id, message, album, correction)
+            except (BadRequest, Forbidden) as e:
+                if is_permission_error(e):
+                    # Our cached permissions are stale: forget them and reply instead
+                    invalidate_bot_permissions(chat_id)
+                elif not is_undeletable_error(e):
+                    # Only this message cannot be deleted; the cached permission still holds
+                    raise
+                logger.warning("Could not delete message in %s (ID: %s): %s. Replying instead.", chat_name, chat_id, e, extra={"chat_id": chat_id, "handler": "process_message"})
+        else:
+            logger.warning("Bot lacks permissions to delete messages in %s (ID: %s).", chat_name, chat_id, extra={"chat_id": chat_id, "handler": "process_message", "rate_limited": True})
+
+        if sent_id is None:
+            sent = await message.reply_text(**render_correction(text, links, url_mappings))
+            sent_id = sent.message_id
+        if RECENT_LINKS is not None:
             for url, new_url in url_mappings.items():
-                corrected_text = corrected_text.replace(url, new_url)
-            await update.message.reply_text(corrected_text)
\ No newline at end of file
+                if new_url != url:
+                    RECENT_LINKS.add(chat_id, new_url, sent_id)
+        return "rewritten"
+    except RetryAfter as e:
+        # Still flooded after the scheduler's retries: sending a fallback would only make it worse
+        logger.warning("Flood control in %s (ID: %s), dropping correction: %s", chat_name, chat_id, e, extra={"chat_id": chat_id, "handler": "process_message", "rate_limited": True})
+        return "error"
+    except Exception as e:
+        logger.error("Error processing message in %s (ID: %s): %s", chat_name, chat_id, e, extra={"chat_id": chat_id, "handler": "process_message"})
+        # Try without formatting as fallback
+        await message.reply_text(replace_links(text, links, url_mappings))
+        return "error"
+
+# Album parts waiting to be corrected together
+MEDIA_GROUPS = MediaGroupBuffer(process_album, MEDIA_GROUP_DELAY)
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update
+from telegram.ext import CallbackContext
+import handlers
+from db import is_known_member
+from lru_cache import LRUCache
+from metrics import instrument_handler, STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Seconds Telegram keeps an answer for the same user and query before asking the bot again
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+
+# Seconds a query must stay unchanged (the user stopped typing) before it is answered
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.4"))
+
+# Answers kept in memory, per query text and mappings version
+INLINE_CACHE_SIZE = int(os.getenv("INLINE_CACHE_SIZE", "2048"))
+INLINE_RESULTS = LRUCache(INLINE_CACHE_SIZE, handlers.URL_CACHE_TTL)
+
+# Links in a query are the words that mention a mapped domain, with or without a scheme
+WORD_PATTERN = re.compile(r"\S+")
+
+# user_id -> task answering that user's latest query once it stops changing
+_pending_answers = {}
+
+def rewrite_query(text: str) -> tuple:
+    """Returns the query text with its links normalized, and the links that changed."""
+    changed = []
+
+    def replace(match):
+        word = match.group()
+        if not handlers.DOMAIN_INDEX.mentions_mapped_domain(word):
+            return word
+        new_url = handlers.normalize_url(word)
+        if new_url != word:
+            changed.append(new_url)
+        return new_url
+
+    return WORD_PATTERN.sub(replace, text), changed
+
+def inline_results(text: str) -> list:
+    """The inline answer for a query: one article with its links fixed, or none if nothing changes."""
+    key = (handlers.MAPPINGS_VERSION, text)
+    results = INLINE_RESULTS.get(key)
+    if results is None:
+        with STAGE_LATENCY.time(stage="normalize_url"):
+            rewritten, changed = rewrite_query(text)
+        results = []
+        if changed:
+            results.append(InlineQueryResultArticle(
+                id=hashlib.sha1(rewritten.encode()).hexdigest(),
+                title=changed[0] if len(changed) == 1 else f"{len(changed)} fixed links",
+                description=rewritten,
+                input_message_content=InputTextMessageContent(rewritten),
+            ))
+        INLINE_RESULTS.set(key, results)
+    return results
+
+@instrument_handler
+async def inline_query(update: Update, context: CallbackContext):
+    """
+    Answers "@bot <link>" with the link fixed, for the admin and users seen in
+    authorized groups. Answers already in INLINE_RESULTS are sent right away;
+    others wait until the user stops typing, so partial queries are not computed.
+    """
+    query = update.inline_query
+    user_id = query.from_user.id
+    if user_id != context.bot_data.get("admin_id") and not is_known_member(user_id):
+        # Not cached, so the user can use inline mode as soon as they post in a group
+        await query.answer([], cache_time=0, is_personal=True)
+        return "unauthorized"
+
+    text = query.query.strip()
+    pending = _pending_answers.pop(user_id, None)
+    if pending:
+        # A newer query supersedes the one still being typed
+        pending.cancel()
+    if not text:
+        return "untouched"
+
+    if (handlers.MAPPINGS_VERSION, text) in INLINE_RESULTS or INLINE_DEBOUNCE <= 0:
+        await _answer(query, text)
+        return "answered"
+
+    _pending_answers[user_id] = asyncio.create_task(_answer_later(query, text))
+    return "debounced"
+
+async def _answer(query, text: str):
+    # Answers are personal because access is checked per user
+    await query.answer(inline_results(text), cache_time=INLINE_CACHE_TIME, is_personal=True)
+
+async def _answer_later(query, text: str):
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    _pending_answers.pop(query.from_user.id, None)
+    try:
+        await _answer(query, text)
+    except Exception as e:
+        logger.error("Error answering inline query from user %s: %s", query.from_user.id, e)
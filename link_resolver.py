@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from lru_cache import LRUCache
+from metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Hosts whose links only redirect to the real post
+DEFAULT_SHORT_LINK_HOSTS = ("t.co", "vm.tiktok.com", "vt.tiktok.com", "instagr.am")
+
+_REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+def link_hostname(url: str):
+    """Hostname of a link, which may be scheme-less as in url entities."""
+    try:
+        return urlparse(url if "://" in url else "https://" + url).hostname
+    except ValueError:
+        return None
+
+class LinkResolver:
+    """
+    Expands short links to the URL they redirect to. Redirects are followed with
+    HEAD requests only while they stay on short-link hosts, so the target site
+    itself is never fetched. All requests share one pooled client and at most
+    `max_concurrency` run at once; resolved targets are cached, and concurrent
+    lookups of the same link share a single request.
+    """
+
+    def __init__(self, hosts=DEFAULT_SHORT_LINK_HOSTS, timeout: float = 2.0, max_concurrency: int = 10,
+                 cache_size: int = 4096, cache_ttl: float = 3600.0, max_redirects: int = 5):
+        self.hosts = {host.lower() for host in hosts}
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._cache = LRUCache(cache_size, cache_ttl)
+        self._pending = {}
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            follow_redirects=False,
+        )
+
+    def is_short_link(self, url: str) -> bool:
+        return link_hostname(url) in self.hosts
+
+    def mentions_short_link(self, text: str) -> bool:
+        """Cheap pre-filter: tells whether a text may contain a short link."""
+        text = text.lower()
+        return any(host in text for host in self.hosts)
+
+    def stats(self) -> dict:
+        return {**self._cache.stats(), "pending": len(self._pending)}
+
+    async def resolve(self, url: str) -> str:
+        """Returns the URL a short link leads to, or the link itself if it cannot be resolved."""
+        cached = self._cache.get(url)
+        if cached is not None:
+            return cached
+        task = self._pending.get(url)
+        if task is None:
+            task = self._pending[url] = asyncio.create_task(self._resolve(url))
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        # Shielded so a caller giving up does not cancel the request other callers share
+        return await asyncio.shield(task)
+
+    async def resolve_all(self, urls, budget: float) -> dict:
+        """
+        Resolves several links at once, waiting at most `budget` seconds. Links not
+        resolved in time map to themselves; their requests keep running and fill the
+        cache for the next message.
+        """
+        tasks = {url: asyncio.ensure_future(self.resolve(url)) for url in dict.fromkeys(urls)}
+        if not tasks:
+            return {}
+        await asyncio.wait(tasks.values(), timeout=budget)
+        resolved = {}
+        for url, task in tasks.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                resolved[url] = task.result()
+            else:
+                resolved[url] = url
+                # Nobody waits for the result any more: drop this caller's handle quietly
+                task.cancel()
+        return resolved
+
+    async def _resolve(self, url: str) -> str:
+        current = url if "://" in url else "https://" + url
+        try:
+            async with self._semaphore:
+                with STAGE_LATENCY.time(stage="resolve_short_link"):
+                    for _ in range(self.max_redirects):
+                        location = await self._redirect_target(current)
+                        if location is None:
+                            break
+                        current = urljoin(current, location)
+                        if link_hostname(current) not in self.hosts:
+                            break
+        except (httpx.HTTPError, ValueError) as e:
+            logger.debug("Could not resolve short link %s: %s", url, e)
+            return url
+        if urlparse(current).scheme not in ("http", "https"):
+            return url
+        self._cache.set(url, current)
+        return current
+
+    async def _redirect_target(self, url: str):
+        response = await self._client.head(url)
+        if response.status_code in (405, 501):
+            # Some shorteners only answer GET; the body is never read
+            async with self._client.stream("GET", url) as response:
+                pass
+        if response.status_code in _REDIRECT_STATUSES:
+            return response.headers.get("location")
+        return None
+
+    async def close(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        await self._client.aclose()
@@ -0,0 +1,161 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+# Record attributes that become JSON fields when a log call passes them in extra=
+STRUCTURED_FIELDS = ("chat_id", "handler", "outcome", "latency", "suppressed")
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including the structured fields they carry."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Queues records for the background writer. The message is merged with its
+    arguments here, but formatting is left to the writer so structured fields survive.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records per `interval` seconds through for each key, for
+    events a single chat can trigger over and over. Only records logged with
+    extra={"rate_limited": True} are limited; they are keyed by logger, message
+    template and chat_id. The next record let through reports how many were dropped.
+    """
+
+    def __init__(self, burst: int = 10, interval: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # key -> [window start, records let through, records dropped]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "rate_limited", False):
+            return True
+        key = (record.name, record.msg, getattr(record, "chat_id", None))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if len(self._windows) > 10000:
+                    self._drop_expired(now)
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+    def _drop_expired(self, now):
+        for key in [key for key, window in self._windows.items() if now - window[0] >= self.interval]:
+            del self._windows[key]
+
+class SampleFilter(logging.Filter):
+    """Keeps one in every `rate` records logged with extra={"sampled": True}."""
+
+    def __init__(self, rate: int = 1):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        with self._lock:
+            self._seen += 1
+            return (self._seen - 1) % self.rate == 0
+
+class LogListener(QueueListener):
+    """QueueListener that can be stopped more than once (explicitly, then again at exit)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.running = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            super().start()
+            self.running = True
+
+    def stop(self):
+        with self._lock:
+            if self.running:
+                self.running = False
+                super().stop()
+
+def setup_logging(level="INFO", log_format="text", log_file="logs/bot.log", rate_limit_burst=10, rate_limit_interval=60.0, sample_rate=1):
+    """
+    Routes the root logger through a queue: callers only enqueue records, and a
+    background thread formats them and writes to the rotating file and the console.
+    Returns the running LogListener.
+    """
+    if log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # Handler for logging to a file that rotates daily
+    file_handler = TimedRotatingFileHandler(log_file, when="midnight", interval=1, backupCount=7)
+    file_handler.setFormatter(formatter)
+
+    # Handler for logging to the console
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+
+    # Throttled and sampled records are dropped before they are queued
+    queue_handler = StructuredQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter(rate_limit_burst, rate_limit_interval))
+    queue_handler.addFilter(SampleFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = LogListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Flush the records still queued when the process exits
+    atexit.register(stop_logging, listener)
+    return listener
+
+def stop_logging(listener):
+    """Writes out the queued records and stops the background writer; safe to call twice."""
+    listener.stop()
@@ -1,67 +1,233 @@
+import asyncio
 import logging
-from logging.handlers import TimedRotatingFileHandler
 import os
+import time
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     ChatMemberHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     filters
 )
 from dotenv import load_dotenv
 
-from db import create_database
-from commands import menu, list_groups, add_group, remove_group, admin_help, button_handler, list_unauthorized_attempts
-from handlers import process_message, handle_group_join
+import db
+from commands import menu, list_groups, add_group, remove_group, admin_help, button_handler, list_unauthorized_attempts, unauthorized_attempt_stats, queue_stats, cache_stats, live_stats, profile, mappings_status, group_mappings, set_mapping, reset_mapping
+from diagnostics import LoopLagMonitor
+from handlers import process_message, handle_group_join, apply_mappings, DUPLICATE_ACTIONS, MEDIA_GROUPS
+from inline import inline_query
+from mappings import MappingsWatcher
+from link_resolver import LinkResolver, DEFAULT_SHORT_LINK_HOSTS
+from update_processor import PerChatUpdateProcessor
+from outbound_scheduler import OutboundScheduler
+from sharding import ShardedFrontend
+from metrics import start_metrics_server, add_route
+from log_pipeline import setup_logging
 
-# Create logs directory if it doesn't exist
-if not os.path.exists("logs"):
-    os.makedirs("logs")
+logger = logging.getLogger()
 
-# Logging configuration
-log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+class Settings:
+    """The bot's configuration, read from the environment. Raises ValueError for missing or invalid values."""
 
-# Handler for logging to a file that rotates daily
-file_handler = TimedRotatingFileHandler("logs/bot.log", when="midnight", interval=1, backupCount=7)
-file_handler.setFormatter(log_formatter)
-file_handler.setLevel(logging.INFO)
+    def __init__(self, env=os.environ):
+        self.bot_token = env.get("BOT_TOKEN")
+        admin_id = env.get("ADMIN_ID")
+        if not self.bot_token or not admin_id:
+            raise ValueError("The bot token or admin ID are not defined in the .env file")
+        try:
+            self.admin_id = int(admin_id)
+        except ValueError:
+            raise ValueError("ADMIN_ID must be an integer")
 
-# Handler for logging to the console
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-console_handler.setLevel(logging.INFO)
+        # Seconds between reloads of the authorized-group registry from the database
+        self.group_resync_interval = int(env.get("GROUP_RESYNC_INTERVAL", "300"))
 
-# Get the root logger and add the handlers
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+        # Maximum number of updates handled at the same time (updates of one chat stay in order)
+        self.max_concurrent_updates = int(env.get("MAX_CONCURRENT_UPDATES", "64"))
 
-# Load environment variables
-load_dotenv(dotenv_path="config/.env")
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-ADMIN_ID = os.getenv("ADMIN_ID")
+        # Load shedding: updates allowed to wait for a slot, and seconds after which waiting
+        # low-priority updates (not admin commands, membership changes or links) are dropped
+        self.ingress_queue_size = int(env.get("INGRESS_QUEUE_SIZE", "1000"))
+        self.ingress_shed_age = float(env.get("INGRESS_SHED_AGE", "10"))
 
-if not BOT_TOKEN or not ADMIN_ID:
-    logger.error("The bot token or admin ID are not defined in the .env file")
-    raise ValueError("The bot token or admin ID are not defined in the .env file")
+        # Outbound rate limits: requests per second overall and messages per minute per chat
+        self.outbound_global_rate = float(env.get("OUTBOUND_GLOBAL_RATE", "30"))
+        self.outbound_chat_rate_per_minute = float(env.get("OUTBOUND_CHAT_RATE_PER_MINUTE", "20"))
 
-try:
-    ADMIN_ID = int(ADMIN_ID)
-except ValueError:
-    logger.error("ADMIN_ID is not a valid integer")
-    raise ValueError("ADMIN_ID must be an integer")
+        # Worker processes the chats are sharded across (1 runs everything in this process)
+        self.shard_workers = int(env.get("SHARD_WORKERS", "1"))
 
-def main():
-    # Ensure the database is created or verified on startup
-    create_database()
+        # How updates are received: "polling" (default) or "webhook"
+        self.bot_mode = env.get("BOT_MODE", "polling").lower()
+        self.webhook_listen = env.get("WEBHOOK_LISTEN", "0.0.0.0")
+        self.webhook_port = int(env.get("WEBHOOK_PORT", "8443"))
+        self.webhook_path = env.get("WEBHOOK_PATH", "telegram").strip("/")
+        self.webhook_url = env.get("WEBHOOK_URL")
+        self.webhook_secret_token = env.get("WEBHOOK_SECRET_TOKEN")
+        if self.bot_mode not in ("polling", "webhook"):
+            raise ValueError("BOT_MODE must be 'polling' or 'webhook'")
+        if self.bot_mode == "webhook" and not self.webhook_url:
+            raise ValueError("WEBHOOK_URL is required when BOT_MODE is 'webhook'")
+
+        # What to do with a link corrected in the same group moments ago (see handlers.DUPLICATE_ACTION)
+        self.duplicate_action = env.get("DUPLICATE_ACTION", "reply").lower()
+        if self.duplicate_action not in DUPLICATE_ACTIONS:
+            raise ValueError(f"DUPLICATE_ACTION must be one of: {', '.join(DUPLICATE_ACTIONS)}")
+
+        # Seconds between checks of config/mappings.json for changes (0 disables hot reload)
+        self.mappings_reload_interval = float(env.get("MAPPINGS_RELOAD_INTERVAL", "5"))
+
+        # Short-link resolution: off unless enabled; hosts to expand, per-request timeout and parallel requests
+        self.resolve_short_links = env.get("RESOLVE_SHORT_LINKS", "false").lower() in ("1", "true", "yes")
+        self.short_link_hosts = [host.strip() for host in env.get("SHORT_LINK_HOSTS", ",".join(DEFAULT_SHORT_LINK_HOSTS)).split(",") if host.strip()]
+        self.short_link_timeout = float(env.get("SHORT_LINK_TIMEOUT", "2"))
+        self.short_link_concurrency = int(env.get("SHORT_LINK_CONCURRENCY", "10"))
+
+        # Local HTTP endpoint exposing Prometheus metrics and the health checks (0 disables it);
+        # sharded workers use the following ports
+        self.metrics_host = env.get("METRICS_HOST", "127.0.0.1")
+        self.metrics_port = int(env.get("METRICS_PORT", "9090"))
+
+        # Event-loop lag checks: seconds between them (0 disables the monitor) and the lag logged as a warning
+        self.loop_lag_interval = float(env.get("LOOP_LAG_INTERVAL", "0.5"))
+        self.loop_lag_threshold = float(env.get("LOOP_LAG_THRESHOLD", "0.25"))
+
+def configure(worker_id=None):
+    """
+    Loads config/.env, starts the logging pipeline and returns the Settings.
+    Sharded workers log to a file of their own, so processes never rotate each other's file.
+    """
+    # Create logs directory if it doesn't exist
+    os.makedirs("logs", exist_ok=True)
+
+    # Load environment variables
+    load_dotenv(dotenv_path="config/.env")
+
+    # Logging configuration: records are written by a background thread, as text lines
+    # by default (LOG_FORMAT=json for JSON lines); LOG_RATE_LIMIT caps repetitive warnings
+    # per chat per minute
+    setup_logging(
+        level=os.getenv("LOG_LEVEL", "INFO").upper(),
+        log_format=os.getenv("LOG_FORMAT", "text").lower(),
+        log_file="logs/bot.log" if worker_id is None else f"logs/bot-worker-{worker_id}.log",
+        rate_limit_burst=int(os.getenv("LOG_RATE_LIMIT", "10")),
+        sample_rate=int(os.getenv("LOG_SAMPLE_RATE", "1")),
+    )
+    try:
+        return Settings()
+    except ValueError as e:
+        logger.error(str(e))
+        raise
+
+def add_health_routes(app):
+    """
+    Serves /healthz (the process is up) and /ready (startup finished, updates are
+    being handled) from the metrics server, for the container orchestrator.
+    """
+    add_route("/healthz", lambda: (200, "text/plain", "ok\n"))
+    add_route("/ready", lambda: (200, "text/plain", "ready\n") if app.bot_data.get("ready") else (503, "text/plain", "starting\n"))
+
+async def warm_up(app):
+    """
+    Does the startup I/O before any update is handled. The tasks do not depend on
+    each other, so they run concurrently: pinging the database, creating its
+    indexes, compiling the domain mappings and loading the authorized groups into memory.
+    """
+    start = time.perf_counter()
+    _, _, _, group_count = await asyncio.gather(
+        db.ping_async(),
+        db.create_database_async(),
+        app.bot_data["mappings_watcher"].load(),
+        db.load_allowed_groups_async(),
+    )
+    app.bot_data["ready"] = True
+    logger.info("Bot ready in %.3fs with %s authorized groups.", time.perf_counter() - start, group_count)
 
-    # Create the bot application
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def post_init(app):
+    """Warms the bot up and starts background tasks once the application is initialized."""
+    settings = app.bot_data["settings"]
+    # The health endpoints answer during the warm-up, so the orchestrator sees the bot starting
+    metrics_port = app.bot_data.get("metrics_port")
+    if metrics_port:
+        add_health_routes(app)
+        app.bot_data["metrics_server"] = await start_metrics_server(settings.metrics_host, metrics_port)
+
+    app.bot_data["mappings_watcher"] = MappingsWatcher(apply_mappings, interval=settings.mappings_reload_interval)
+    await warm_up(app)
+
+    app.bot_data["resync_task"] = asyncio.create_task(db.resync_allowed_groups(settings.group_resync_interval))
+    app.bot_data["attempts_task"] = asyncio.create_task(db.flush_unauthorized_attempts_periodically(db.ATTEMPT_FLUSH_INTERVAL))
+    if settings.mappings_reload_interval > 0:
+        app.bot_data["mappings_task"] = asyncio.create_task(app.bot_data["mappings_watcher"].run())
+    if settings.loop_lag_interval > 0:
+        app.bot_data["loop_monitor"] = LoopLagMonitor(settings.loop_lag_interval, settings.loop_lag_threshold)
+        app.bot_data["loop_monitor_task"] = asyncio.create_task(app.bot_data["loop_monitor"].run())
+    if settings.resolve_short_links:
+        app.bot_data["link_resolver"] = LinkResolver(settings.short_link_hosts, settings.short_link_timeout, settings.short_link_concurrency)
+
+async def post_shutdown(app):
+    """Stops background tasks started in post_init."""
+    app.bot_data["ready"] = False
+    for name in ("resync_task", "mappings_task", "attempts_task", "loop_monitor_task"):
+        task = app.bot_data.get(name)
+        if task:
+            task.cancel()
+    dropped = MEDIA_GROUPS.cancel()
+    if dropped:
+        logger.warning("Shutting down with %s albums still waiting for their parts; they were not corrected.", dropped)
+    resolver = app.bot_data.get("link_resolver")
+    if resolver:
+        await resolver.close()
+    server = app.bot_data.get("metrics_server")
+    if server:
+        server.close()
+        await server.wait_closed()
+    try:
+        # Batches already being written go first, so the storage is not closed under them
+        await db.wait_for_background_flushes()
+        await db.flush_unauthorized_attempts_async()
+    except Exception as e:
+        logger.error("Could not write the queued unauthorized attempts: %s", e)
+    await db.close_storage_async()
+
+def build_application(settings=None, with_updater=True, worker_id=None):
+    """
+    Creates the bot application with all its handlers. Nothing is connected or
+    loaded here: that happens in post_init, when the application starts.
+    """
+    if settings is None:
+        settings = Settings()
+    # Sharded workers share the bot's global limit; each chat is only ever served by one of them
+    global_rate = settings.outbound_global_rate if worker_id is None else settings.outbound_global_rate / settings.shard_workers
+    scheduler = OutboundScheduler(global_rate, settings.outbound_chat_rate_per_minute)
+    builder = (
+        ApplicationBuilder()
+        .token(settings.bot_token)
+        .concurrent_updates(PerChatUpdateProcessor(
+            settings.max_concurrent_updates,
+            admin_id=settings.admin_id,
+            max_queue=settings.ingress_queue_size,
+            shed_age=settings.ingress_shed_age,
+            chat_filter=db.is_group_allowed,
+        ))
+        .rate_limiter(scheduler)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if not with_updater:
+        # Sharded workers get their updates from the front end instead
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Set global bot data
-    app.bot_data["admin_id"] = ADMIN_ID
+    app.bot_data["settings"] = settings
+    app.bot_data["admin_id"] = settings.admin_id
+    app.bot_data["scheduler"] = scheduler
+    app.bot_data["ready"] = False
+    if settings.metrics_port:
+        app.bot_data["metrics_port"] = settings.metrics_port if worker_id is None else settings.metrics_port + 1 + worker_id
 
     # Command handlers
     app.add_handler(CommandHandler("menu", menu))  # Interactive menu
@@ -69,6 +235,15 @@ def main():
     app.add_handler(CommandHandler("add_group", add_group))
     app.add_handler(CommandHandler("remove_group", remove_group))
     app.add_handler(CommandHandler("list_attempts", list_unauthorized_attempts))
+    app.add_handler(CommandHandler("attempt_stats", unauthorized_attempt_stats))
+    app.add_handler(CommandHandler("queue", queue_stats))
+    app.add_handler(CommandHandler("cache", cache_stats))
+    app.add_handler(CommandHandler("stats", live_stats))
+    app.add_handler(CommandHandler("profile", profile))
+    app.add_handler(CommandHandler("mappings", mappings_status))
+    app.add_handler(CommandHandler("group_mappings", group_mappings))
+    app.add_handler(CommandHandler("set_mapping", set_mapping))
+    app.add_handler(CommandHandler("reset_mapping", reset_mapping))
     app.add_handler(CommandHandler("help", admin_help))
 
     # Menu button handlers
@@ -80,9 +255,55 @@ def main():
     # Handler for events when the bot is added to a group
     app.add_handler(ChatMemberHandler(handle_group_join, ChatMemberHandler.MY_CHAT_MEMBER))
 
+    # Inline mode: "@bot <link>" from any chat
+    app.add_handler(InlineQueryHandler(inline_query))
+
+    return app
+
+def webhook_settings(settings):
+    """Arguments for starting the webhook server."""
+    return {
+        "listen": settings.webhook_listen,
+        "port": settings.webhook_port,
+        "url_path": settings.webhook_path,
+        "webhook_url": f"{settings.webhook_url.rstrip('/')}/{settings.webhook_path}",
+        "secret_token": settings.webhook_secret_token,
+    }
+
+def run_sharded(settings):
+    """Runs a routing front end in this process and the handlers in SHARD_WORKERS processes."""
+    frontend = ShardedFrontend(settings.shard_workers)
+    try:
+        asyncio.run(frontend.run(
+            settings.bot_token,
+            webhook_settings(settings) if settings.bot_mode == "webhook" else None,
+            # The health checks stay on METRICS_PORT; workers serve their metrics on the next ports
+            (settings.metrics_host, settings.metrics_port) if settings.metrics_port else None,
+        ))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Stopping workers...")
+        frontend.stop()
+
+def main():
+    settings = configure()
+
+    if settings.shard_workers > 1:
+        logger.info("Bot started with %s worker processes...", settings.shard_workers)
+        run_sharded(settings)
+        return
+
+    # The database, mappings and group registry are prepared in post_init, before the first update
+    app = build_application(settings)
+
     # Start the bot
-    logger.info("Bot started and running...")
-    app.run_polling()
+    if settings.bot_mode == "webhook":
+        logger.info("Bot started in webhook mode on %s:%s/%s...", settings.webhook_listen, settings.webhook_port, settings.webhook_path)
+        app.run_webhook(**webhook_settings(settings))
+    else:
+        logger.info("Bot started and running...")
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
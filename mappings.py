@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+MAPPINGS_FILE = "config/mappings.json"
+
+# Hostname-like tokens ("x.com", "vm.tiktok.com") anywhere in a piece of text
+_HOSTNAME_PATTERN = re.compile(r"[a-z0-9-]+(?:\.[a-z0-9-]+)+", re.IGNORECASE)
+
+# A complete domain name, for validating mapping files
+_DOMAIN_PATTERN = re.compile(r"(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9-]{2,}", re.IGNORECASE)
+
+# Trie key holding a node's replacement domain (never a valid hostname label)
+_REPLACEMENT = None
+
+def load_mappings(path: str = MAPPINGS_FILE) -> dict:
+    """Loads the domain mappings from the configuration file."""
+    with open(path, "r") as f:
+        return json.load(f)
+
+def is_valid_domain(domain) -> bool:
+    """Tells whether a value is a complete domain name such as "x.com"."""
+    return isinstance(domain, str) and _DOMAIN_PATTERN.fullmatch(domain) is not None
+
+def validate_mappings(mappings) -> dict:
+    """Checks that loaded mappings are a non-empty object of domain -> domain; raises ValueError otherwise."""
+    if not isinstance(mappings, dict) or not mappings:
+        raise ValueError("The mappings must be a non-empty JSON object.")
+    for original_domain, replacement_domain in mappings.items():
+        if not is_valid_domain(original_domain) or not is_valid_domain(replacement_domain):
+            raise ValueError(f"Invalid mapping: {original_domain!r} -> {replacement_domain!r}")
+    return mappings
+
+def mappings_version(mappings: dict) -> str:
+    """Short fingerprint of a mapping table, the same however the file is formatted."""
+    return hashlib.sha256(json.dumps(mappings, sort_keys=True).encode()).hexdigest()[:12]
+
+def merge_mappings(mappings: dict, overrides: dict) -> dict:
+    """Applies a group's overrides to the global mappings; an override of None drops the domain."""
+    merged = {**mappings, **overrides}
+    return {domain: replacement for domain, replacement in merged.items() if replacement is not None}
+
+class DomainIndex:
+    """
+    Domain mappings compiled into a trie of reversed hostname labels.
+    Finding the mapping for a hostname costs one dict lookup per label,
+    no matter how many mappings are registered.
+    """
+
+    def __init__(self, mappings: dict):
+        self.mappings = dict(mappings)
+        self.version = mappings_version(self.mappings)
+        self._root = {}
+        for original_domain, replacement_domain in self.mappings.items():
+            node = self._root
+            for label in reversed(original_domain.lower().split(".")):
+                node = node.setdefault(label, {})
+            node[_REPLACEMENT] = replacement_domain
+
+    def __len__(self):
+        return len(self.mappings)
+
+    def matches_hostname(self, hostname: str) -> bool:
+        """Tells whether any registered domain is a label suffix of the hostname."""
+        node = self._root
+        for label in reversed(hostname.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if _REPLACEMENT in node:
+                return True
+        return False
+
+    def mentions_mapped_domain(self, text: str) -> bool:
+        """Cheap pre-filter: tells whether a text contains any hostname this index maps."""
+        for match in _HOSTNAME_PATTERN.finditer(text):
+            if self.matches_hostname(match.group().lower()):
+                return True
+        return False
+
+    def rewrite_hostname(self, hostname: str):
+        """
+        Returns the hostname with its longest registered domain replaced, keeping
+        subdomains, or None if no mapping applies. Hostnames already ending with
+        the replacement domain are left alone.
+        """
+        new_hostname, _ = self.lookup(hostname)
+        return new_hostname
+
+    def lookup(self, hostname: str):
+        """Like rewrite_hostname, but returns (new hostname, matched domain) or (None, None)."""
+        labels = hostname.split(".")
+        node = self._root
+        matches = []
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                break
+            replacement_domain = node.get(_REPLACEMENT)
+            if replacement_domain is not None:
+                matches.append((depth, replacement_domain))
+
+        # Prefer the longest match, falling back to shorter ones like the old mapping loop did
+        for depth, replacement_domain in reversed(matches):
+            if hostname.endswith(replacement_domain):
+                continue
+            subdomain_labels = labels[:-depth]
+            return ".".join(subdomain_labels + [replacement_domain]), ".".join(labels[-depth:])
+        return None, None
+
+class MappingsWatcher:
+    """
+    Polls the mappings file for changes. A changed file is read, validated and
+    compiled in a worker thread, then handed to `apply(mappings, index)` on the
+    event loop, so messages never see a half-built table. A file that fails to
+    load is rejected and the previous table stays in use.
+    """
+
+    def __init__(self, apply, path: str = MAPPINGS_FILE, interval: float = 5.0):
+        self.apply = apply
+        self.path = path
+        self.interval = interval
+        self.last_error = None
+        self.last_checked = None
+        self._signature = self._file_signature()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_if_changed(self):
+        """Returns (mappings, index) for a changed, valid file, or None."""
+        self.last_checked = time.time()
+        signature = self._file_signature()
+        if signature is None or signature == self._signature:
+            return None
+        # Remember the signature even if the file is bad, so it is reported only once
+        self._signature = signature
+        try:
+            mappings = validate_mappings(load_mappings(self.path))
+            index = DomainIndex(mappings)
+        except (OSError, ValueError) as e:
+            self.last_error = f"{self.path}: {e}"
+            logger.error("Rejected mappings file %s, keeping the current mappings: %s", self.path, e)
+            return None
+        self.last_error = None
+        return mappings, index
+
+    def _load(self):
+        self._signature = self._file_signature()
+        mappings = validate_mappings(load_mappings(self.path))
+        return mappings, DomainIndex(mappings)
+
+    async def load(self):
+        """Loads the mappings whatever the file's state, as at startup; raises if the file is missing or invalid."""
+        loop = asyncio.get_running_loop()
+        self.apply(*await loop.run_in_executor(None, self._load))
+
+    async def check(self) -> bool:
+        """Reloads the mappings if the file changed; returns whether new mappings were applied."""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, self._load_if_changed)
+        if result is None:
+            return False
+        self.apply(*result)
+        return True
+
+    async def run(self):
+        """Checks the file every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error("Error reloading the mappings: %s", e)
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MediaGroupBuffer:
+    """
+    Collects the messages of an album, which Telegram delivers as separate updates
+    sharing a media_group_id, and hands them to `on_complete(messages, context)`
+    together once no new part has arrived for `delay` seconds.
+    """
+
+    def __init__(self, on_complete, delay: float = 1.0):
+        self.on_complete = on_complete
+        self.delay = delay
+        # (chat_id, media_group_id) -> [messages, context, flush task]
+        self._albums = {}
+
+    def __len__(self):
+        return len(self._albums)
+
+    def add(self, message, context):
+        """Adds a part of an album; never waits, so later updates of the chat are not held up."""
+        key = (message.chat_id, message.media_group_id)
+        entry = self._albums.get(key)
+        if entry is None:
+            entry = self._albums[key] = [[], context, None]
+        else:
+            entry[2].cancel()
+        entry[0].append(message)
+        entry[2] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.delay)
+        messages, context, _ = self._albums.pop(key)
+        messages.sort(key=lambda message: message.message_id)
+        try:
+            await self.on_complete(messages, context)
+        except Exception as e:
+            logger.error("Error handling album %s: %s", key[1], e)
+
+    def cancel(self) -> int:
+        """Drops the albums still waiting for more parts (at shutdown); returns how many."""
+        count = len(self._albums)
+        for _, _, task in self._albums.values():
+            task.cancel()
+        self._albums.clear()
+        return count
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond in-memory work to slow API calls
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Gauge:
+    """Value that goes up and down (work in progress), optionally split by labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(labels.get(name, "") for name in self.labelnames)] = value
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def values(self) -> dict:
+        """Non-zero values by label values."""
+        with self._lock:
+            return {key: value for key, value in self._values.items() if value}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    """Distribution of observed values (latencies) in cumulative buckets, optionally split by labels."""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def snapshot(self, predicate=None) -> list:
+        """[count per bucket, sum, count] merged over the label sets predicate(labels) accepts (all by default)."""
+        merged = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._values.items():
+                if predicate is None or predicate(dict(zip(self.labelnames, key))):
+                    merged[0] = [a + b for a, b in zip(merged[0], bucket_counts)]
+                    merged[1] += total
+                    merged[2] += count
+        return merged
+
+    def summarize(self, before: list, after: list, quantile: float = 0.99) -> dict:
+        """
+        Count, mean and estimated quantile of the values observed between two
+        snapshots. The quantile is interpolated within its bucket, as Prometheus does.
+        """
+        counts = [b - a for a, b in zip(before[0], after[0])]
+        count = after[2] - before[2]
+        if not count:
+            return {"count": 0, "mean": None, "quantile": None}
+        rank = quantile * count
+        cumulative = 0
+        estimate = self.buckets[-1]
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                if index < len(self.buckets):
+                    lower = self.buckets[index - 1] if index else 0.0
+                    estimate = lower + (self.buckets[index] - lower) * (rank - cumulative) / bucket_count
+                break
+            cumulative += bucket_count
+        return {"count": count, "mean": (after[1] - before[1]) / count, "quantile": estimate}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), bucket_counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Pipeline metrics
+UPDATES_RECEIVED = Counter("bot_updates_received_total", "Updates received from Telegram.")
+UPDATES_SHED = Counter("bot_updates_shed_total", "Updates dropped before handling, by reason and priority class.", ["reason", "priority"])
+HANDLED_UPDATES = Counter("bot_handled_updates_total", "Updates handled, by handler and outcome.", ["handler", "outcome"])
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Time spent in a handler, by handler and outcome.", ["handler", "outcome"])
+STAGE_LATENCY = Histogram("bot_stage_latency_seconds", "Time spent in each pipeline stage (checks, parsing, API and database calls).", ["stage"])
+REWRITES = Counter("bot_rewrites_total", "Links rewritten, by mapped domain.", ["domain"])
+OUTBOUND_WAIT = Histogram("bot_outbound_wait_seconds", "Time outgoing requests waited for the rate limiter.")
+HANDLERS_IN_FLIGHT = Gauge("bot_handlers_in_flight", "Handlers running right now, by handler.", ["handler"])
+EVENT_LOOP_LAG = Histogram("bot_event_loop_lag_seconds", "How late the event loop ran a timer, i.e. how long it was blocked.")
+
+def instrument_handler(func):
+    """
+    Counts and times a handler. The wrapped coroutine returns its outcome
+    ("rewritten", "untouched", "unauthorized", ...); exceptions count as "error".
+    """
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        HANDLERS_IN_FLIGHT.inc(handler=func.__name__)
+        try:
+            outcome = await func(*args, **kwargs) or "untouched"
+            return outcome
+        finally:
+            HANDLERS_IN_FLIGHT.dec(handler=func.__name__)
+            HANDLED_UPDATES.inc(handler=func.__name__, outcome=outcome)
+            latency = time.perf_counter() - start
+            HANDLER_LATENCY.observe(latency, handler=func.__name__, outcome=outcome)
+            if logger.isEnabledFor(logging.DEBUG):
+                update = args[0] if args else None
+                chat = getattr(update, "effective_chat", None)
+                logger.debug(
+                    "%s handled an update: %s", func.__name__, outcome,
+                    extra={"handler": func.__name__, "outcome": outcome, "latency": round(latency, 6), "chat_id": getattr(chat, "id", None), "sampled": True},
+                )
+    return wrapper
+
+# HTTP endpoints served by the metrics server: path -> callable returning (status, content type, body)
+_routes = {"/metrics": lambda: (200, "text/plain; version=0.0.4", render_metrics())}
+
+def add_route(path: str, handler):
+    """Serves another endpoint (for example a health check) from the metrics server."""
+    _routes[path] = handler
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers; the endpoints take no input
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) > 1 else "/"
+        route = _routes.get(path)
+        if route:
+            status, content_type, body = route()
+        else:
+            status, content_type, body = 404, "text/plain", "Not found\n"
+        payload = body.encode()
+        reason = {200: "OK", 404: "Not Found", 503: "Service Unavailable"}.get(status, "")
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug("Error serving metrics request: %s", e)
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int):
+    """Starts the local HTTP server exposing /metrics."""
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info("Metrics available on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from metrics import STAGE_LATENCY, OUTBOUND_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, passed as rate_limit_args (lower goes first; ExtBot drops falsy values)
+PRIORITY_ADMIN = 1
+PRIORITY_NORMAL = 2
+
+# Endpoints that are never throttled
+_UNLIMITED_ENDPOINTS = {"getMe", "getUpdates", "setWebhook", "deleteWebhook"}
+
+# Telegram's per-chat limits apply to messages posted in the chat
+_CHAT_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+
+# Idle per-chat buckets are pruned once there are more than this many
+_MAX_IDLE_CHAT_BUCKETS = 10000
+
+def _chat_key(chat_id):
+    """Key of a chat's bucket and pause: handlers pass IDs as str and int alike, usernames stay as they are."""
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+class TokenBucket:
+    """Holds up to capacity tokens, refilled at rate tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """Takes one token."""
+        self._refill()
+        self.tokens -= 1
+
+    def refund(self):
+        """Gives back a token taken for a request that was not counted."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def reserve(self) -> float:
+        """Takes one token now, going into debt if needed, and returns how long to wait for it."""
+        self.consume()
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Throttles every Bot API request with a global token bucket, and messages posted
+    to a chat with a token bucket per chat.
+    Requests waiting for a global token are served by priority, so admin command
+    responses overtake queued link corrections; they are also counted against their
+    chat's bucket without waiting for it. A 429 response pauses the chat (or
+    everything, for requests without a chat) for its retry_after before retrying;
+    the rejected request gives its chat token back and takes a new one only once the
+    pause is over, so it holds no place in the chat's queue while backing off.
+    """
+
+    def __init__(self, global_rate=30.0, chat_rate_per_minute=20.0, max_retries=3):
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate_per_minute / 60
+        self._chat_capacity = chat_rate_per_minute
+        self._max_retries = max_retries
+        self._chat_buckets = {}
+        self._chat_paused_until = {}
+        self._global_paused_until = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._dispatcher = None
+        # Statistics
+        self._waiting = 0
+        self._requests = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests currently waiting for a per-chat or global token."""
+        return self._waiting
+
+    def stats(self) -> dict:
+        """Queue depth and wait-time statistics."""
+        return {
+            "queue_depth": self._waiting,
+            "requests": self._requests,
+            "avg_wait": self._total_wait / self._requests if self._requests else 0.0,
+            "max_wait": self._max_wait,
+            "retries": self._retries,
+        }
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > _MAX_IDLE_CHAT_BUCKETS:
+                self._prune_chat_buckets()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_capacity)
+        return bucket
+
+    def _chat_pause(self, chat_id) -> float:
+        return self._chat_paused_until.get(chat_id, 0.0) - time.monotonic()
+
+    def _prune_chat_buckets(self):
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle()]:
+            del self._chat_buckets[chat_id]
+        for chat_id in [chat_id for chat_id, until in self._chat_paused_until.items() if until <= now]:
+            del self._chat_paused_until[chat_id]
+
+    async def _acquire_global(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        """Hands out global tokens to waiting requests, highest priority first."""
+        while self._queue:
+            delay = max(self._global_bucket.delay(), self._global_paused_until - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            self._global_bucket.consume()
+            future.set_result(None)
+
+    async def _wait_turn(self, chat_id, priority, chat_limited):
+        start = time.monotonic()
+        self._waiting += 1
+        try:
+            if chat_id is not None:
+                # A chat paused by a 429 waits even for requests its bucket does not count
+                pause = self._chat_pause(chat_id)
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                if chat_limited:
+                    bucket = self._chat_bucket(chat_id)
+                    if priority <= PRIORITY_ADMIN:
+                        # Admin responses jump the chat's queue but still count against it
+                        bucket.consume()
+                    else:
+                        delay = bucket.reserve()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+            await self._acquire_global(priority)
+        finally:
+            self._waiting -= 1
+        waited = time.monotonic() - start
+        self._requests += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        OUTBOUND_WAIT.observe(waited)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in _UNLIMITED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id = _chat_key(data.get("chat_id"))
+        chat_limited = endpoint.startswith(_CHAT_LIMITED_PREFIXES)
+        priority = PRIORITY_NORMAL if rate_limit_args is None else rate_limit_args
+        retries = 0
+        while True:
+            await self._wait_turn(chat_id, priority, chat_limited)
+            try:
+                with STAGE_LATENCY.time(stage=f"telegram.{endpoint}"):
+                    return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if retries >= self._max_retries:
+                    raise
+                retries += 1
+                self._retries += 1
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                paused_until = time.monotonic() + retry_after
+                if chat_id is not None:
+                    self._chat_paused_until[chat_id] = paused_until
+                    if chat_limited:
+                        # Telegram did not count the rejected message
+                        self._chat_bucket(chat_id).refund()
+                else:
+                    self._global_paused_until = paused_until
+                logger.warning("Flood control on %s (chat %s): retrying in %ss (%s/%s).", endpoint, chat_id, retry_after, retries, self._max_retries, extra={"chat_id": chat_id})
@@ -0,0 +1,210 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import queue
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import db
+from metrics import add_route, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+# Virtual nodes per worker on the hash ring; more gives a more even split
+RING_REPLICAS = 100
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """
+    Consistent hash ring mapping shard keys to workers. Adding or removing a
+    worker only moves the keys in the ranges its virtual nodes cover.
+    """
+
+    def __init__(self, nodes=(), replicas: int = RING_REPLICAS):
+        self.replicas = replicas
+        self._hashes = []
+        self._nodes = {}
+        for node in nodes:
+            self.add_node(node)
+
+    def __len__(self):
+        return len(set(self._nodes.values()))
+
+    def add_node(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            if point not in self._nodes:
+                bisect.insort(self._hashes, point)
+                self._nodes[point] = node
+
+    def remove_node(self, node):
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            if self._nodes.get(point) == node:
+                del self._nodes[point]
+                self._hashes.remove(point)
+
+    def node_for(self, key):
+        """Returns the worker that owns a key."""
+        if not self._hashes:
+            raise LookupError("The hash ring has no nodes.")
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[self._hashes[index]]
+
+def shard_key(update: Update):
+    """Key an update is routed by: its chat, so every chat is handled by a single worker."""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return update.update_id
+
+def run_worker(worker_id, inbox, events):
+    """Entry point of a worker process: runs the bot handlers on the updates routed to it."""
+    asyncio.run(_worker_loop(worker_id, inbox, events))
+
+async def _worker_loop(worker_id, inbox, events):
+    from main import build_application, configure
+
+    settings = configure(worker_id)
+    # Tell the front end when this worker changes the groups, so it can resync the others,
+    # and when it sees a new group member, so the others answer that user's inline queries
+    db.add_group_listener(lambda: events.put(("groups", worker_id, None)))
+    db.add_member_listener(lambda chat_id, user_id: events.put(("member", worker_id, (str(chat_id), user_id))))
+
+    # The group registry is loaded by post_init, with the rest of the warm-up
+    app = build_application(settings, with_updater=False, worker_id=worker_id)
+    loop = asyncio.get_running_loop()
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        events.put(("ready", worker_id, None))
+        logger.info("Worker %s started.", worker_id)
+        try:
+            while True:
+                kind, payload = await loop.run_in_executor(None, inbox.get)
+                if kind == "stop":
+                    break
+                elif kind == "resync":
+                    count = await db._run_in_executor(db.load_allowed_groups)
+                    logger.info("Worker %s resynced %s authorized groups.", worker_id, count)
+                elif kind == "member":
+                    db.remember_member(*payload, notify=False)
+                elif kind == "update":
+                    await app.update_queue.put(Update.de_json(json.loads(payload), app.bot))
+        finally:
+            await app.stop()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
+    logger.info("Worker %s stopped.", worker_id)
+
+class ShardedFrontend:
+    """
+    Receives updates (polling or webhook) in a single process and routes each one
+    by consistent hash of its chat to one of the worker processes. Updates of a
+    chat always reach the same worker in order, so per-chat ordering holds.
+    The front end is ready once every worker has finished its warm-up.
+    """
+
+    def __init__(self, worker_count: int):
+        self._context = multiprocessing.get_context("spawn")
+        self._events = self._context.Queue()
+        self._inboxes = {}
+        self._processes = {}
+        self._ready_workers = set()
+        self.ring = HashRing()
+        for worker_id in range(worker_count):
+            self.add_worker(worker_id)
+
+    def add_worker(self, worker_id):
+        inbox = self._context.Queue()
+        process = self._context.Process(target=run_worker, args=(worker_id, inbox, self._events), name=f"bot-worker-{worker_id}", daemon=True)
+        process.start()
+        self._inboxes[worker_id] = inbox
+        self._processes[worker_id] = process
+        self.ring.add_node(worker_id)
+
+    def remove_worker(self, worker_id):
+        self.ring.remove_node(worker_id)
+        self._ready_workers.discard(worker_id)
+        self._inboxes.pop(worker_id).put(("stop", None))
+        process = self._processes.pop(worker_id)
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+    def route(self, update: Update):
+        worker_id = self.ring.node_for(shard_key(update))
+        self._inboxes[worker_id].put(("update", update.to_json()))
+
+    def broadcast_resync(self, source_worker=None):
+        for worker_id, inbox in self._inboxes.items():
+            if worker_id != source_worker:
+                inbox.put(("resync", None))
+
+    def broadcast_member(self, member, source_worker=None):
+        """Passes a (chat_id, user_id) membership seen by one worker to the others."""
+        for worker_id, inbox in self._inboxes.items():
+            if worker_id != source_worker:
+                inbox.put(("member", member))
+
+    def is_ready(self) -> bool:
+        """Whether every worker has finished its warm-up."""
+        return bool(self._inboxes) and self._ready_workers.issuperset(self._inboxes)
+
+    def handle_event(self, kind, worker_id, payload=None):
+        """Handles an event sent by a worker: it finished starting, changed the groups or saw a new member."""
+        if kind == "ready":
+            self._ready_workers.add(worker_id)
+        elif kind == "groups":
+            self.broadcast_resync(worker_id)
+        elif kind == "member":
+            self.broadcast_member(payload, worker_id)
+
+    async def _relay_events(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                kind, worker_id, payload = await loop.run_in_executor(None, self._events.get, True, 1)
+            except queue.Empty:
+                continue
+            self.handle_event(kind, worker_id, payload)
+
+    async def _start_health_server(self, host, port):
+        add_route("/healthz", lambda: (200, "text/plain", "ok\n"))
+        add_route("/ready", lambda: (200, "text/plain", "ready\n") if self.is_ready() else (503, "text/plain", "starting\n"))
+        return await start_metrics_server(host, port)
+
+    async def run(self, token, webhook=None, health=None):
+        """
+        Receives updates until cancelled; webhook is a dict of start_webhook arguments.
+        With health as (host, port), the health checks are served there, as in a single process.
+        """
+        update_queue = asyncio.Queue()
+        updater = Updater(Bot(token), update_queue)
+        relay = asyncio.create_task(self._relay_events())
+        server = await self._start_health_server(*health) if health else None
+        async with updater:
+            if webhook:
+                await updater.start_webhook(**webhook)
+            else:
+                await updater.start_polling()
+            logger.info("Front end routing updates to %s workers.", len(self.ring))
+            try:
+                while True:
+                    self.route(await update_queue.get())
+            finally:
+                relay.cancel()
+                if server:
+                    server.close()
+                await updater.stop()
+
+    def stop(self):
+        for worker_id in list(self._inboxes):
+            self.remove_worker(worker_id)
@@ -0,0 +1,517 @@
+import abc
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Fields count_unauthorized_attempts can group by: name -> (ID field, name field)
+ATTEMPT_GROUPINGS = {"added_by": ("added_by_id", "added_by_name"), "chat": ("chat_id", "chat_name")}
+
+# MongoDB's TTL index expires documents by a date field; 85 is IndexOptionsConflict, raised when
+# an index on the same keys exists with other options (another expireAfterSeconds)
+TTL_INDEX_NAME = "timestamp_1"
+INDEX_OPTIONS_CONFLICT = 85
+
+def as_utc(timestamp: datetime) -> datetime:
+    """Attempt timestamps are UTC; naive ones (written by older versions) are taken as UTC too."""
+    return timestamp.replace(tzinfo=timezone.utc) if timestamp.tzinfo is None else timestamp.astimezone(timezone.utc)
+
+def encode_cursor(timestamp: datetime, attempt_id) -> str:
+    """Position of an attempt in the newest-first order, short enough for callback data."""
+    return f"{as_utc(timestamp).strftime('%Y%m%d%H%M%S%f')}:{attempt_id}"
+
+def decode_cursor(cursor: str) -> tuple:
+    """Returns (UTC timestamp, attempt ID as a string); raises ValueError for a malformed cursor."""
+    timestamp, attempt_id = cursor.split(":", 1)
+    return datetime.strptime(timestamp, "%Y%m%d%H%M%S%f").replace(tzinfo=timezone.utc), attempt_id
+
+class Storage(abc.ABC):
+    """
+    Where the bot keeps its groups, their mapping overrides and the unauthorized
+    attempts. db.py serves the hot lookups from memory and calls a Storage only to
+    load and change them. Methods are blocking: db.py runs them in its executor.
+    Group IDs are strings; overrides are {domain: replacement or None}; attempt
+    timestamps are timezone-aware UTC datetimes.
+    """
+
+    @abc.abstractmethod
+    def ping(self):
+        """Raises if the backend cannot be reached."""
+
+    @abc.abstractmethod
+    def create_database(self):
+        """Creates whatever tables and indexes the backend needs; safe to call every start."""
+
+    @abc.abstractmethod
+    def add_group(self, chat_id: str, chat_name: str):
+        """Adds a group, or renames it if it exists (keeping its overrides)."""
+
+    @abc.abstractmethod
+    def remove_group(self, chat_id: str) -> bool:
+        """Removes a group; returns whether it existed."""
+
+    @abc.abstractmethod
+    def add_groups(self, groups: dict):
+        """Adds or renames many groups ({chat_id: name}) in one bulk write."""
+
+    @abc.abstractmethod
+    def remove_groups(self, chat_ids: list) -> int:
+        """Removes many groups in one bulk write; returns how many existed."""
+
+    @abc.abstractmethod
+    def get_all_groups(self) -> list:
+        """Returns every group as {"_id": chat_id, "name": name}."""
+
+    @abc.abstractmethod
+    def get_groups(self, limit: int = 20, cursor: str = None, search: str = None) -> tuple:
+        """
+        Returns a page of groups ordered by ID, optionally only those whose name or
+        ID contains `search` (ignoring case), and the cursor of the next page (None
+        on the last one). The cursor is the last ID of the page. Backends may narrow
+        the search to what their indexes serve: a numeric search to the start of the
+        ID, a name search to whole words.
+        """
+
+    @abc.abstractmethod
+    def load_groups(self) -> dict:
+        """Returns every group ID with its mapping overrides ({} when it has none)."""
+
+    @abc.abstractmethod
+    def save_group_overrides(self, chat_id: str, overrides: dict):
+        """Replaces a group's mapping overrides."""
+
+    @abc.abstractmethod
+    def log_unauthorized_groups(self, attempts: list):
+        """
+        Records attempts in one bulk write. Each is a dict of chat_id, chat_name,
+        added_by_id, added_by_name and timestamp. Attempts older than the backend's
+        `attempts_retention` seconds (if not 0) are dropped.
+        """
+
+    @abc.abstractmethod
+    def get_unauthorized_attempts(self, limit: int = 10, cursor: str = None) -> tuple:
+        """
+        Returns a page of attempts, newest first, and the cursor of the next page
+        (None on the last one). Attempts are dicts with the fields given to
+        log_unauthorized_groups.
+        """
+
+    @abc.abstractmethod
+    def count_unauthorized_attempts(self, by: str, limit: int = 10) -> list:
+        """
+        Counts attempts per adder (by="added_by") or per group (by="chat"), most
+        first, as {"id", "name", "count", "last"} dicts.
+        """
+
+    def close(self):
+        pass
+
+class MongoStorage(Storage):
+    """MongoDB backend; the client is created on first use, so building one does no I/O."""
+
+    def __init__(self, uri: str = None, db_name: str = None, max_pool_size: int = 8, attempts_retention: int = 0):
+        self.uri = uri
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.attempts_retention = attempts_retention
+        self._client = None
+        self._db = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            with self._connect_lock:
+                if self._db is None:
+                    from pymongo import MongoClient
+                    # tz_aware: dates come back as UTC datetimes, like they are written
+                    self._client = MongoClient(self.uri, maxPoolSize=self.max_pool_size, tz_aware=True)
+                    self._db = self._client[self.db_name]
+        return self._db
+
+    def ping(self):
+        self.db.command("ping")
+
+    def create_database(self):
+        from pymongo.errors import OperationFailure
+        attempts = self.db.unauthorized_groups
+        # MongoDB enforces the retention itself, with a TTL index on the timestamp
+        ttl = {"expireAfterSeconds": self.attempts_retention} if self.attempts_retention else {}
+        try:
+            attempts.create_index("timestamp", **ttl)
+        except OperationFailure as e:
+            if e.code != INDEX_OPTIONS_CONFLICT:
+                raise
+            if self.attempts_retention:
+                # The index exists with another retention: change it in place
+                self.db.command("collMod", "unauthorized_groups", index={"keyPattern": {"timestamp": 1}, "expireAfterSeconds": self.attempts_retention})
+            else:
+                # Retention was turned off: a TTL index left behind would keep deleting attempts
+                # (and expireAfterSeconds 0 would delete them all), so replace it with a plain one
+                attempts.drop_index(TTL_INDEX_NAME)
+                attempts.create_index("timestamp")
+        attempts.create_index([("timestamp", -1), ("_id", -1)])
+        attempts.create_index("chat_id")
+        attempts.create_index("added_by_id")
+        # /list_groups searches names by word; "none" keeps every word (no stemming or stop words)
+        self.db.groups.create_index([("name", "text")], default_language="none")
+
+    def add_group(self, chat_id, chat_name):
+        self.db.groups.update_one({"_id": chat_id}, {"$set": {"name": chat_name}}, upsert=True)
+
+    def remove_group(self, chat_id):
+        return self.db.groups.delete_one({"_id": chat_id}).deleted_count > 0
+
+    def add_groups(self, groups):
+        from pymongo import UpdateOne
+        if groups:
+            self.db.groups.bulk_write([UpdateOne({"_id": chat_id}, {"$set": {"name": name}}, upsert=True) for chat_id, name in groups.items()], ordered=False)
+
+    def remove_groups(self, chat_ids):
+        if not chat_ids:
+            return 0
+        return self.db.groups.delete_many({"_id": {"$in": list(chat_ids)}}).deleted_count
+
+    def get_all_groups(self):
+        return list(self.db.groups.find({}, {"_id": 1, "name": 1}))
+
+    def get_groups(self, limit=20, cursor=None, search=None):
+        query = {}
+        if cursor:
+            query["_id"] = {"$gt": cursor}
+        if search:
+            search = search.strip()
+            if search.lstrip("-").isdigit():
+                # A group ID: an anchored, case-sensitive prefix is answered from the _id index
+                prefix = search if search.startswith("-") else f"-{search}"
+                query.setdefault("_id", {})["$regex"] = f"^{re.escape(prefix)}"
+            else:
+                # A name: whole words, through the text index
+                query["$text"] = {"$search": search}
+        # Pages walk the _id index; one extra document tells whether there is a next page
+        docs = list(self.db.groups.find(query, {"_id": 1, "name": 1}).sort("_id", 1).limit(limit + 1))
+        return docs[:limit], docs[limit - 1]["_id"] if len(docs) > limit else None
+
+    def load_groups(self):
+        return {
+            str(group["_id"]): {item["domain"]: item["replacement"] for item in group.get("mapping_overrides") or []}
+            for group in self.db.groups.find({}, {"_id": 1, "mapping_overrides": 1})
+        }
+
+    def save_group_overrides(self, chat_id, overrides):
+        # Stored as a list: domains contain dots, which MongoDB field names should not
+        self.db.groups.update_one(
+            {"_id": chat_id},
+            {"$set": {"mapping_overrides": [{"domain": domain, "replacement": replacement} for domain, replacement in overrides.items()]}}
+        )
+
+    def log_unauthorized_groups(self, attempts):
+        self.db.unauthorized_groups.insert_many([dict(attempt) for attempt in attempts], ordered=False)
+
+    def get_unauthorized_attempts(self, limit=10, cursor=None):
+        query = {}
+        if cursor:
+            from bson import ObjectId
+            timestamp, attempt_id = decode_cursor(cursor)
+            attempt_id = ObjectId(attempt_id)
+            query = {"$or": [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "_id": {"$lt": attempt_id}}]}
+        # One extra document tells whether there is a next page
+        docs = list(self.db.unauthorized_groups.find(query).sort([("timestamp", -1), ("_id", -1)]).limit(limit + 1))
+        next_cursor = encode_cursor(docs[limit - 1]["timestamp"], docs[limit - 1]["_id"]) if len(docs) > limit else None
+        return [{key: value for key, value in doc.items() if key != "_id"} for doc in docs[:limit]], next_cursor
+
+    def count_unauthorized_attempts(self, by, limit=10):
+        id_field, name_field = ATTEMPT_GROUPINGS[by]
+        pipeline = [
+            {"$sort": {"timestamp": 1}},
+            {"$group": {"_id": f"${id_field}", "name": {"$last": f"${name_field}"}, "count": {"$sum": 1}, "last": {"$last": "$timestamp"}}},
+            {"$sort": {"count": -1, "last": -1}},
+            {"$limit": limit},
+        ]
+        return [
+            {"id": row["_id"], "name": row["name"], "count": row["count"], "last": row["last"]}
+            for row in self.db.unauthorized_groups.aggregate(pipeline)
+        ]
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+class SQLiteStorage(Storage):
+    """
+    Embedded SQLite backend for small deployments. The database runs in WAL mode,
+    so readers never wait for the writer, and each executor thread keeps its own
+    connection, whose statement cache turns the fixed, parameterized queries below
+    into prepared statements. Every connection makes sure the tables exist, so no
+    call depends on create_database having run first.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS groups (
+            chat_id TEXT PRIMARY KEY,
+            name TEXT,
+            mapping_overrides TEXT
+        );
+        CREATE TABLE IF NOT EXISTS unauthorized_groups (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER,
+            chat_name TEXT,
+            added_by_id INTEGER,
+            added_by_name TEXT,
+            timestamp TEXT
+        );
+        CREATE INDEX IF NOT EXISTS unauthorized_groups_timestamp ON unauthorized_groups (timestamp, id);
+        CREATE INDEX IF NOT EXISTS unauthorized_groups_chat ON unauthorized_groups (chat_id);
+        CREATE INDEX IF NOT EXISTS unauthorized_groups_added_by ON unauthorized_groups (added_by_id);
+    """
+
+    # Fixed queries per grouping, so no SQL is ever built from input
+    COUNT_QUERIES = {
+        by: f"SELECT {id_field}, {name_field}, COUNT(*), MAX(timestamp) FROM unauthorized_groups "
+            f"GROUP BY {id_field} ORDER BY COUNT(*) DESC, MAX(timestamp) DESC LIMIT ?"
+        for by, (id_field, name_field) in ATTEMPT_GROUPINGS.items()
+    }
+
+    def __init__(self, path: str = "data/bot.db", attempts_retention: int = 0):
+        self.path = path
+        self.attempts_retention = attempts_retention
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.executescript(self.SCHEMA)
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def ping(self):
+        self.connection.execute("SELECT 1")
+
+    def create_database(self):
+        # The schema is created with the connection
+        self.connection
+
+    def add_group(self, chat_id, chat_name):
+        self.connection.execute(
+            "INSERT INTO groups (chat_id, name) VALUES (?, ?) ON CONFLICT (chat_id) DO UPDATE SET name = excluded.name",
+            (chat_id, chat_name),
+        )
+
+    def remove_group(self, chat_id):
+        return self.connection.execute("DELETE FROM groups WHERE chat_id = ?", (chat_id,)).rowcount > 0
+
+    def add_groups(self, groups):
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT INTO groups (chat_id, name) VALUES (?, ?) ON CONFLICT (chat_id) DO UPDATE SET name = excluded.name",
+                list(groups.items()),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def remove_groups(self, chat_ids):
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            before = connection.total_changes
+            connection.executemany("DELETE FROM groups WHERE chat_id = ?", [(chat_id,) for chat_id in chat_ids])
+            removed = connection.total_changes - before
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return removed
+
+    def get_all_groups(self):
+        return [{"_id": chat_id, "name": name} for chat_id, name in self.connection.execute("SELECT chat_id, name FROM groups")]
+
+    def get_groups(self, limit=20, cursor=None, search=None):
+        # One statement for every page and search: no cursor is "", no search matches everything
+        pattern = "%" + (search or "").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = self.connection.execute(
+            "SELECT chat_id, name FROM groups WHERE chat_id > ? AND (name LIKE ? ESCAPE '\\' OR chat_id LIKE ? ESCAPE '\\') "
+            "ORDER BY chat_id LIMIT ?",
+            (cursor or "", pattern, pattern, limit + 1),
+        ).fetchall()
+        return [{"_id": chat_id, "name": name} for chat_id, name in rows[:limit]], rows[limit - 1][0] if len(rows) > limit else None
+
+    def load_groups(self):
+        return {
+            chat_id: json.loads(overrides) if overrides else {}
+            for chat_id, overrides in self.connection.execute("SELECT chat_id, mapping_overrides FROM groups")
+        }
+
+    def save_group_overrides(self, chat_id, overrides):
+        self.connection.execute("UPDATE groups SET mapping_overrides = ? WHERE chat_id = ?", (json.dumps(overrides), chat_id))
+
+    def log_unauthorized_groups(self, attempts):
+        connection = self.connection
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT INTO unauthorized_groups (chat_id, chat_name, added_by_id, added_by_name, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (attempt["chat_id"], attempt["chat_name"], attempt["added_by_id"], attempt["added_by_name"], as_utc(attempt["timestamp"]).isoformat(timespec="microseconds"))
+                    for attempt in attempts
+                ],
+            )
+            if self.attempts_retention:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.attempts_retention)
+                connection.execute("DELETE FROM unauthorized_groups WHERE timestamp < ?", (cutoff.isoformat(timespec="microseconds"),))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def get_unauthorized_attempts(self, limit=10, cursor=None):
+        if cursor:
+            timestamp, attempt_id = decode_cursor(cursor)
+            rows = self.connection.execute(
+                "SELECT id, chat_id, chat_name, added_by_id, added_by_name, timestamp FROM unauthorized_groups "
+                "WHERE (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (timestamp.isoformat(timespec="microseconds"), int(attempt_id), limit + 1),
+            ).fetchall()
+        else:
+            rows = self.connection.execute(
+                "SELECT id, chat_id, chat_name, added_by_id, added_by_name, timestamp FROM unauthorized_groups "
+                "ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (limit + 1,),
+            ).fetchall()
+        attempts = [
+            {"chat_id": chat_id, "chat_name": chat_name, "added_by_id": added_by_id, "added_by_name": added_by_name, "timestamp": as_utc(datetime.fromisoformat(timestamp))}
+            for _, chat_id, chat_name, added_by_id, added_by_name, timestamp in rows[:limit]
+        ]
+        next_cursor = encode_cursor(attempts[-1]["timestamp"], rows[limit - 1][0]) if len(rows) > limit else None
+        return attempts, next_cursor
+
+    def count_unauthorized_attempts(self, by, limit=10):
+        rows = self.connection.execute(self.COUNT_QUERIES[by], (limit,))
+        return [
+            {"id": attempt_id, "name": name, "count": count, "last": as_utc(datetime.fromisoformat(last))}
+            for attempt_id, name, count, last in rows
+        ]
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+class MemoryStorage(Storage):
+    """Keeps everything in this process, for tests, benchmarks and throwaway bots; nothing survives a restart."""
+
+    def __init__(self, attempts_retention: int = 0):
+        self.attempts_retention = attempts_retention
+        self._lock = threading.Lock()
+        self._groups = {}
+        # (timestamp, sequence number, attempt), in insertion order
+        self._attempts = []
+        self._sequence = 0
+
+    def ping(self):
+        pass
+
+    def create_database(self):
+        pass
+
+    def add_group(self, chat_id, chat_name):
+        with self._lock:
+            self._groups[chat_id] = {**self._groups.get(chat_id, {"overrides": {}}), "name": chat_name}
+
+    def remove_group(self, chat_id):
+        with self._lock:
+            return self._groups.pop(chat_id, None) is not None
+
+    def add_groups(self, groups):
+        with self._lock:
+            for chat_id, chat_name in groups.items():
+                self._groups[chat_id] = {**self._groups.get(chat_id, {"overrides": {}}), "name": chat_name}
+
+    def remove_groups(self, chat_ids):
+        with self._lock:
+            return sum(self._groups.pop(chat_id, None) is not None for chat_id in chat_ids)
+
+    def get_all_groups(self):
+        with self._lock:
+            return [{"_id": chat_id, "name": group["name"]} for chat_id, group in self._groups.items()]
+
+    def get_groups(self, limit=20, cursor=None, search=None):
+        with self._lock:
+            groups = [{"_id": chat_id, "name": group["name"]} for chat_id, group in sorted(self._groups.items())]
+        if cursor:
+            groups = [group for group in groups if group["_id"] > cursor]
+        if search:
+            search = search.lower()
+            groups = [group for group in groups if search in (group["name"] or "").lower() or search in group["_id"].lower()]
+        return groups[:limit], groups[limit - 1]["_id"] if len(groups) > limit else None
+
+    def load_groups(self):
+        with self._lock:
+            return {chat_id: dict(group["overrides"]) for chat_id, group in self._groups.items()}
+
+    def save_group_overrides(self, chat_id, overrides):
+        with self._lock:
+            if chat_id in self._groups:
+                self._groups[chat_id]["overrides"] = dict(overrides)
+
+    def log_unauthorized_groups(self, attempts):
+        with self._lock:
+            for attempt in attempts:
+                self._sequence += 1
+                attempt = {**attempt, "timestamp": as_utc(attempt["timestamp"])}
+                self._attempts.append((attempt["timestamp"], self._sequence, attempt))
+            if self.attempts_retention:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.attempts_retention)
+                self._attempts = [entry for entry in self._attempts if entry[0] >= cutoff]
+
+    def get_unauthorized_attempts(self, limit=10, cursor=None):
+        with self._lock:
+            entries = sorted(self._attempts, key=lambda entry: entry[:2], reverse=True)
+        if cursor:
+            timestamp, sequence = decode_cursor(cursor)
+            entries = [entry for entry in entries if entry[:2] < (timestamp, int(sequence))]
+        page = entries[:limit]
+        next_cursor = encode_cursor(*page[-1][:2]) if len(entries) > limit else None
+        return [dict(entry[2]) for entry in page], next_cursor
+
+    def count_unauthorized_attempts(self, by, limit=10):
+        id_field, name_field = ATTEMPT_GROUPINGS[by]
+        counts = {}
+        with self._lock:
+            for timestamp, _, attempt in sorted(self._attempts, key=lambda entry: entry[:2]):
+                row = counts.setdefault(attempt[id_field], {"id": attempt[id_field], "count": 0})
+                row.update(name=attempt[name_field], last=timestamp, count=row["count"] + 1)
+        return sorted(counts.values(), key=lambda row: (row["count"], row["last"]), reverse=True)[:limit]
+
+# Backends selectable with STORAGE_BACKEND
+BACKENDS = {"mongodb": MongoStorage, "sqlite": SQLiteStorage, "memory": MemoryStorage}
+
+def create_storage(backend: str = "mongodb", **options) -> Storage:
+    """Creates the storage backend with the given name; raises ValueError for unknown ones."""
+    try:
+        storage_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {backend!r} (expected one of {', '.join(BACKENDS)})")
+    return storage_class(**options)
@@ -0,0 +1,239 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, MagicMock, AsyncMock
+from dotenv import load_dotenv
+
+# Load environment variables for testing
+load_dotenv(dotenv_path="config/.env")
+
+import db
+from storage import MemoryStorage
+
+
+def make_storage(ids=(), storage_class=MemoryStorage):
+    """In-memory storage holding the given groups."""
+    storage = storage_class()
+    for chat_id in ids:
+        MemoryStorage.add_group(storage, str(chat_id), "Group")
+    return storage
+
+
+class TestGroupRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.storage = make_storage(["-100", "-200"])
+        patcher = patch.object(db, "storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.load_allowed_groups()
+
+    def test_loaded_groups_are_allowed(self):
+        self.assertTrue(db.is_group_allowed("-100"))
+        self.assertTrue(db.is_group_allowed(-200))
+        self.assertFalse(db.is_group_allowed("-300"))
+
+    def test_membership_check_does_no_io(self):
+        with patch.object(db, "storage", MagicMock()) as storage:
+            db.is_group_allowed("-100")
+        self.assertFalse(storage.method_calls)
+
+    def test_add_and_remove_update_registry(self):
+        db.add_group("-300", "New")
+        self.assertTrue(db.is_group_allowed("-300"))
+        db.remove_group("-100")
+        self.assertFalse(db.is_group_allowed("-100"))
+
+    def test_bulk_add_and_remove_update_registry(self):
+        db.add_groups({"-300": "Three", "-400": "Four"})
+        self.assertTrue(db.is_group_allowed("-300"))
+        self.assertTrue(db.is_group_allowed("-400"))
+        self.assertEqual(db.remove_groups(["-100", "-300", "-999"]), 2)
+        self.assertFalse(db.is_group_allowed("-100"))
+        self.assertFalse(db.is_group_allowed("-300"))
+        self.assertEqual([group["_id"] for group in db.get_groups(limit=10)[0]], ["-200", "-400"])
+
+    def test_group_listeners_are_notified(self):
+        calls = []
+        db.add_group_listener(lambda: calls.append(True))
+        self.addCleanup(db._group_listeners.clear)
+        db.add_group("-300", "New")
+        db.remove_group("-300")
+        self.assertEqual(len(calls), 2)
+
+    def test_member_listeners_hear_only_new_memberships(self):
+        calls = []
+        db.add_member_listener(lambda chat_id, user_id: calls.append((chat_id, user_id)))
+        self.addCleanup(db._member_listeners.clear)
+        self.addCleanup(db._known_members.clear)
+        db.remember_member("-100", 7)
+        db.remember_member("-100", 7)
+        db.remember_member("-200", 7)
+        # One received from another worker is not passed on again
+        db.remember_member("-100", 8, notify=False)
+        self.assertEqual(calls, [("-100", 7), ("-200", 7)])
+        self.assertTrue(db.is_known_member(8))
+
+    def test_resync_picks_up_external_changes(self):
+        self.storage.remove_group("-200")
+        self.storage.add_group("-400", "External")
+        db.load_allowed_groups()
+        self.assertFalse(db.is_group_allowed("-200"))
+        self.assertTrue(db.is_group_allowed("-400"))
+
+    def test_resync_keeps_changes_made_while_it_reads(self):
+        load_groups = self.storage.load_groups
+
+        def load_during_changes():
+            groups = load_groups()
+            # An admin adds and removes groups while the resync's read is in flight
+            db.add_group("-300", "New")
+            db.remove_group("-100")
+            return groups
+
+        with patch.object(self.storage, "load_groups", load_during_changes):
+            db.load_allowed_groups()
+        self.assertTrue(db.is_group_allowed("-300"))
+        self.assertFalse(db.is_group_allowed("-100"))
+        self.assertEqual(db._reloads, [])
+
+    def test_mapping_overrides_are_stored_on_the_group(self):
+        db.set_group_override("-100", "Instagram.com", "imginn.com")
+        db.set_group_override("-100", "tiktok.com", None)
+        self.assertEqual(db.get_group_overrides("-100"), {"instagram.com": "imginn.com", "tiktok.com": None})
+        self.assertEqual(self.storage.get_all_groups()[0], {"_id": "-100", "name": "Group"})
+
+        # Another process reading the documents sees the same overrides
+        db._group_overrides = {}
+        db.load_allowed_groups()
+        self.assertEqual(db.get_group_overrides("-100"), {"instagram.com": "imginn.com", "tiktok.com": None})
+        self.assertIsNone(db.get_group_overrides("-200"))
+
+    def test_concurrent_overrides_are_all_kept(self):
+        domains = [f"site{i}.com" for i in range(20)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda domain: db.set_group_override("-100", domain, "mirror.com"), domains))
+        self.assertEqual(set(db.get_group_overrides("-100")), set(domains))
+
+    def test_clearing_overrides(self):
+        db.set_group_override("-100", "instagram.com", "imginn.com")
+        db.set_group_override("-100", "tiktok.com", None)
+        db.clear_group_override("-100", "tiktok.com")
+        self.assertEqual(db.get_group_overrides("-100"), {"instagram.com": "imginn.com"})
+        db.clear_group_override("-100")
+        self.assertIsNone(db.get_group_overrides("-100"))
+        self.assertEqual(self.storage.load_groups()["-100"], {})
+
+
+class TestUnauthorizedAttemptBuffer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.storage = MemoryStorage()
+        patcher = patch.object(db, "storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db._pending_attempts.clear()
+        self.addCleanup(db._pending_attempts.clear)
+
+    async def test_attempts_are_written_in_one_batch(self):
+        with patch.object(self.storage, "log_unauthorized_groups", wraps=self.storage.log_unauthorized_groups) as write:
+            for i in range(5):
+                await db.log_unauthorized_group_async(-300 - i, "Spam", 7, "Spammer")
+            write.assert_not_called()
+            self.assertEqual(await db.flush_unauthorized_attempts_async(), 5)
+        write.assert_called_once()
+        self.assertEqual(len(db.get_unauthorized_attempts(limit=10)[0]), 5)
+
+    async def test_full_batch_is_flushed_in_the_background(self):
+        with patch.object(db, "ATTEMPT_BATCH_SIZE", 3):
+            for i in range(3):
+                await db.log_unauthorized_group_async(-300 - i, "Spam", 7, "Spammer")
+            await db.wait_for_background_flushes()
+        self.assertEqual(db._flush_tasks, set())
+        self.assertEqual(db._pending_attempts, [])
+        self.assertEqual(len(self.storage.get_unauthorized_attempts()[0]), 3)
+
+    async def test_reads_include_queued_attempts(self):
+        db.log_unauthorized_group(-300, "Spam", 7, "Spammer")
+        self.assertEqual(db.count_unauthorized_attempts("added_by")[0]["count"], 1)
+
+    async def test_failed_write_keeps_the_attempts(self):
+        db.log_unauthorized_group(-300, "Spam", 7, "Spammer")
+        with patch.object(self.storage, "log_unauthorized_groups", side_effect=RuntimeError("down")):
+            with self.assertRaises(RuntimeError):
+                db.flush_unauthorized_attempts()
+        db.log_unauthorized_group(-400, "Spam", 7, "Spammer")
+        self.assertEqual(db.flush_unauthorized_attempts(), 2)
+        self.assertEqual([attempt["chat_id"] for attempt in self.storage.get_unauthorized_attempts()[0]], [-400, -300])
+
+
+class SlowStorage(MemoryStorage):
+    """Stand-in whose writes take as long as a slow database round trip."""
+
+    def add_group(self, *args, **kwargs):
+        time.sleep(0.5)
+        super().add_group(*args, **kwargs)
+
+
+class TestAsyncDataLayer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch.object(db, "storage", make_storage(["-100"], SlowStorage))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.load_allowed_groups()
+
+    async def test_async_api_round_trip(self):
+        await db.add_group_async("-200", "Other")
+        self.assertTrue(db.is_group_allowed("-200"))
+        groups = await db.get_all_groups_async()
+        self.assertEqual({group["_id"] for group in groups}, {"-100", "-200"})
+        await db.remove_group_async("-200")
+        self.assertFalse(db.is_group_allowed("-200"))
+
+    async def test_slow_db_does_not_block_unrelated_updates(self):
+        from telegram import Chat
+        from handlers import handle_group_join, process_message
+        from tests.test_handlers import use_mock_mappings
+        use_mock_mappings()
+
+        context = MagicMock()
+        context.bot = AsyncMock()
+        context.bot.id = 1
+        context.bot_data = {"admin_id": 42}
+        context.bot.get_chat_member.return_value = MagicMock(can_delete_messages=True)
+
+        # Admin adds the bot to a new group: triggers a slow database write
+        join_update = MagicMock()
+        join_update.effective_chat = MagicMock(id=-300, title="Slow")
+        join_update.my_chat_member.from_user.id = 42
+        join_update.my_chat_member.new_chat_member.status = "member"
+
+        # Meanwhile a link is posted in an unrelated, already authorized group
+        message_update = MagicMock()
+        message_update.effective_chat = MagicMock(id=-100, title="Busy", type=Chat.SUPERGROUP)
+        message_update.message.text = "look https://x.com/user"
+        message_update.message.entities = ()
+        message_update.message.media_group_id = None
+        message_update.message.from_user.first_name = "User"
+
+        finished = {}
+
+        async def timed(name, coro):
+            await coro
+            finished[name] = time.monotonic()
+
+        start = time.monotonic()
+        await asyncio.gather(
+            timed("join", handle_group_join(join_update, context)),
+            timed("message", process_message(message_update, context)),
+        )
+
+        self.assertLess(finished["message"] - start, 0.25)
+        self.assertGreaterEqual(finished["join"] - start, 0.5)
+        context.bot.delete_message.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock, AsyncMock
+
+from diagnostics import LoopLagMonitor, SamplingProfiler
+
+def busy_function(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+def make_admin_context(args):
+    context = MagicMock()
+    context.args = args
+    context.bot_data = {"admin_id": 42}
+    context.bot = AsyncMock()
+    return context
+
+def make_admin_update():
+    update = MagicMock()
+    update.callback_query = None
+    update.effective_user.id = 42
+    update.effective_chat.id = 42
+    update.get_bot.return_value = AsyncMock()
+    return update
+
+class TestLoopLagMonitor(unittest.IsolatedAsyncioTestCase):
+
+    async def test_blocking_the_loop_is_reported(self):
+        monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+        with self.assertLogs("diagnostics", level="WARNING") as logs:
+            # A handler doing blocking work holds up everything else on the loop
+            time.sleep(0.2)
+            await asyncio.sleep(0.05)
+        task.cancel()
+        self.assertGreaterEqual(monitor.max_lag, 0.15)
+        self.assertIn("Event loop blocked", logs.output[0])
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_busy_function_is_found(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        busy_function(0.3)
+        profiler.stop()
+
+        self.assertGreater(profiler.samples, 20)
+        self.assertIn("busy_function", profiler.top(3)[0][0])
+        self.assertIn("test_busy_function_is_found", " ".join(label for label, _ in profiler.top(100, cumulative=True)))
+        self.assertIn("Busiest functions", profiler.report())
+        self.assertIn("test_diagnostics.py:busy_function", profiler.folded())
+
+class TestDiagnosticCommands(unittest.IsolatedAsyncioTestCase):
+
+    async def test_live_stats(self):
+        import commands
+        from metrics import STAGE_LATENCY, UPDATES_RECEIVED
+
+        async def traffic():
+            for _ in range(10):
+                UPDATES_RECEIVED.inc()
+                STAGE_LATENCY.observe(0.02, stage="db.add_group")
+                await asyncio.sleep(0.005)
+
+        update = make_admin_update()
+        context = make_admin_context(["0.2"])
+        tasks = []
+        context.application.create_task = lambda coro: tasks.append(asyncio.create_task(coro))
+
+        # The command is answered right away; the measurement runs in the background
+        await commands.live_stats(update, context)
+        self.assertIn("Measuring for 0.2 seconds", update.get_bot.return_value.send_message.await_args.args[1])
+        await asyncio.gather(*tasks, traffic())
+
+        text = context.bot.send_message.await_args.args[1]
+        self.assertRegex(text, r"- Updates: \d+\.\d/s")
+        self.assertIn("- Handlers in flight: 0", text)
+        self.assertIn("- Database: 10 calls, mean 20.0ms", text)
+        self.assertIn("- Telegram API: no calls", text)
+
+    async def test_profile_is_sent_to_the_admin_chat(self):
+        import commands
+        update = make_admin_update()
+        context = make_admin_context(["0.2", "file"])
+        context.application.create_task = asyncio.create_task
+
+        await commands.profile(update, context)
+        self.assertIn("profiler", context.bot_data)
+        await commands.profile(update, context)
+        self.assertIn("already", update.get_bot.return_value.send_message.await_args.args[1])
+
+        await asyncio.sleep(0.3)
+        self.assertNotIn("profiler", context.bot_data)
+        self.assertIn("Profile of", context.bot.send_message.await_args.args[1])
+        context.bot.send_document.assert_awaited_once()
+
+    async def test_other_users_are_refused_with_a_rate_limited_warning(self):
+        import commands
+        update = make_admin_update()
+        update.effective_user.id = 7
+        update.message.reply_text = AsyncMock()
+        with self.assertLogs("commands", level="WARNING") as logs:
+            await commands.live_stats(update, make_admin_context([]))
+        update.message.reply_text.assert_awaited_once()
+        self.assertTrue(logs.records[0].rate_limited)
+        self.assertEqual(logs.records[0].args, (7, "live_stats"))
+
+if __name__ == '__main__':
+    unittest.main()
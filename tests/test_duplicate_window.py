@@ -0,0 +1,31 @@
+import unittest
+
+from duplicate_window import DuplicateWindow
+
+class TestDuplicateWindow(unittest.TestCase):
+
+    def test_links_are_remembered_per_chat_within_the_window(self):
+        window = DuplicateWindow(60)
+        window.add("-100", "https://fixupx.com/a", 7, now=1000)
+        self.assertEqual(window.get("-100", "https://fixupx.com/a", now=1030), 7)
+        self.assertIsNone(window.get("-200", "https://fixupx.com/a", now=1030))
+        self.assertIsNone(window.get("-100", "https://fixupx.com/b", now=1030))
+        self.assertIsNone(window.get("-100", "https://fixupx.com/a", now=1061))
+
+    def test_old_buckets_are_dropped(self):
+        window = DuplicateWindow(60)
+        for second in range(0, 300, 5):
+            window.add("-100", f"https://fixupx.com/{second}", second, now=second)
+        # Only the buckets overlapping the last minute are kept
+        self.assertLessEqual(len(window), 14)
+        self.assertIsNone(window.get("-100", "https://fixupx.com/0", now=300))
+        self.assertEqual(window.get("-100", "https://fixupx.com/295", now=300), 295)
+
+    def test_memory_is_bounded(self):
+        window = DuplicateWindow(60, buckets=6, max_entries=600)
+        for chat in range(10000):
+            window.add(str(chat), "https://fixupx.com/a", chat, now=1000)
+        self.assertEqual(len(window), 100)
+
+if __name__ == '__main__':
+    unittest.main()
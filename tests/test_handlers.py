@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import patch, MagicMock, AsyncMock
 from dotenv import load_dotenv
 import os
 
@@ -15,47 +16,461 @@ MOCK_MAPPINGS = {
     "fixupx.com": "fixupx.com"
 }
 
+def use_mock_mappings():
+    """Loads MOCK_MAPPINGS as the global mappings; the handlers start with none until the app warms up."""
+    import handlers
+    handlers.apply_mappings(dict(MOCK_MAPPINGS))
+
 class TestURLNormalization(unittest.TestCase):
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_normalize_instagram_url(self, mock_file):
+    def setUp(self):
+        use_mock_mappings()
+
+    def test_normalize_instagram_url(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://instagram.com/user"), "https://ddinstagram.com/user")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_normalize_twitter_url(self, mock_file):
+    def test_normalize_twitter_url(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://twitter.com/user"), "https://fixupx.com/user")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_normalize_x_url(self, mock_file):
+    def test_normalize_x_url(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://x.com/user"), "https://fixupx.com/user")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_normalize_tiktok_url(self, mock_file):
+    def test_normalize_tiktok_url(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://tiktok.com/user"), "https://vxtiktok.com/user")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_normalize_with_subdomain(self, mock_file):
+    def test_normalize_with_subdomain(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://vm.tiktok.com/user"), "https://vm.vxtiktok.com/user")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_no_normalization_needed(self, mock_file):
+    def test_no_normalization_needed(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://google.com"), "https://google.com")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_malformed_url(self, mock_file):
+    def test_malformed_url(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("not a url"), "not a url")
 
-    @patch("builtins.open", new_callable=mock_open, read_data='{"instagram.com": "ddinstagram.com", "twitter.com": "fixupx.com", "x.com": "fixupx.com", "tiktok.com": "vxtiktok.com", "fixupx.com": "fixupx.com"}')
-    def test_already_normalized_url(self, mock_file):
+    def test_already_normalized_url(self):
         from handlers import normalize_url
         self.assertEqual(normalize_url("https://ddinstagram.com/user"), "https://ddinstagram.com/user")
 
+    def test_port_and_userinfo_are_kept(self):
+        from handlers import normalize_url
+        self.assertEqual(normalize_url("https://user:pw@x.com:8443/a?b=1"), "https://user:pw@fixupx.com:8443/a?b=1")
+
+    def test_lookalike_domain_untouched(self):
+        from handlers import normalize_url
+        self.assertEqual(normalize_url("https://dominiox.com/a"), "https://dominiox.com/a")
+
+class TestURLCache(unittest.TestCase):
+
+    def setUp(self):
+        import handlers
+        self.handlers = handlers
+        use_mock_mappings()
+        handlers.URL_CACHE.clear()
+
+    def test_repeated_urls_are_served_from_the_cache(self):
+        hits = self.handlers.URL_CACHE.hits
+        with patch.object(self.handlers, "urlparse", wraps=self.handlers.urlparse) as parse:
+            for _ in range(3):
+                self.assertEqual(self.handlers.normalize_url("https://x.com/viral"), "https://fixupx.com/viral")
+        parse.assert_called_once()
+        self.assertEqual(self.handlers.URL_CACHE.hits, hits + 2)
+
+    def test_oversized_urls_skip_the_cache(self):
+        url = "https://x.com/" + "a" * self.handlers.URL_CACHE_MAX_LENGTH
+        self.assertEqual(self.handlers.normalize_url(url), "https://fixupx.com/" + "a" * self.handlers.URL_CACHE_MAX_LENGTH)
+        self.assertEqual(len(self.handlers.URL_CACHE), 0)
+
+    def test_changing_mappings_clears_the_cache(self):
+        original = self.handlers.DOMAIN_MAPPINGS
+        self.addCleanup(self.handlers.apply_mappings, original)
+        self.assertEqual(self.handlers.normalize_url("https://x.com/a"), "https://fixupx.com/a")
+        self.handlers.apply_mappings({**original, "x.com": "vxtwitter.com"})
+        self.assertEqual(self.handlers.normalize_url("https://x.com/a"), "https://vxtwitter.com/a")
+
+class TestGroupMappings(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        import handlers
+        self.handlers = handlers
+        use_mock_mappings()
+        handlers._bot_permissions.clear()
+        handlers._chat_indexes.clear()
+        self.overrides = {}
+        patcher = patch.object(handlers, "is_group_allowed", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(handlers, "get_group_overrides", side_effect=lambda chat_id: self.overrides.get(chat_id))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def send(self, chat_id, text):
+        context = make_context()
+        await self.handlers.process_message(make_link_update(chat_id=chat_id, text=text), context)
+        return context.bot.send_message.await_args.kwargs["text"] if context.bot.send_message.await_args else None
+
+    async def test_overrides_apply_to_their_group_only(self):
+        self.overrides["-100"] = {"x.com": "vxtwitter.com", "tiktok.com": None}
+        self.assertIn("https://vxtwitter.com/a", await self.send(-100, "see https://x.com/a"))
+        self.assertIsNone(await self.send(-100, "see https://tiktok.com/v/1"))
+        self.assertIn("https://fixupx.com/a", await self.send(-200, "see https://x.com/a"))
+        self.assertIn("https://vxtiktok.com/v/1", await self.send(-200, "see https://tiktok.com/v/1"))
+
+    async def test_merged_table_is_compiled_once_and_rebuilt_on_change(self):
+        self.overrides["-100"] = {"x.com": "vxtwitter.com"}
+        with patch.object(self.handlers, "DomainIndex", wraps=self.handlers.DomainIndex) as compile_index:
+            await self.send(-100, "see https://x.com/a")
+            await self.send(-100, "see https://x.com/b")
+            self.assertEqual(compile_index.call_count, 1)
+
+            # db replaces the overrides dict when an admin changes it
+            self.overrides["-100"] = {"x.com": "fxtwitter.com"}
+            self.assertIn("https://fxtwitter.com/a", await self.send(-100, "see https://x.com/a"))
+            self.assertEqual(compile_index.call_count, 2)
+
+            # A resync replaces the dict with an equal one
+            self.overrides["-100"] = dict(self.overrides["-100"])
+            await self.send(-100, "see https://x.com/a")
+            self.assertEqual(compile_index.call_count, 2)
+
+    async def test_cleared_overrides_are_evicted(self):
+        self.overrides["-100"] = {"x.com": "vxtwitter.com"}
+        self.overrides["-200"] = {"x.com": "fxtwitter.com"}
+        await self.send(-100, "see https://x.com/a")
+        await self.send(-200, "see https://x.com/a")
+        self.assertEqual(set(self.handlers._chat_indexes), {"-100", "-200"})
+
+        del self.overrides["-100"]
+        self.handlers.forget_chat_indexes()
+        self.assertEqual(set(self.handlers._chat_indexes), {"-200"})
+
+class TestDuplicateLinks(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        import handlers
+        from duplicate_window import DuplicateWindow
+        self.handlers = handlers
+        use_mock_mappings()
+        handlers._bot_permissions.clear()
+        for name, value in (("is_group_allowed", MagicMock(return_value=True)), ("RECENT_LINKS", DuplicateWindow(60))):
+            patcher = patch.object(handlers, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_repeat_is_answered_with_one_call(self):
+        context = make_context()
+        context.bot.send_message.return_value = MagicMock(message_id=55)
+        await self.handlers.process_message(make_link_update(chat_id=-1001234), context)
+        self.assertEqual(context.bot.delete_message.await_count, 1)
+
+        update = make_link_update(chat_id=-1001234)
+        update.message.message_id = 8
+        context.bot.get_chat_member.reset_mock()
+        self.assertEqual(await self.handlers.process_message(update, context), "duplicate")
+        # A single reply to the repeat linking the first correction, without a permission check or delete
+        context.bot.get_chat_member.assert_not_awaited()
+        self.assertEqual(context.bot.delete_message.await_count, 1)
+        self.assertEqual(context.bot.send_message.await_count, 2)
+        kwargs = context.bot.send_message.await_args.kwargs
+        self.assertEqual(kwargs["reply_parameters"].message_id, 8)
+        self.assertIn("https://t.me/c/1234/55", kwargs["text"])
+
+        # A different link in the same chat is corrected as usual
+        await self.handlers.process_message(make_link_update(chat_id=-1001234, text="see https://x.com/other"), context)
+        self.assertEqual(context.bot.delete_message.await_count, 2)
+
+    async def test_replace_action_points_to_earlier_correction(self):
+        context = make_context()
+        context.bot.send_message.return_value = MagicMock(message_id=55)
+        await self.handlers.process_message(make_link_update(), context)
+        with patch.object(self.handlers, "DUPLICATE_ACTION", "replace"):
+            self.assertEqual(await self.handlers.process_message(make_link_update(), context), "duplicate")
+        # The repeat is deleted without a re-post, and replaced by a pointer to the first correction
+        self.assertEqual(context.bot.delete_message.await_count, 2)
+        self.assertEqual(context.bot.send_message.await_count, 2)
+        self.assertEqual(context.bot.send_message.await_args.kwargs["reply_parameters"].message_id, 55)
+
+    async def test_replace_answers_in_place_without_delete_rights(self):
+        context = make_context(can_delete=False)
+        context.bot.send_message.return_value = MagicMock(message_id=55)
+        await self.handlers.process_message(make_link_update(), context)
+        update = make_link_update()
+        update.message.message_id = 8
+        with patch.object(self.handlers, "DUPLICATE_ACTION", "replace"):
+            await self.handlers.process_message(update, context)
+        context.bot.delete_message.assert_not_awaited()
+        self.assertEqual(context.bot.send_message.await_args.kwargs["reply_parameters"].message_id, 8)
+
+    async def test_telegram_errors_do_not_fail_the_handler(self):
+        from telegram.error import BadRequest
+        context = make_context()
+        context.bot.send_message.return_value = MagicMock(message_id=55)
+        await self.handlers.process_message(make_link_update(), context)
+        context.bot.send_message.side_effect = BadRequest("Message thread not found")
+        self.assertEqual(await self.handlers.process_message(make_link_update(), context), "error")
+
+    async def test_skip_action(self):
+        context = make_context()
+        await self.handlers.process_message(make_link_update(), context)
+        with patch.object(self.handlers, "DUPLICATE_ACTION", "skip"):
+            await self.handlers.process_message(make_link_update(), context)
+        self.assertEqual(context.bot.send_message.await_count, 1)
+        self.assertEqual(context.bot.delete_message.await_count, 1)
+
+def make_link_update(chat_id=-100, text="see https://x.com/user"):
+    """Builds a mocked group message update containing a rewritable link."""
+    from telegram import Chat
+    update = MagicMock()
+    update.effective_chat = MagicMock(id=chat_id, title="Group", type=Chat.SUPERGROUP)
+    update.message.text = text
+    update.message.entities = ()
+    update.message.media_group_id = None
+    update.message.from_user.first_name = "User"
+    update.message.reply_text = AsyncMock()
+    return update
+
+def make_context(can_delete=True):
+    """Builds a mocked callback context whose bot reports the given delete permission."""
+    context = MagicMock()
+    context.bot = AsyncMock()
+    context.bot.id = 1
+    context.bot_data = {"admin_id": 42}
+    context.bot.get_chat_member.return_value = MagicMock(can_delete_messages=can_delete)
+    return context
+
+class TestBotPermissionCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        import handlers
+        self.handlers = handlers
+        use_mock_mappings()
+        handlers._bot_permissions.clear()
+        patcher = patch.object(handlers, "is_group_allowed", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_permissions_fetched_once_per_chat(self):
+        context = make_context()
+        for _ in range(3):
+            await self.handlers.process_message(make_link_update(), context)
+        context.bot.get_chat_member.assert_awaited_once()
+        self.assertEqual(context.bot.delete_message.await_count, 3)
+
+    async def test_cache_expires_after_ttl(self):
+        context = make_context()
+        await self.handlers.process_message(make_link_update(), context)
+        with patch.object(self.handlers.time, "monotonic", return_value=self.handlers.time.monotonic() + self.handlers.PERMISSION_CACHE_TTL + 1):
+            await self.handlers.process_message(make_link_update(), context)
+        self.assertEqual(context.bot.get_chat_member.await_count, 2)
+
+    async def test_promotion_refreshes_cache(self):
+        context = make_context(can_delete=False)
+        await self.handlers.process_message(make_link_update(), context)
+        context.bot.delete_message.assert_not_awaited()
+
+        promotion = MagicMock()
+        promotion.effective_chat = MagicMock(id=-100, title="Group")
+        promotion.my_chat_member.new_chat_member = MagicMock(status="administrator", can_delete_messages=True)
+        await self.handlers.handle_group_join(promotion, context)
+
+        await self.handlers.process_message(make_link_update(), context)
+        context.bot.get_chat_member.assert_awaited_once()
+        context.bot.delete_message.assert_awaited_once()
+
+    async def test_permission_error_invalidates_and_replies(self):
+        from telegram.error import BadRequest
+        context = make_context()
+        context.bot.delete_message.side_effect = BadRequest("Not enough rights to delete the message")
+        update = make_link_update()
+        await self.handlers.process_message(update, context)
+
+        self.assertNotIn("-100", self.handlers._bot_permissions)
+        context.bot.send_message.assert_not_awaited()
+        update.message.reply_text.assert_awaited_once()
+        self.assertEqual(update.message.reply_text.await_args.kwargs.get("parse_mode"), "MarkdownV2")
+
+    async def test_undeletable_message_keeps_permissions_and_replies(self):
+        from telegram.error import BadRequest
+        context = make_context()
+        context.bot.delete_message.side_effect = BadRequest("Message can't be deleted")
+        update = make_link_update()
+        await self.handlers.process_message(update, context)
+
+        self.assertTrue(self.handlers._bot_permissions["-100"][0])
+        update.message.reply_text.assert_awaited_once()
+        self.assertEqual(update.message.reply_text.await_args.kwargs.get("parse_mode"), "MarkdownV2")
+
+    async def test_entities_format_sends_no_markup(self):
+        context = make_context()
+        with patch.object(self.handlers, "MESSAGE_FORMAT", "entities"):
+            await self.handlers.process_message(make_link_update(), context)
+        kwargs = context.bot.send_message.await_args.kwargs
+        self.assertNotIn("parse_mode", kwargs)
+        self.assertEqual([entity.url for entity in kwargs["entities"] if entity.type == "text_link"], ["https://fixupx.com/user"])
+
+def make_media_message(message_id, caption=None, media_group_id=None):
+    """Builds a real photo message, optionally captioned with a rewritable link and part of an album."""
+    from datetime import datetime
+    from telegram import Chat, Message, MessageEntity, PhotoSize
+    entities = [MessageEntity(MessageEntity.URL, caption.index("https"), len("https://x.com/user"))] if caption else None
+    return Message(
+        message_id=message_id,
+        date=datetime.now(),
+        chat=Chat(id=-100, type=Chat.SUPERGROUP, title="Group"),
+        photo=[PhotoSize(f"small{message_id}", f"s{message_id}", 90, 90), PhotoSize(f"large{message_id}", f"l{message_id}", 1280, 1280)],
+        caption=caption,
+        caption_entities=entities,
+        media_group_id=media_group_id,
+    )
+
+def make_media_update(message):
+    update = MagicMock()
+    update.effective_chat = message.chat
+    update.message = message
+    return update
+
+class TestMediaCaptions(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        import handlers
+        self.handlers = handlers
+        use_mock_mappings()
+        handlers._bot_permissions.clear()
+        patcher = patch.object(handlers, "is_group_allowed", return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_caption_link_is_corrected_on_a_copy(self):
+        context = make_context()
+        context.bot.copy_message.return_value = MagicMock(message_id=50)
+        await self.handlers.process_message(make_media_update(make_media_message(7, "see https://x.com/user")), context)
+
+        kwargs = context.bot.copy_message.await_args.kwargs
+        self.assertIn("https://fixupx.com/user", kwargs["caption"])
+        context.bot.delete_messages.assert_awaited_once_with("-100", [7])
+        context.bot.send_message.assert_not_awaited()
+
+    async def test_caption_limit_counts_the_text_shown(self):
+        context = make_context()
+        context.bot.copy_message.return_value = MagicMock(message_id=50)
+        # Escaping doubles the MarkdownV2 source, but the caption shown fits
+        await self.handlers.process_message(make_media_update(make_media_message(7, "see https://x.com/user " + "." * 700)), context)
+        context.bot.copy_message.assert_awaited_once()
+
+        # Emoji take two UTF-16 units each
+        context = make_context()
+        update = make_media_update(make_media_message(8, "see https://x.com/user " + "\U0001F600" * 600))
+        with patch("telegram.Message.reply_text", AsyncMock()) as reply_text:
+            await self.handlers.process_message(update, context)
+        context.bot.copy_message.assert_not_awaited()
+        reply_text.assert_awaited_once()
+
+    async def test_copy_is_removed_when_the_original_stays(self):
+        from telegram.error import BadRequest, TimedOut
+        context = make_context()
+        context.bot.copy_message.return_value = MagicMock(message_id=50)
+        context.bot.delete_messages.side_effect = [BadRequest("Message can't be deleted"), TimedOut()]
+        update = make_media_update(make_media_message(7, "see https://x.com/user"))
+        with patch("telegram.Message.reply_text", AsyncMock()) as reply_text, self.assertLogs("handlers", level="ERROR"):
+            await self.handlers.process_message(update, context)
+        self.assertEqual(context.bot.delete_messages.await_args.args, ("-100", [50]))
+        # The original is still there: the bot replies to it instead
+        reply_text.assert_awaited_once()
+
+    async def test_copy_is_kept_when_the_delete_times_out(self):
+        from telegram.error import TimedOut
+        context = make_context()
+        context.bot.copy_message.return_value = MagicMock(message_id=50)
+        context.bot.delete_messages.side_effect = TimedOut()
+        update = make_media_update(make_media_message(7, "see https://x.com/user"))
+        with patch("telegram.Message.reply_text", AsyncMock()) as reply_text:
+            self.assertEqual(await self.handlers.process_message(update, context), "rewritten")
+        context.bot.delete_messages.assert_awaited_once_with("-100", [7])
+        reply_text.assert_not_awaited()
+
+    async def test_album_is_corrected_once(self):
+        context = make_context()
+        context.bot.send_media_group.return_value = [MagicMock(message_id=100 + i) for i in range(10)]
+        album = [make_media_message(i, "see https://x.com/user" if i == 3 else None, media_group_id="album") for i in range(10)]
+
+        with patch.object(self.handlers.MEDIA_GROUPS, "delay", 0.05):
+            for message in reversed(album):
+                self.assertEqual(await self.handlers.process_message(make_media_update(message), context), "buffered")
+            await asyncio.sleep(0.15)
+
+        context.bot.get_chat_member.assert_awaited_once()
+        context.bot.send_media_group.assert_awaited_once()
+        media = context.bot.send_media_group.await_args.args[1]
+        self.assertEqual([item.media for item in media], [f"large{i}" for i in range(10)])
+        self.assertIn("https://fixupx.com/user", context.bot.send_media_group.await_args.kwargs["caption"])
+        context.bot.delete_messages.assert_awaited_once_with("-100", list(range(10)))
+        self.assertEqual(len(self.handlers.MEDIA_GROUPS), 0)
+
+def make_message(text, entities):
+    """Builds a real Telegram message so entity offsets are parsed like in production."""
+    from datetime import datetime
+    from telegram import Chat, Message, MessageEntity
+    return Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=-100, type=Chat.SUPERGROUP),
+        text=text,
+        entities=[MessageEntity(type=kind, offset=offset, length=length, url=url) for kind, offset, length, url in entities],
+    )
+
+class TestURLExtraction(unittest.TestCase):
+
+    def setUp(self):
+        import handlers
+        self.handlers = handlers
+        use_mock_mappings()
+
+    def urls(self, message):
+        return [link.url for link in self.handlers.extract_links(message)]
+
+    def test_url_entities(self):
+        text = "héllo 🎉 https://x.com/a and https://google.com"
+        offset = len("héllo 🎉 ".encode("utf-16-le")) // 2
+        message = make_message(text, [("url", offset, 15, None), ("url", offset + 20, 18, None), ("bold", 0, 5, None)])
+        self.assertEqual(self.urls(message), ["https://x.com/a", "https://google.com"])
+
+    def test_text_link_entities_use_hidden_url(self):
+        message = make_message("click here", [("text_link", 6, 4, "https://instagram.com/p/1")])
+        self.assertEqual(self.urls(message), ["https://instagram.com/p/1"])
+
+    def test_scheme_less_links(self):
+        message = make_message("see x.com/foo", [("url", 4, 9, None)])
+        self.assertEqual(self.urls(message), ["x.com/foo"])
+        self.assertEqual(self.handlers.normalize_url("x.com/foo"), "https://fixupx.com/foo")
+
+    def test_entityless_message_without_mapped_domain_is_skipped(self):
+        message = make_message("nothing to see at https://google.com", [])
+        with patch.object(self.handlers, "URL_PATTERN") as url_pattern:
+            self.assertEqual(self.urls(message), [])
+            url_pattern.findall.assert_not_called()
+
+    def test_message_without_mapped_domain_is_not_parsed(self):
+        message = make_message("héllo https://google.com", [("url", 6, 18, None)])
+        with patch.object(self.handlers, "utf16_to_index") as utf16_to_index:
+            self.assertEqual(self.urls(message), [])
+            utf16_to_index.assert_not_called()
+
+    def test_short_links_pass_the_pre_filter_with_a_resolver(self):
+        from link_resolver import LinkResolver
+        message = make_message("see https://t.co/abc", [("url", 4, 16, None)])
+        resolver = LinkResolver(["t.co"])
+        self.assertEqual(self.handlers.extract_links(message), [])
+        self.assertEqual([link.url for link in self.handlers.extract_links(message, resolver=resolver)], ["https://t.co/abc"])
+
+    def test_entityless_message_falls_back_to_scanner(self):
+        message = make_message("look https://tiktok.com/v/1", [])
+        self.assertEqual(self.urls(message), ["https://tiktok.com/v/1"])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import db
+import handlers
+import inline
+from storage import MemoryStorage
+from tests.test_handlers import use_mock_mappings
+
+ADMIN_ID = 42
+MEMBER_ID = 7
+
+def make_inline_update(text, user_id=MEMBER_ID, query_id="1"):
+    update = MagicMock()
+    update.effective_chat = None
+    update.inline_query.id = query_id
+    update.inline_query.query = text
+    update.inline_query.from_user.id = user_id
+    update.inline_query.answer = AsyncMock()
+    return update
+
+def make_context():
+    context = MagicMock()
+    context.bot_data = {"admin_id": ADMIN_ID}
+    return context
+
+class TestInlineQueries(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        use_mock_mappings()
+        inline.INLINE_RESULTS.clear()
+        storage = MemoryStorage()
+        storage.add_group("-100", "Group")
+        patcher = patch.object(db, "storage", storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.load_allowed_groups()
+        db._known_members.clear()
+        db.remember_member("-100", MEMBER_ID)
+
+    def test_links_in_the_query_are_fixed(self):
+        results = inline.inline_results("look x.com/user/status/1 and https://example.org")
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].title, "https://fixupx.com/user/status/1")
+        self.assertEqual(
+            results[0].input_message_content.message_text,
+            "look https://fixupx.com/user/status/1 and https://example.org",
+        )
+        self.assertEqual(inline.inline_results("nothing to fix at example.org"), [])
+
+    def test_results_are_cached(self):
+        inline.inline_results("https://x.com/user")
+        with patch.object(handlers, "normalize_url", wraps=handlers.normalize_url) as normalize:
+            inline.inline_results("https://x.com/user")
+        normalize.assert_not_called()
+
+        # New mappings make the old answers stale
+        handlers.apply_mappings({"x.com": "vxtwitter.com"})
+        self.assertEqual(inline.inline_results("https://x.com/user")[0].title, "https://vxtwitter.com/user")
+
+    async def test_partial_queries_are_debounced(self):
+        context = make_context()
+        updates = [make_inline_update(text, query_id=str(i)) for i, text in enumerate(["x.co", "x.com/us", "x.com/user"])]
+        with patch.object(inline, "INLINE_DEBOUNCE", 0.05):
+            for update in updates:
+                self.assertEqual(await inline.inline_query(update, context), "debounced")
+            await asyncio.sleep(0.1)
+
+        updates[0].inline_query.answer.assert_not_awaited()
+        updates[1].inline_query.answer.assert_not_awaited()
+        updates[2].inline_query.answer.assert_awaited_once()
+        results = updates[2].inline_query.answer.await_args.args[0]
+        self.assertEqual(results[0].title, "https://fixupx.com/user")
+
+    async def test_cached_queries_are_answered_right_away(self):
+        inline.inline_results("x.com/user")
+        update = make_inline_update("x.com/user")
+        self.assertEqual(await inline.inline_query(update, make_context()), "answered")
+        kwargs = update.inline_query.answer.await_args.kwargs
+        self.assertEqual(kwargs["cache_time"], inline.INLINE_CACHE_TIME)
+        self.assertTrue(kwargs["is_personal"])
+
+    async def test_only_members_of_authorized_groups_are_answered(self):
+        stranger = make_inline_update("x.com/user", user_id=99)
+        self.assertEqual(await inline.inline_query(stranger, make_context()), "unauthorized")
+        self.assertEqual(stranger.inline_query.answer.await_args.args[0], [])
+        # Refusals are not cached, so a user who just joined is not kept out
+        self.assertEqual(stranger.inline_query.answer.await_args.kwargs["cache_time"], 0)
+
+        with patch.object(db, "storage", MagicMock()) as storage:
+            self.assertTrue(db.is_known_member(MEMBER_ID))
+        self.assertFalse(storage.method_calls)
+
+        # Removing the group takes the access away
+        db.remove_group("-100")
+        self.assertFalse(db.is_known_member(MEMBER_ID))
+        admin = make_inline_update("", user_id=ADMIN_ID)
+        self.assertEqual(await inline.inline_query(admin, make_context()), "untouched")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from telegram import MessageEntity
+
+from link_resolver import LinkResolver
+
+class RedirectServer:
+    """Local stand-in for a link shortener: path -> (status, Location header, delay in seconds)."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.base = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            self.requests.append((method, path))
+            status, location, delay = self.routes.get(path, (404, None, 0))
+            await asyncio.sleep(delay)
+            headers = f"Location: {location.replace('BASE', self.base)}\r\n" if location else ""
+            writer.write(f"HTTP/1.1 {status} X\r\n{headers}Content-Length: 0\r\n\r\n".encode())
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+class TestLinkResolver(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.resolver = LinkResolver(hosts=["127.0.0.1"], timeout=0.5)
+
+    async def asyncTearDown(self):
+        await self.resolver.close()
+
+    async def test_redirects_are_followed_until_they_leave_the_short_hosts(self):
+        routes = {"/a": (301, "BASE/b", 0), "/b": (302, "https://x.com/user/status/1", 0)}
+        async with RedirectServer(routes) as server:
+            self.assertEqual(await self.resolver.resolve(f"{server.base}/a"), "https://x.com/user/status/1")
+        # The destination itself is never requested
+        self.assertEqual(server.requests, [("HEAD", "/a"), ("HEAD", "/b")])
+
+    async def test_popular_link_is_fetched_once(self):
+        routes = {"/viral": (301, "https://www.tiktok.com/@user/video/1", 0.05)}
+        async with RedirectServer(routes) as server:
+            url = f"{server.base}/viral"
+            results = await asyncio.gather(*(self.resolver.resolve(url) for _ in range(20)))
+            results.append(await self.resolver.resolve(url))
+        self.assertEqual(set(results), {"https://www.tiktok.com/@user/video/1"})
+        self.assertEqual(len(server.requests), 1)
+
+    async def test_timeout_falls_back_to_the_original_link(self):
+        async with RedirectServer({"/slow": (301, "https://x.com/a", 5)}) as server:
+            url = f"{server.base}/slow"
+            self.assertEqual(await self.resolver.resolve(url), url)
+
+    async def test_budget_bounds_the_wait(self):
+        async with RedirectServer({"/slow": (301, "https://x.com/a", 0.3), "/fast": (301, "https://x.com/b", 0)}) as server:
+            slow, fast = f"{server.base}/slow", f"{server.base}/fast"
+            start = time.monotonic()
+            resolved = await self.resolver.resolve_all([slow, fast], budget=0.1)
+            self.assertLess(time.monotonic() - start, 0.25)
+            self.assertEqual(resolved, {slow: slow, fast: "https://x.com/b"})
+
+            # The slow request kept running and is cached for the next message
+            await asyncio.sleep(0.4)
+            self.assertEqual(await self.resolver.resolve_all([slow], budget=0.01), {slow: "https://x.com/a"})
+
+    async def test_links_that_do_not_redirect_are_kept(self):
+        async with RedirectServer({"/page": (200, None, 0)}) as server:
+            self.assertEqual(await self.resolver.resolve(f"{server.base}/page"), f"{server.base}/page")
+
+class TestShortLinksInMessages(unittest.IsolatedAsyncioTestCase):
+
+    async def test_short_link_is_resolved_then_mapped(self):
+        import handlers
+        from tests.test_handlers import make_context, make_link_update, use_mock_mappings
+        use_mock_mappings()
+        handlers._bot_permissions.clear()
+        resolver = LinkResolver(hosts=["t.co"])
+        self.addAsyncCleanup(resolver.close)
+        context = make_context()
+        context.bot_data["link_resolver"] = resolver
+        update = make_link_update(text="look https://t.co/abc")
+        update.message.entities = [MessageEntity(MessageEntity.URL, 5, 17)]
+        with patch.object(handlers, "is_group_allowed", return_value=True), \
+                patch.object(resolver, "_redirect_target", AsyncMock(side_effect=["https://twitter.com/user/status/1"])):
+            await handlers.process_message(update, context)
+        self.assertIn("https://fixupx.com/user/status/1", context.bot.send_message.await_args.kwargs["text"])
+
+if __name__ == '__main__':
+    unittest.main()
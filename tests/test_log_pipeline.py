@@ -0,0 +1,104 @@
+import io
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from log_pipeline import JsonFormatter, RateLimitFilter, SampleFilter, setup_logging, stop_logging
+
+def make_record(msg="Message received from unauthorized group: %s (ID: %s).", args=("Spam", "-100"), **extra):
+    record = logging.LogRecord("handlers", logging.WARNING, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+class TestJsonFormatter(unittest.TestCase):
+
+    def test_structured_fields(self):
+        entry = json.loads(JsonFormatter().format(make_record(chat_id="-100", handler="process_message", latency=0.002)))
+        self.assertEqual(entry["message"], "Message received from unauthorized group: Spam (ID: -100).")
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["chat_id"], "-100")
+        self.assertEqual(entry["handler"], "process_message")
+        self.assertEqual(entry["latency"], 0.002)
+        self.assertNotIn("outcome", entry)
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def test_repeated_warnings_from_a_chat_are_limited(self):
+        log_filter = RateLimitFilter(burst=3, interval=60)
+        passed = [log_filter.filter(make_record(chat_id="-100", rate_limited=True)) for _ in range(1000)]
+        self.assertEqual(sum(passed), 3)
+
+        # Other chats have their own budget
+        self.assertTrue(log_filter.filter(make_record(chat_id="-200", rate_limited=True)))
+        # Records not marked as rate limited always pass
+        self.assertTrue(log_filter.filter(make_record(chat_id="-100")))
+
+    def test_next_window_reports_dropped_records(self):
+        log_filter = RateLimitFilter(burst=1, interval=60)
+        for _ in range(5):
+            log_filter.filter(make_record(chat_id="-100", rate_limited=True))
+        with patch("log_pipeline.time.monotonic", return_value=10 ** 9):
+            record = make_record(chat_id="-100", rate_limited=True)
+            self.assertTrue(log_filter.filter(record))
+        self.assertEqual(record.suppressed, 4)
+
+class TestSampleFilter(unittest.TestCase):
+
+    def test_one_in_rate_sampled_records_pass(self):
+        log_filter = SampleFilter(rate=10)
+        passed = [log_filter.filter(make_record(sampled=True)) for _ in range(100)]
+        self.assertEqual(sum(passed), 10)
+        self.assertTrue(passed[0])
+
+class TestSetupLogging(unittest.TestCase):
+
+    def test_records_are_written_by_the_background_thread(self):
+        root = logging.getLogger()
+        handlers_before = list(root.handlers)
+        level_before = root.level
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bot.log")
+            with patch("sys.stderr", new_callable=io.StringIO):
+                listener = setup_logging(log_format="json", log_file=path, sample_rate=100)
+                try:
+                    logging.getLogger("handlers").info("Message deleted in group %s (ID: %s).", "Group", "-100", extra={"chat_id": "-100"})
+                finally:
+                    stop_logging(listener)
+                    # Again at exit
+                    stop_logging(listener)
+                    for handler in root.handlers[len(handlers_before):]:
+                        root.removeHandler(handler)
+                    root.setLevel(level_before)
+                    for handler in listener.handlers:
+                        handler.close()
+            with open(path) as log_file:
+                entry = json.loads(log_file.readline())
+        self.assertEqual(entry["message"], "Message deleted in group Group (ID: -100).")
+        self.assertEqual(entry["chat_id"], "-100")
+
+    def test_default_format_is_one_text_line(self):
+        root = logging.getLogger()
+        handlers_before = list(root.handlers)
+        level_before = root.level
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bot.log")
+            with patch("sys.stderr", new_callable=io.StringIO):
+                listener = setup_logging(log_file=path)
+                try:
+                    logging.getLogger("handlers").info("Message deleted in group %s (ID: %s).", "Group", "-100")
+                finally:
+                    stop_logging(listener)
+                    for handler in root.handlers[len(handlers_before):]:
+                        root.removeHandler(handler)
+                    root.setLevel(level_before)
+                    for handler in listener.handlers:
+                        handler.close()
+            with open(path) as log_file:
+                line = log_file.readline()
+        self.assertTrue(line.rstrip().endswith(" - handlers - INFO - Message deleted in group Group (ID: -100)."))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from unittest.mock import patch
+
+from lru_cache import LRUCache
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(ttl=10)
+        cache.set("a", 1)
+        with patch("lru_cache.time.monotonic", return_value=10 ** 9):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_membership_check_ignores_expired_entries_and_stats(self):
+        cache = LRUCache(ttl=10)
+        cache.set("a", 1)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        with patch("lru_cache.time.monotonic", return_value=10 ** 9):
+            self.assertNotIn("a", cache)
+        self.assertEqual(cache.stats()["hits"] + cache.stats()["misses"], 0)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=10)
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(cache.stats(), {"size": 1, "maxsize": 10, "hits": 2, "misses": 1, "hit_rate": 2 / 3})
+
+    def test_zero_size_disables_caching(self):
+        cache = LRUCache(maxsize=0)
+        cache.set("a", 1)
+        self.assertIsNone(cache.get("a"))
+
+if __name__ == '__main__':
+    unittest.main()
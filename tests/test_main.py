@@ -0,0 +1,93 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import db
+from main import Settings, add_health_routes, build_application, warm_up
+from metrics import start_metrics_server
+
+ENV = {"BOT_TOKEN": "123:abc", "ADMIN_ID": "42"}
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status
+
+class TestSettings(unittest.TestCase):
+
+    def test_defaults(self):
+        settings = Settings(ENV)
+        self.assertEqual(settings.admin_id, 42)
+        self.assertEqual(settings.bot_mode, "polling")
+
+    def test_invalid_values_are_rejected(self):
+        for env in ({}, {**ENV, "ADMIN_ID": "admin"}, {**ENV, "BOT_MODE": "push"}, {**ENV, "BOT_MODE": "webhook"},
+                    {**ENV, "DUPLICATE_ACTION": "delete"}):
+            with self.assertRaises(ValueError):
+                Settings(env)
+
+class TestStartup(unittest.TestCase):
+
+    def test_workers_share_the_global_rate(self):
+        settings = Settings({**ENV, "OUTBOUND_GLOBAL_RATE": "30", "SHARD_WORKERS": "3"})
+        single = build_application(settings)
+        worker = build_application(settings, with_updater=False, worker_id=1)
+        self.assertEqual(single.bot_data["scheduler"]._global_bucket.rate, 30)
+        self.assertEqual(worker.bot_data["scheduler"]._global_bucket.rate, 10)
+
+    def test_imports_do_no_io(self):
+        # A fresh interpreter: no database client, no mappings file read, no logging set up
+        code = (
+            "import sys, logging\n"
+            "sys.addaudithook(lambda event, args: event == 'open' and 'mappings.json' in str(args[0]) and sys.exit('opened ' + str(args[0])))\n"
+            "import main, db, handlers\n"
+            "assert db.storage is None and handlers.MAPPINGS_LOADED_AT is None\n"
+            "assert not logging.getLogger().handlers\n"
+        )
+        env = {key: value for key, value in os.environ.items() if key not in ("DB_NAME", "MONGO_URI")}
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+class TestWarmUp(unittest.IsolatedAsyncioTestCase):
+
+    def slow(self, result=None):
+        def call():
+            time.sleep(0.1)
+            return result
+        return call
+
+    async def test_tasks_run_concurrently_and_set_ready(self):
+        app = MagicMock()
+        app.bot_data = {"ready": False, "mappings_watcher": MagicMock()}
+        app.bot_data["mappings_watcher"].load = lambda: asyncio.sleep(0.1)
+
+        with patch.object(db, "ping", self.slow()), patch.object(db, "create_database", self.slow()), \
+                patch.object(db, "load_allowed_groups", self.slow(3)):
+            start = time.monotonic()
+            await warm_up(app)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(app.bot_data["ready"])
+
+    async def test_ready_endpoint_follows_warm_up(self):
+        app = MagicMock()
+        app.bot_data = {"ready": False}
+        add_health_routes(app)
+        server = await start_metrics_server("127.0.0.1", 0)
+        self.addAsyncCleanup(server.wait_closed)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+
+        self.assertEqual(await get(port, "/healthz"), 200)
+        self.assertEqual(await get(port, "/ready"), 503)
+        app.bot_data["ready"] = True
+        self.assertEqual(await get(port, "/ready"), 200)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import unittest
+
+from mappings import DomainIndex, MappingsWatcher, mappings_version, validate_mappings
+
+MAPPINGS = {
+    "instagram.com": "ddinstagram.com",
+    "twitter.com": "fixupx.com",
+    "x.com": "fixupx.com",
+    "tiktok.com": "vxtiktok.com",
+    "fixupx.com": "fixupx.com",
+    "vm.tiktok.com": "vm.tiktxk.com",
+}
+
+class TestDomainIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DomainIndex(MAPPINGS)
+
+    def test_exact_domain(self):
+        self.assertEqual(self.index.rewrite_hostname("x.com"), "fixupx.com")
+
+    def test_subdomain_is_kept(self):
+        self.assertEqual(self.index.rewrite_hostname("mobile.twitter.com"), "mobile.fixupx.com")
+
+    def test_longest_registered_domain_wins(self):
+        self.assertEqual(self.index.rewrite_hostname("vm.tiktok.com"), "vm.tiktxk.com")
+        self.assertEqual(self.index.rewrite_hostname("www.tiktok.com"), "www.vxtiktok.com")
+
+    def test_lookalike_domain_is_not_matched(self):
+        self.assertIsNone(self.index.rewrite_hostname("dominiox.com"))
+        self.assertIsNone(self.index.rewrite_hostname("com"))
+
+    def test_already_replacement(self):
+        self.assertIsNone(self.index.rewrite_hostname("fixupx.com"))
+        self.assertIsNone(self.index.rewrite_hostname("ddinstagram.com"))
+
+    def test_mentions_mapped_domain(self):
+        self.assertTrue(self.index.mentions_mapped_domain("look at https://WWW.Instagram.com/p/1"))
+        self.assertTrue(self.index.mentions_mapped_domain("x.com/foo"))
+        self.assertFalse(self.index.mentions_mapped_domain("just chatting, see dominiox.com"))
+        self.assertFalse(self.index.mentions_mapped_domain("no links here"))
+
+class TestMappingsValidation(unittest.TestCase):
+
+    def test_valid_mappings(self):
+        self.assertEqual(validate_mappings(MAPPINGS), MAPPINGS)
+
+    def test_invalid_mappings(self):
+        for bad in ([], {}, {"x.com": 1}, {"not a domain": "fixupx.com"}, {"x.com": "fixupx"}):
+            with self.assertRaises(ValueError):
+                validate_mappings(bad)
+
+    def test_version_ignores_formatting(self):
+        reordered = dict(reversed(list(MAPPINGS.items())))
+        self.assertEqual(mappings_version(reordered), mappings_version(MAPPINGS))
+        self.assertNotEqual(mappings_version({"x.com": "vxtwitter.com"}), mappings_version(MAPPINGS))
+
+class TestMappingsWatcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "mappings.json")
+        self.writes = 0
+        self.write({"x.com": "fixupx.com"})
+        self.applied = []
+        self.watcher = MappingsWatcher(lambda mappings, index: self.applied.append((mappings, index)), self.path)
+
+    def write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content if isinstance(content, str) else json.dumps(content))
+        # Make every write visible to mtime polling, however fast the tests run
+        self.writes += 1
+        os.utime(self.path, ns=(self.writes * 10 ** 9, self.writes * 10 ** 9))
+
+    async def test_unchanged_file_is_not_reloaded(self):
+        self.assertFalse(await self.watcher.check())
+        self.assertEqual(self.applied, [])
+
+    async def test_changed_file_is_compiled_and_applied(self):
+        self.write({"x.com": "vxtwitter.com"})
+        self.assertTrue(await self.watcher.check())
+        mappings, index = self.applied[0]
+        self.assertEqual(mappings, {"x.com": "vxtwitter.com"})
+        self.assertEqual(index.rewrite_hostname("x.com"), "vxtwitter.com")
+
+    async def test_bad_file_is_rejected(self):
+        self.write('{"x.com": ')
+        with self.assertLogs("mappings", "ERROR"):
+            self.assertFalse(await self.watcher.check())
+        self.assertEqual(self.applied, [])
+        self.assertIn("mappings.json", self.watcher.last_error)
+
+        # Fixing the file clears the error
+        self.write({"x.com": "vxtwitter.com"})
+        self.assertTrue(await self.watcher.check())
+        self.assertIsNone(self.watcher.last_error)
+
+    async def test_startup_load_applies_the_file(self):
+        await self.watcher.load()
+        self.assertEqual(self.applied[0][0], {"x.com": "fixupx.com"})
+        # The loaded file does not count as a change afterwards
+        self.assertFalse(await self.watcher.check())
+
+    async def test_startup_load_raises_on_a_bad_file(self):
+        self.write('{"x.com": ')
+        with self.assertRaises(ValueError):
+            await self.watcher.load()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from media_groups import MediaGroupBuffer
+
+def make_part(message_id, media_group_id="album", chat_id=-100):
+    return MagicMock(message_id=message_id, media_group_id=media_group_id, chat_id=chat_id)
+
+class TestMediaGroupBuffer(unittest.IsolatedAsyncioTestCase):
+
+    async def test_parts_are_delivered_together_in_order(self):
+        on_complete = AsyncMock()
+        buffer = MediaGroupBuffer(on_complete, delay=0.05)
+        for message_id in (3, 1, 2):
+            buffer.add(make_part(message_id), "context")
+        await asyncio.sleep(0.1)
+        on_complete.assert_awaited_once()
+        messages, context = on_complete.await_args.args
+        self.assertEqual([message.message_id for message in messages], [1, 2, 3])
+        self.assertEqual(context, "context")
+        self.assertEqual(len(buffer), 0)
+
+    async def test_late_parts_extend_the_wait(self):
+        on_complete = AsyncMock()
+        buffer = MediaGroupBuffer(on_complete, delay=0.06)
+        buffer.add(make_part(1), None)
+        await asyncio.sleep(0.04)
+        buffer.add(make_part(2), None)
+        await asyncio.sleep(0.04)
+        on_complete.assert_not_awaited()
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(on_complete.await_args.args[0]), 2)
+
+    async def test_albums_are_kept_apart(self):
+        on_complete = AsyncMock()
+        buffer = MediaGroupBuffer(on_complete, delay=0.02)
+        buffer.add(make_part(1, "a"), None)
+        buffer.add(make_part(2, "b"), None)
+        buffer.add(make_part(3, "a", chat_id=-200), None)
+        await asyncio.sleep(0.05)
+        self.assertEqual(on_complete.await_count, 3)
+
+    async def test_errors_are_logged_not_raised(self):
+        buffer = MediaGroupBuffer(AsyncMock(side_effect=RuntimeError("boom")), delay=0.01)
+        buffer.add(make_part(1), None)
+        with self.assertLogs("media_groups", level="ERROR"):
+            await asyncio.sleep(0.03)
+
+    async def test_cancel_drops_waiting_albums(self):
+        on_complete = AsyncMock()
+        buffer = MediaGroupBuffer(on_complete, delay=0.02)
+        buffer.add(make_part(1, "a"), None)
+        buffer.add(make_part(2, "b"), None)
+        self.assertEqual(buffer.cancel(), 2)
+        await asyncio.sleep(0.05)
+        on_complete.assert_not_awaited()
+        self.assertEqual(len(buffer), 0)
+
+if __name__ == '__main__':
+    unittest.main()
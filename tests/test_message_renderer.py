@@ -0,0 +1,71 @@
+import unittest
+
+from telegram import MessageEntity, User
+
+from message_renderer import LinkSpan, escape_markdown_v2, render_entities, render_markdown, replace_links, strip_links, utf16_to_index
+
+def spans_for(text, *urls):
+    spans = []
+    position = 0
+    for url in urls:
+        start = text.index(url, position)
+        spans.append(LinkSpan(start, start + len(url), url))
+        position = start + len(url)
+    return spans
+
+class TestEscaping(unittest.TestCase):
+
+    def test_special_characters_are_escaped(self):
+        self.assertEqual(escape_markdown_v2("a_b*c (d) e.f!"), "a\\_b\\*c \\(d\\) e\\.f\\!")
+
+    def test_backslash_is_escaped_once(self):
+        self.assertEqual(escape_markdown_v2("a\\b."), "a\\\\b\\.")
+
+class TestRendering(unittest.TestCase):
+
+    def setUp(self):
+        self.text = "look https://x.com/a and https://x.com/a. wow https://google.com"
+        self.spans = spans_for(self.text, "https://x.com/a", "https://x.com/a")
+        self.url_mappings = {"https://x.com/a": "https://fixupx.com/a"}
+        self.sender = User(id=7, first_name="Ana_B", is_bot=False)
+
+    def test_strip_and_replace_links(self):
+        self.assertEqual(strip_links(self.text, self.spans), "look  and . wow https://google.com")
+        self.assertEqual(replace_links(self.text, self.spans, self.url_mappings), "look https://fixupx.com/a and https://fixupx.com/a. wow https://google.com")
+
+    def test_markdown(self):
+        self.assertEqual(
+            render_markdown(self.text, self.spans, self.url_mappings, self.sender),
+            'Sent by [Ana\\_B](tg://user?id=7)\n\n"look  and \\. wow https://google\\.com"\n\n[Modified link](https://fixupx.com/a)',
+        )
+
+    def test_hidden_links_keep_their_text(self):
+        text = "click here"
+        spans = [LinkSpan(6, 10, "https://x.com/a", inline=False)]
+        self.assertEqual(render_markdown(text, spans, self.url_mappings), '"click here"\n\n[Modified link](https://fixupx.com/a)')
+
+    def test_entities_match_markdown_output(self):
+        text, entities = render_entities(self.text, self.spans, self.url_mappings, self.sender)
+        self.assertEqual(text, 'Sent by Ana_B\n\n"look  and . wow https://google.com"\n\nModified link')
+        mention, link = entities
+        self.assertEqual(mention.type, MessageEntity.TEXT_MENTION)
+        self.assertEqual(text[mention.offset:mention.offset + mention.length], "Ana_B")
+        self.assertEqual(mention.user, self.sender)
+        self.assertEqual(link.type, MessageEntity.TEXT_LINK)
+        self.assertEqual(text[link.offset:link.offset + link.length], "Modified link")
+        self.assertEqual(link.url, "https://fixupx.com/a")
+
+    def test_entity_offsets_count_utf16_units(self):
+        sender = User(id=7, first_name="🎉 Ana", is_bot=False)
+        text, entities = render_entities("🎉 https://x.com/a", spans_for("🎉 https://x.com/a", "https://x.com/a"), self.url_mappings, sender)
+        encoded = text.encode("utf-16-le")
+        for entity, expected in zip(entities, ["🎉 Ana", "Modified link"]):
+            self.assertEqual(encoded[entity.offset * 2:(entity.offset + entity.length) * 2].decode("utf-16-le"), expected)
+
+    def test_utf16_offsets(self):
+        text = "🎉 x.com"
+        self.assertEqual(utf16_to_index(text, [3, 8]), [2, 7])
+        self.assertEqual(utf16_to_index("plain", [1, 5]), [1, 5])
+
+if __name__ == '__main__':
+    unittest.main()
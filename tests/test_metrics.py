@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from metrics import Counter, Gauge, Histogram, HANDLED_UPDATES, HANDLERS_IN_FLIGHT, REWRITES, STAGE_LATENCY, instrument_handler, start_metrics_server
+from tests.test_handlers import make_context, make_link_update, use_mock_mappings
+
+class TestMetricTypes(unittest.TestCase):
+
+    def test_counter_renders_labels(self):
+        counter = Counter("test_events_total", "Events.", ["kind"])
+        counter.inc(kind="a")
+        counter.inc(2, kind='quote"d')
+        lines = counter.render()
+        self.assertIn("# TYPE test_events_total counter", lines)
+        self.assertIn('test_events_total{kind="a"} 1', lines)
+        self.assertIn('test_events_total{kind="quote\\"d"} 2', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        lines = histogram.render()
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn("test_latency_seconds_count 3", lines)
+
+    def test_summary_between_snapshots(self):
+        histogram = Histogram("test_stage_seconds", "Stages.", ["stage"], buckets=(0.01, 0.1, 1.0))
+        histogram.observe(0.5, stage="db.old")
+        is_db = lambda labels: labels["stage"].startswith("db.")
+        before = histogram.snapshot(is_db)
+        for value in [0.005] * 98 + [0.05, 0.5]:
+            histogram.observe(value, stage="db.add_group")
+        histogram.observe(0.9, stage="normalize_url")
+
+        summary = histogram.summarize(before, histogram.snapshot(is_db))
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["mean"], (0.49 + 0.05 + 0.5) / 100)
+        # The 99th value is the one in the (0.01, 0.1] bucket
+        self.assertAlmostEqual(summary["quantile"], 0.1)
+        self.assertEqual(histogram.summarize(before, before)["count"], 0)
+
+    def test_gauge_goes_up_and_down(self):
+        gauge = Gauge("test_running", "Running.", ["handler"])
+        gauge.inc(handler="a")
+        gauge.inc(handler="a")
+        gauge.dec(handler="a")
+        gauge.inc(handler="b")
+        gauge.dec(handler="b")
+        self.assertEqual(gauge.values(), {("a",): 1})
+        self.assertIn('test_running{handler="a"} 1', gauge.render())
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+
+    async def test_outcomes_are_counted(self):
+        @instrument_handler
+        async def sample_handler(outcome):
+            if outcome == "boom":
+                raise RuntimeError(outcome)
+            return outcome
+
+        await sample_handler("rewritten")
+        await sample_handler(None)
+        with self.assertRaises(RuntimeError):
+            await sample_handler("boom")
+
+        self.assertEqual(HANDLED_UPDATES.value(handler="sample_handler", outcome="rewritten"), 1)
+        self.assertEqual(HANDLED_UPDATES.value(handler="sample_handler", outcome="untouched"), 1)
+        self.assertEqual(HANDLED_UPDATES.value(handler="sample_handler", outcome="error"), 1)
+
+    async def test_handlers_in_flight_are_tracked(self):
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        @instrument_handler
+        async def waiting_handler():
+            started.set()
+            await release.wait()
+
+        task = asyncio.create_task(waiting_handler())
+        await started.wait()
+        self.assertEqual(HANDLERS_IN_FLIGHT.value(handler="waiting_handler"), 1)
+        release.set()
+        await task
+        self.assertEqual(HANDLERS_IN_FLIGHT.value(handler="waiting_handler"), 0)
+
+    async def test_process_message_records_rewrites_and_stages(self):
+        import handlers
+        use_mock_mappings()
+        handlers._bot_permissions.clear()
+        rewrites = REWRITES.value(domain="x.com")
+        handled = HANDLED_UPDATES.value(handler="process_message", outcome="rewritten")
+        parsed = STAGE_LATENCY.count(stage="extract_urls")
+
+        with patch.object(handlers, "is_group_allowed", return_value=True):
+            await handlers.process_message(make_link_update(), make_context())
+
+        self.assertEqual(REWRITES.value(domain="x.com"), rewrites + 1)
+        self.assertEqual(HANDLED_UPDATES.value(handler="process_message", outcome="rewritten"), handled + 1)
+        self.assertEqual(STAGE_LATENCY.count(stage="extract_urls"), parsed + 1)
+
+    async def test_unauthorized_group_outcome(self):
+        import handlers
+        before = HANDLED_UPDATES.value(handler="process_message", outcome="unauthorized")
+        with patch.object(handlers, "is_group_allowed", return_value=False):
+            await handlers.process_message(make_link_update(), make_context())
+        self.assertEqual(HANDLED_UPDATES.value(handler="process_message", outcome="unauthorized"), before + 1)
+
+class TestMetricsServer(unittest.IsolatedAsyncioTestCase):
+
+    async def test_metrics_endpoint(self):
+        server = await start_metrics_server("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            response = (await reader.read()).decode()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+        self.assertTrue(response.startswith("HTTP/1.1 200 OK"))
+        self.assertIn("# TYPE bot_stage_latency_seconds histogram", response)
+        self.assertIn("bot_updates_received_total", response)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import unittest
+
+from telegram.error import RetryAfter
+
+from outbound_scheduler import OutboundScheduler, TokenBucket, PRIORITY_ADMIN
+
+class FakeBot:
+    """Records sent messages and answers 429 to the first flood_responses requests of a chat."""
+
+    def __init__(self, flood_responses=None, retry_after=0.2):
+        self.flood_responses = dict(flood_responses or {})
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.flood_responses.get(chat_id, 0) > 0:
+            self.flood_responses[chat_id] -= 1
+            raise RetryAfter(self.retry_after)
+        self.sent.append((chat_id, text, time.monotonic()))
+        return True
+
+def send(scheduler, bot, chat_id, text, priority=None):
+    data = {"chat_id": chat_id, "text": text}
+    return scheduler.process_request(bot.send_message, (), data, "sendMessage", data, priority)
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_delay(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        self.assertGreater(bucket.delay(), 0.1)
+        bucket.refund()
+        self.assertAlmostEqual(bucket.tokens, 0.0, places=1)
+
+class TestOutboundScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def test_retry_after_is_honored(self):
+        scheduler = OutboundScheduler(global_rate=100, chat_rate_per_minute=600)
+        bot = FakeBot(flood_responses={-100: 1}, retry_after=0.2)
+        start = time.monotonic()
+        self.assertTrue(await send(scheduler, bot, -100, "hello"))
+        self.assertGreaterEqual(bot.sent[0][2] - start, 0.2)
+        self.assertEqual(scheduler.stats()["retries"], 1)
+
+    async def test_gives_up_after_max_retries(self):
+        scheduler = OutboundScheduler(global_rate=100, chat_rate_per_minute=600, max_retries=2)
+        bot = FakeBot(flood_responses={-100: 5}, retry_after=0.05)
+        with self.assertRaises(RetryAfter):
+            await send(scheduler, bot, -100, "hello")
+        self.assertEqual(bot.sent, [])
+
+    async def test_flooded_chat_does_not_delay_other_chats(self):
+        scheduler = OutboundScheduler(global_rate=100, chat_rate_per_minute=600)
+        bot = FakeBot(flood_responses={-100: 1}, retry_after=0.5)
+        start = time.monotonic()
+        await asyncio.gather(send(scheduler, bot, -100, "flooded"), send(scheduler, bot, -200, "other"))
+        sent_at = {chat_id: at - start for chat_id, _, at in bot.sent}
+        self.assertLess(sent_at[-200], 0.2)
+        self.assertGreaterEqual(sent_at[-100], 0.5)
+
+    async def test_admin_responses_overtake_queued_messages(self):
+        scheduler = OutboundScheduler(global_rate=10, chat_rate_per_minute=6000)
+        bot = FakeBot()
+        # Use up the global burst so the next requests have to queue
+        await asyncio.gather(*(send(scheduler, bot, -i, "burst") for i in range(1, 11)))
+
+        queued = [asyncio.create_task(send(scheduler, bot, -100 - i, f"link {i}")) for i in range(5)]
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.queue_depth, 5)
+        admin = asyncio.create_task(send(scheduler, bot, 42, "admin", PRIORITY_ADMIN))
+        await asyncio.gather(admin, *queued)
+
+        texts = [text for _, text, _ in bot.sent[10:]]
+        self.assertLessEqual(texts.index("admin"), 1)
+        self.assertEqual(scheduler.queue_depth, 0)
+        self.assertGreater(scheduler.stats()["max_wait"], 0)
+
+    async def test_admin_responses_skip_the_chat_bucket(self):
+        scheduler = OutboundScheduler(global_rate=100, chat_rate_per_minute=60)
+        bot = FakeBot()
+        # Use up the chat's burst so its next message waits a second
+        await asyncio.gather(*(send(scheduler, bot, 42, "burst") for _ in range(60)))
+
+        start = time.monotonic()
+        queued = asyncio.create_task(send(scheduler, bot, 42, "link"))
+        await send(scheduler, bot, 42, "admin", PRIORITY_ADMIN)
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertFalse(queued.done())
+        queued.cancel()
+
+    async def test_rejected_request_gives_its_chat_token_back(self):
+        scheduler = OutboundScheduler(global_rate=100, chat_rate_per_minute=60)
+        bot = FakeBot(flood_responses={-100: 1}, retry_after=0.1)
+        await send(scheduler, bot, -100, "hello")
+        # One token for the message that went through, none for the rejected attempt
+        self.assertAlmostEqual(scheduler._chat_buckets[-100].tokens, 59, delta=0.5)
+
+    async def test_str_and_int_ids_share_a_chat(self):
+        scheduler = OutboundScheduler(global_rate=100, chat_rate_per_minute=60)
+        bot = FakeBot(flood_responses={"-100": 1}, retry_after=0.3)
+        start = time.monotonic()
+        flooded = asyncio.create_task(send(scheduler, bot, "-100", "as str"))
+        await asyncio.sleep(0.05)
+        # The 429 on the str path pauses the int path too
+        await send(scheduler, bot, -100, "as int")
+        await flooded
+        self.assertGreaterEqual(min(at for _, _, at in bot.sent) - start, 0.3)
+        self.assertEqual(list(scheduler._chat_buckets), [-100])
+        self.assertAlmostEqual(scheduler._chat_buckets[-100].tokens, 58, delta=0.5)
+
+if __name__ == '__main__':
+    unittest.main()
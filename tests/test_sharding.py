@@ -0,0 +1,107 @@
+import json
+import queue
+import time
+import unittest
+from collections import Counter
+
+from telegram import Update
+
+from sharding import HashRing, ShardedFrontend, shard_key
+
+CHAT_IDS = [-1000000000000 - i for i in range(5000)]
+
+def message_update(update_id, chat_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Group"},
+            "from": {"id": 10, "is_bot": False, "first_name": "User"},
+            "text": "hi",
+        },
+    }, None)
+
+class TestHashRing(unittest.TestCase):
+
+    def test_keys_spread_over_all_workers(self):
+        ring = HashRing(range(4))
+        counts = Counter(ring.node_for(chat_id) for chat_id in CHAT_IDS)
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        for count in counts.values():
+            self.assertGreater(count, len(CHAT_IDS) / 4 * 0.6)
+
+    def test_adding_a_worker_only_moves_keys_to_it(self):
+        ring = HashRing(range(4))
+        before = {chat_id: ring.node_for(chat_id) for chat_id in CHAT_IDS}
+        ring.add_node(4)
+        moved = {chat_id for chat_id in CHAT_IDS if ring.node_for(chat_id) != before[chat_id]}
+        self.assertTrue(all(ring.node_for(chat_id) == 4 for chat_id in moved))
+        self.assertLess(len(moved), len(CHAT_IDS) * 0.35)
+
+    def test_removing_a_worker_only_moves_its_keys(self):
+        ring = HashRing(range(4))
+        before = {chat_id: ring.node_for(chat_id) for chat_id in CHAT_IDS}
+        ring.remove_node(2)
+        for chat_id in CHAT_IDS:
+            if before[chat_id] != 2:
+                self.assertEqual(ring.node_for(chat_id), before[chat_id])
+            else:
+                self.assertNotEqual(ring.node_for(chat_id), 2)
+
+    def test_empty_ring(self):
+        with self.assertRaises(LookupError):
+            HashRing().node_for(1)
+
+class TestShardedFrontend(unittest.TestCase):
+
+    def setUp(self):
+        # No worker processes: inboxes are plain queues we can inspect
+        self.frontend = ShardedFrontend(0)
+        for worker_id in range(3):
+            self.frontend._inboxes[worker_id] = queue.Queue()
+            self.frontend.ring.add_node(worker_id)
+
+    def test_updates_of_a_chat_go_to_one_worker_in_order(self):
+        for update_id in range(1, 31):
+            self.frontend.route(message_update(update_id, CHAT_IDS[update_id % 3]))
+
+        seen = {}
+        for worker_id, inbox in self.frontend._inboxes.items():
+            while not inbox.empty():
+                kind, payload = inbox.get()
+                data = json.loads(payload)
+                chat_id = data["message"]["chat"]["id"]
+                self.assertEqual(self.frontend.ring.node_for(chat_id), worker_id)
+                seen.setdefault(chat_id, []).append(data["update_id"])
+        for update_ids in seen.values():
+            self.assertEqual(update_ids, sorted(update_ids))
+        self.assertEqual(sum(len(ids) for ids in seen.values()), 30)
+
+    def test_group_changes_are_broadcast_to_other_workers(self):
+        self.frontend.broadcast_resync(source_worker=1)
+        self.assertEqual(self.frontend._inboxes[0].get_nowait(), ("resync", None))
+        self.assertTrue(self.frontend._inboxes[1].empty())
+        self.assertEqual(self.frontend._inboxes[2].get_nowait(), ("resync", None))
+
+    def test_ready_once_every_worker_is(self):
+        for worker_id in range(3):
+            self.assertFalse(self.frontend.is_ready())
+            self.frontend.handle_event("ready", worker_id)
+        self.assertTrue(self.frontend.is_ready())
+
+        self.frontend.handle_event("groups", 2)
+        self.assertEqual(self.frontend._inboxes[0].get_nowait(), ("resync", None))
+        self.assertTrue(self.frontend._inboxes[2].empty())
+
+    def test_new_members_are_passed_to_other_workers(self):
+        self.frontend.handle_event("member", 0, ("-100", 7))
+        self.assertTrue(self.frontend._inboxes[0].empty())
+        self.assertEqual(self.frontend._inboxes[1].get_nowait(), ("member", ("-100", 7)))
+        self.assertEqual(self.frontend._inboxes[2].get_nowait(), ("member", ("-100", 7)))
+
+    def test_shard_key_is_the_chat(self):
+        self.assertEqual(shard_key(message_update(1, -100)), -100)
+
+if __name__ == '__main__':
+    unittest.main()
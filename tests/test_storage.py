@@ -0,0 +1,224 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from storage import MemoryStorage, MongoStorage, SQLiteStorage, Storage, create_storage
+
+def make_attempt(chat_id, adder_id, timestamp, adder_name="Spammer"):
+    return {"chat_id": chat_id, "chat_name": f"Group {chat_id}", "added_by_id": adder_id, "added_by_name": adder_name, "timestamp": timestamp}
+
+class StorageConformance:
+    """Behaviour every storage backend must share; subclasses provide make_storage."""
+
+    def make_storage(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.make_storage()
+        self.addCleanup(self.storage.close)
+        self.storage.create_database()
+        self.storage.ping()
+
+    def test_groups_round_trip(self):
+        self.storage.add_group("-100", "One")
+        self.storage.add_group("-200", "Two")
+        self.assertEqual(
+            sorted(self.storage.get_all_groups(), key=lambda group: group["_id"]),
+            [{"_id": "-100", "name": "One"}, {"_id": "-200", "name": "Two"}],
+        )
+        self.assertEqual(self.storage.load_groups(), {"-100": {}, "-200": {}})
+
+    def test_remove_reports_whether_the_group_existed(self):
+        self.storage.add_group("-100", "One")
+        self.assertTrue(self.storage.remove_group("-100"))
+        self.assertFalse(self.storage.remove_group("-100"))
+        self.assertEqual(self.storage.get_all_groups(), [])
+
+    def test_overrides_survive_a_rename(self):
+        self.storage.add_group("-100", "One")
+        self.storage.save_group_overrides("-100", {"x.com": "vxtwitter.com", "tiktok.com": None})
+        self.storage.add_group("-100", "Renamed")
+        self.assertEqual(self.storage.load_groups(), {"-100": {"x.com": "vxtwitter.com", "tiktok.com": None}})
+        self.assertEqual(self.storage.get_all_groups(), [{"_id": "-100", "name": "Renamed"}])
+
+        self.storage.save_group_overrides("-100", {})
+        self.assertEqual(self.storage.load_groups(), {"-100": {}})
+
+    def test_readding_a_removed_group_starts_clean(self):
+        self.storage.add_group("-100", "One")
+        self.storage.save_group_overrides("-100", {"x.com": "vxtwitter.com"})
+        self.storage.remove_group("-100")
+        self.storage.add_group("-100", "One")
+        self.assertEqual(self.storage.load_groups(), {"-100": {}})
+
+    def test_bulk_group_changes(self):
+        self.storage.add_group("-100", "One")
+        self.storage.save_group_overrides("-100", {"x.com": "vxtwitter.com"})
+        self.storage.add_groups({"-100": "Renamed", "-200": "Two", "-300": "Three"})
+        self.assertEqual(self.storage.load_groups(), {"-100": {"x.com": "vxtwitter.com"}, "-200": {}, "-300": {}})
+        self.assertEqual(self.storage.remove_groups(["-100", "-300", "-999"]), 2)
+        self.assertEqual(self.storage.get_all_groups(), [{"_id": "-200", "name": "Two"}])
+
+    def test_groups_are_paged_by_id(self):
+        self.storage.add_groups({str(-1000 - i): f"Group {i}" for i in range(45)})
+        seen, cursor, pages = [], None, 0
+        while True:
+            page, cursor = self.storage.get_groups(20, cursor)
+            seen.extend(group["_id"] for group in page)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted(str(-1000 - i) for i in range(45)))
+
+    def test_group_search(self):
+        self.storage.add_groups({"-100": "Cats of Madrid", "-200": "Dogs", "-300": "madrid 100%", "-1234": "Other"})
+        self.assertEqual([group["_id"] for group in self.storage.get_groups(search="MADRID")[0]], ["-100", "-300"])
+        self.assertEqual([group["_id"] for group in self.storage.get_groups(search="123")[0]], ["-1234"])
+        # Pattern characters are matched literally
+        self.assertEqual([group["_id"] for group in self.storage.get_groups(search="100%")[0]], ["-300"])
+        self.assertEqual(self.storage.get_groups(search=".*")[0], [])
+
+        page, cursor = self.storage.get_groups(1, search="madrid")
+        self.assertEqual(self.storage.get_groups(1, cursor, search="madrid")[0], [{"_id": "-300", "name": "madrid 100%"}])
+
+    def test_unauthorized_attempts_keep_their_fields(self):
+        attempt = make_attempt(-300, 7, datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc))
+        self.storage.log_unauthorized_groups([attempt])
+        self.assertEqual(self.storage.get_unauthorized_attempts(), ([attempt], None))
+
+    def test_attempts_are_paged_newest_first(self):
+        start = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+        # Pairs share a timestamp, so the cursor must also tell them apart
+        attempts = [make_attempt(-1000 - i, 7, start + timedelta(seconds=i // 2)) for i in range(25)]
+        self.storage.log_unauthorized_groups(attempts[:10])
+        self.storage.log_unauthorized_groups(attempts[10:])
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            page, cursor = self.storage.get_unauthorized_attempts(10, cursor)
+            seen.extend(attempt["chat_id"] for attempt in page)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [attempt["chat_id"] for attempt in reversed(attempts)])
+
+    def test_last_full_page_has_no_next_cursor(self):
+        self.storage.log_unauthorized_groups([make_attempt(-1000 - i, 7, datetime(2024, 5, 1, 12, i, tzinfo=timezone.utc)) for i in range(10)])
+        page, cursor = self.storage.get_unauthorized_attempts(10)
+        self.assertEqual(len(page), 10)
+        self.assertIsNone(cursor)
+
+    def test_attempts_are_counted_by_adder_and_by_group(self):
+        start = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+        self.storage.log_unauthorized_groups([
+            make_attempt(-300, 7, start, adder_name="Old name"),
+            make_attempt(-400, 7, start + timedelta(minutes=1)),
+            make_attempt(-300, 8, start + timedelta(minutes=2)),
+            make_attempt(-500, 7, start + timedelta(minutes=3)),
+        ])
+        by_adder = self.storage.count_unauthorized_attempts("added_by")
+        self.assertEqual([(row["id"], row["name"], row["count"]) for row in by_adder], [(7, "Spammer", 3), (8, "Spammer", 1)])
+        self.assertEqual(by_adder[0]["last"], start + timedelta(minutes=3))
+        by_chat = self.storage.count_unauthorized_attempts("chat", limit=1)
+        self.assertEqual([(row["id"], row["count"]) for row in by_chat], [(-300, 2)])
+
+    def test_retention_drops_old_attempts(self):
+        self.storage.attempts_retention = 3600
+        self.storage.log_unauthorized_groups([make_attempt(-300, 7, datetime.now(timezone.utc) - timedelta(hours=2))])
+        self.storage.log_unauthorized_groups([make_attempt(-400, 7, datetime.now(timezone.utc))])
+        if not isinstance(self.storage, MongoStorage):
+            # MongoDB's TTL monitor removes expired documents in the background instead
+            self.assertEqual([attempt["chat_id"] for attempt in self.storage.get_unauthorized_attempts()[0]], [-400])
+
+    def test_concurrent_writers(self):
+        def add(start):
+            for i in range(start, start + 50):
+                self.storage.add_group(str(i), f"Group {i}")
+
+        threads = [threading.Thread(target=add, args=(n * 50,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.storage.load_groups()), 200)
+
+class TestMemoryStorage(StorageConformance, unittest.TestCase):
+
+    def make_storage(self):
+        return MemoryStorage()
+
+class TestSQLiteStorage(StorageConformance, unittest.TestCase):
+
+    def make_storage(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "bot.db")
+        return SQLiteStorage(self.path)
+
+    def test_wal_mode(self):
+        self.assertEqual(self.storage.connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_data_survives_reopening(self):
+        self.storage.add_group("-100", "One")
+        self.storage.close()
+        reopened = SQLiteStorage(self.path)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.get_all_groups(), [{"_id": "-100", "name": "One"}])
+
+@unittest.skipUnless(os.getenv("TEST_MONGO_URI"), "set TEST_MONGO_URI to run the MongoDB conformance tests")
+class TestMongoStorage(StorageConformance, unittest.TestCase):
+
+    def make_storage(self):
+        storage = MongoStorage(os.getenv("TEST_MONGO_URI"), "smartsociallinkbot_test")
+        storage.db.groups.delete_many({})
+        storage.db.unauthorized_groups.delete_many({})
+        return storage
+
+class TestCreateStorage(unittest.TestCase):
+
+    def test_backends_by_name(self):
+        self.assertIsInstance(create_storage("memory"), MemoryStorage)
+        self.assertIsInstance(create_storage("sqlite", path=":memory:"), SQLiteStorage)
+        with self.assertRaises(ValueError):
+            create_storage("redis")
+
+    def test_mongo_retention_changes_update_the_ttl_index(self):
+        from pymongo.errors import OperationFailure
+        conflict = OperationFailure("Index already exists with different options", code=85)
+
+        storage = MongoStorage(attempts_retention=0)
+        storage._db = MagicMock()
+        attempts = storage._db.unauthorized_groups
+        attempts.create_index.side_effect = [conflict, None, None, None, None]
+        storage.create_database()
+        # Turned off: the TTL index is replaced, never set to expire after 0 seconds
+        attempts.drop_index.assert_called_once_with("timestamp_1")
+        storage._db.command.assert_not_called()
+
+        storage = MongoStorage(attempts_retention=86400)
+        storage._db = MagicMock()
+        storage._db.unauthorized_groups.create_index.side_effect = [conflict, None, None, None]
+        storage.create_database()
+        self.assertEqual(storage._db.command.call_args.kwargs["index"]["expireAfterSeconds"], 86400)
+
+        # Other failures are not taken for a retention change
+        storage._db.unauthorized_groups.create_index.side_effect = OperationFailure("not authorized", code=13)
+        with self.assertRaises(OperationFailure):
+            storage.create_database()
+
+    def test_backends_must_implement_every_method(self):
+        class Incomplete(Storage):
+            def ping(self):
+                pass
+
+        for storage_class in (Storage, Incomplete):
+            with self.assertRaises(TypeError):
+                storage_class()
+
+if __name__ == '__main__':
+    unittest.main()
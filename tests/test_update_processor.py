@@ -0,0 +1,279 @@
+import asyncio
+import socket
+import time
+import unittest
+from unittest.mock import patch, AsyncMock
+
+import httpx
+from telegram import User
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from update_processor import PerChatUpdateProcessor, classify_update, PRIORITY_HIGH, PRIORITY_LINK, PRIORITY_LOW
+
+SECRET = "test-secret"
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def message_update(update_id, chat_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Group {chat_id}"},
+            "from": {"id": 10, "is_bot": False, "first_name": "User"},
+            "text": f"message {update_id}",
+        },
+    }
+
+ADMIN_ID = 42
+
+def link_update(update_id, chat_id):
+    update = message_update(update_id, chat_id)
+    update["message"]["text"] = "look https://x.com/user"
+    update["message"]["entities"] = [{"type": "url", "offset": 5, "length": 18}]
+    return update
+
+def admin_command_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": ADMIN_ID, "type": "private", "first_name": "Admin"},
+            "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"},
+            "text": "/queue",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+def join_update(update_id, chat_id):
+    bot = {"id": 1, "is_bot": True, "first_name": "Bot"}
+    return {
+        "update_id": update_id,
+        "my_chat_member": {
+            "chat": {"id": chat_id, "type": "supergroup", "title": "New"},
+            "from": {"id": 10, "is_bot": False, "first_name": "User"},
+            "date": int(time.time()),
+            "old_chat_member": {"user": bot, "status": "left"},
+            "new_chat_member": {"user": bot, "status": "member"},
+        },
+    }
+
+def de_json(raw):
+    from telegram import Update
+    return Update.de_json(raw, None)
+
+class TestWebhookConcurrency(unittest.IsolatedAsyncioTestCase):
+
+    async def test_chats_run_in_parallel_and_stay_ordered(self):
+        spans = {}
+        done = asyncio.Event()
+
+        async def slow_handler(update, context):
+            start = time.monotonic()
+            await asyncio.sleep(0.3)
+            spans[update.update_id] = (update.effective_chat.id, start, time.monotonic())
+            if len(spans) == 3:
+                done.set()
+
+        app = ApplicationBuilder().token("123:TEST").concurrent_updates(PerChatUpdateProcessor(8)).build()
+        app.add_handler(MessageHandler(filters.ALL, slow_handler))
+        port = free_port()
+
+        bot_user = User(id=123, is_bot=True, first_name="Bot", username="test_bot")
+        with patch.object(type(app.bot), "get_me", AsyncMock(return_value=bot_user)), \
+                patch.object(type(app.bot), "set_webhook", AsyncMock(return_value=True)):
+            app.bot._bot_user = bot_user
+            await app.initialize()
+            await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="telegram", secret_token=SECRET)
+            await app.start()
+            try:
+                async with httpx.AsyncClient() as client:
+                    for update_id, chat_id in [(1, -100), (2, -200), (3, -100)]:
+                        response = await client.post(
+                            f"http://127.0.0.1:{port}/telegram",
+                            json=message_update(update_id, chat_id),
+                            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+                        )
+                        self.assertEqual(response.status_code, 200)
+                    rejected = await client.post(f"http://127.0.0.1:{port}/telegram", json=message_update(4, -300))
+                    self.assertEqual(rejected.status_code, 403)
+                await asyncio.wait_for(done.wait(), timeout=5)
+            finally:
+                await app.updater.stop()
+                await app.stop()
+                await app.shutdown()
+
+        # Different chats overlap in time
+        self.assertLess(spans[2][1], spans[1][2])
+        # The second update of chat -100 only starts once the first one finished
+        self.assertGreaterEqual(spans[3][1], spans[1][2])
+
+class TestPerChatUpdateProcessor(unittest.IsolatedAsyncioTestCase):
+
+    async def test_chat_locks_are_released(self):
+        from telegram import Update
+        processor = PerChatUpdateProcessor(4)
+        update = Update.de_json(message_update(1, -100), None)
+
+        async def noop():
+            pass
+
+        await processor.process_update(update, noop())
+        self.assertEqual(processor._chat_locks, {})
+
+    async def test_busy_chat_does_not_take_every_slot(self):
+        from telegram import Update
+        processor = PerChatUpdateProcessor(2)
+        finished = []
+
+        async def work(name, delay):
+            await asyncio.sleep(delay)
+            finished.append(name)
+
+        busy = [processor.process_update(Update.de_json(message_update(i, -100), None), work(f"busy{i}", 0.1)) for i in range(5)]
+        other = processor.process_update(Update.de_json(message_update(10, -200), None), work("other", 0.01))
+        await asyncio.gather(*busy, other)
+        self.assertEqual(finished[0], "other")
+
+class TestLoadShedding(unittest.IsolatedAsyncioTestCase):
+
+    def test_classification(self):
+        self.assertEqual(classify_update(de_json(admin_command_update(1)), ADMIN_ID), PRIORITY_HIGH)
+        self.assertEqual(classify_update(de_json(join_update(2, -100)), ADMIN_ID), PRIORITY_HIGH)
+        self.assertEqual(classify_update(de_json(link_update(3, -100)), ADMIN_ID), PRIORITY_LINK)
+        self.assertEqual(classify_update(de_json(message_update(4, -100)), ADMIN_ID), PRIORITY_LOW)
+        # Commands only jump the queue when the admin sends them
+        command = admin_command_update(5)
+        command["message"]["from"]["id"] = 7
+        self.assertEqual(classify_update(de_json(command), ADMIN_ID), PRIORITY_LOW)
+
+    async def test_admin_command_latency_stays_bounded_during_a_flood(self):
+        processor = PerChatUpdateProcessor(4, admin_id=ADMIN_ID, max_queue=10000)
+        admin_waited = []
+
+        async def work():
+            await asyncio.sleep(0.01)
+
+        async def admin_command(sent):
+            admin_waited.append(time.monotonic() - sent)
+
+        # 1000 updates across 250 raided chats take about 2.5s to get through 4 slots
+        updates = [de_json((link_update if i % 2 else message_update)(i, -1000 - i % 250)) for i in range(1000)]
+        flood = [asyncio.create_task(processor.process_update(update, work())) for update in updates]
+        await asyncio.sleep(0.05)
+        sent = time.monotonic()
+        await processor.process_update(de_json(admin_command_update(9999)), admin_command(sent))
+
+        self.assertLess(admin_waited[0], 0.1)
+        self.assertGreater(processor.stats()["pending"], 900)
+        for task in flood:
+            task.cancel()
+        await asyncio.gather(*flood, return_exceptions=True)
+        self.assertEqual(processor.stats()["active"], 0)
+
+    async def test_unauthorized_chats_are_dropped_on_arrival(self):
+        processor = PerChatUpdateProcessor(4, admin_id=ADMIN_ID, chat_filter=lambda chat_id: chat_id == -100)
+        handled = []
+
+        async def work(name):
+            handled.append(name)
+
+        await processor.process_update(de_json(link_update(1, -100)), work("allowed"))
+        await processor.process_update(de_json(link_update(2, -200)), work("unauthorized"))
+        # The bot being added to a new group still goes through
+        await processor.process_update(de_json(join_update(3, -300)), work("join"))
+        self.assertEqual(handled, ["allowed", "join"])
+        self.assertEqual(processor.stats()["shed"], {"unauthorized": 1})
+
+    async def test_stale_low_priority_updates_are_shed(self):
+        processor = PerChatUpdateProcessor(1, shed_age=0.05)
+        handled = []
+
+        async def work(name, delay=0):
+            await asyncio.sleep(delay)
+            handled.append(name)
+
+        await asyncio.gather(
+            processor.process_update(de_json(message_update(1, -100)), work("first", 0.1)),
+            processor.process_update(de_json(message_update(2, -200)), work("chatter")),
+            processor.process_update(de_json(link_update(3, -300)), work("link")),
+        )
+        self.assertEqual(handled, ["first", "link"])
+        self.assertEqual(processor.stats()["shed"], {"stale": 1})
+
+    async def test_full_queue_sheds_the_least_urgent_updates(self):
+        processor = PerChatUpdateProcessor(1, admin_id=ADMIN_ID, max_queue=2)
+        handled = []
+
+        async def work(name, delay=0):
+            await asyncio.sleep(delay)
+            handled.append(name)
+
+        running = asyncio.create_task(processor.process_update(de_json(message_update(1, -100)), work("running", 0.05)))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(processor.process_update(de_json(message_update(2, -200)), work("chatter"))),
+            asyncio.create_task(processor.process_update(de_json(link_update(3, -300)), work("link"))),
+        ]
+        await asyncio.sleep(0)
+        # The queue is full: another plain message is dropped, a link takes the chatter's place
+        await processor.process_update(de_json(message_update(4, -400)), work("more chatter"))
+        await asyncio.gather(
+            running, *waiting,
+            processor.process_update(de_json(link_update(5, -500)), work("second link")),
+        )
+        self.assertEqual(handled, ["running", "link", "second link"])
+        self.assertEqual(processor.stats()["shed"], {"queue_full": 2})
+
+    async def test_single_chat_flood_does_not_shed_links_from_other_chats(self):
+        processor = PerChatUpdateProcessor(4, admin_id=ADMIN_ID, max_queue=50)
+        handled = []
+
+        async def work(name, delay=0.0):
+            await asyncio.sleep(delay)
+            handled.append(name)
+
+        # A raid on one group: its chatter queues behind the group's own lock, not for a slot
+        raid = [asyncio.create_task(processor.process_update(de_json(message_update(i, -100)), work("chatter", 0.001))) for i in range(200)]
+        await asyncio.sleep(0)
+        self.assertEqual(processor.stats()["pending"], 50)
+
+        link = asyncio.create_task(processor.process_update(de_json(link_update(1000, -200)), work("link")))
+        await asyncio.gather(link, *raid)
+        self.assertIn("link", handled)
+        self.assertEqual(processor.stats()["shed"], {"queue_full": 150})
+        self.assertEqual(processor.stats()["pending"], 0)
+        self.assertEqual(processor._chat_locks, {})
+
+    async def test_queue_fills_just_as_a_slot_is_handed_over(self):
+        processor = PerChatUpdateProcessor(1, admin_id=ADMIN_ID, max_queue=1)
+        handled = []
+        finish = asyncio.Event()
+
+        async def work(name, event=None):
+            if event:
+                await event.wait()
+            handled.append(name)
+
+        running = asyncio.create_task(processor.process_update(de_json(message_update(1, -100)), work("running", finish)))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(processor.process_update(de_json(message_update(2, -200)), work("chatter")))
+        await asyncio.sleep(0)
+        # The running update frees its slot for the chatter, and a link arrives before the chatter resumes
+        finish.set()
+        link = asyncio.create_task(processor.process_update(de_json(link_update(3, -300)), work("link")))
+        await asyncio.gather(running, waiting, link)
+
+        # The chatter already holds the slot, so it is not shed in the link's favour
+        self.assertEqual(handled, ["running", "chatter"])
+        self.assertEqual(processor.stats()["shed"], {"queue_full": 1})
+        self.assertEqual(processor.stats()["pending"], 0)
+        self.assertEqual(processor.stats()["active"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from telegram import Chat, MessageEntity, Update
+from telegram.ext import BaseUpdateProcessor
+from metrics import UPDATES_RECEIVED, UPDATES_SHED
+
+# Priority classes, most urgent first: admin commands and the bot joining or leaving
+# chats, then messages that may carry links to correct, then everything else
+PRIORITY_HIGH = 0
+PRIORITY_LINK = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = ("high", "link", "low")
+
+LINK_ENTITY_TYPES = (MessageEntity.URL, MessageEntity.TEXT_LINK)
+
+def classify_update(update, admin_id: int = None) -> int:
+    """Returns the priority class of an update."""
+    if not isinstance(update, Update):
+        return PRIORITY_LOW
+    if update.my_chat_member:
+        return PRIORITY_HIGH
+
+    message = update.message
+    user = update.effective_user
+    if admin_id is not None and user and user.id == admin_id:
+        if update.callback_query or (message and message.text and message.text.startswith("/")):
+            return PRIORITY_HIGH
+
+    if message:
+        # Album parts are corrected together, so none of them may be shed
+        if message.media_group_id:
+            return PRIORITY_LINK
+        entities = message.entities or message.caption_entities
+        if any(entity.type in LINK_ENTITY_TYPES for entity in entities):
+            return PRIORITY_LINK
+    return PRIORITY_LOW
+
+class _QueuedUpdate:
+    """An update accepted but not running yet. Compared by identity, so it can be removed from its queue."""
+    __slots__ = ("future", "arrival", "shed")
+
+    def __init__(self, arrival: float):
+        # Set once the update waits for a slot; resolves to whether it got one
+        self.future = None
+        self.arrival = arrival
+        self.shed = False
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to max_concurrent_updates updates at the same time while keeping
+    updates from the same chat in the order they arrived, so replies within a
+    group never overtake each other.
+
+    Free slots go to waiting updates by priority class (see classify_update), so
+    admin commands do not queue behind a flood of messages. Under load, updates are
+    shed (dropped and counted) instead of piling up: low-priority updates that
+    waited more than shed_age seconds, and updates arriving while max_queue are
+    already waiting (a high-priority one takes the place of a waiting lower one
+    instead, even one still waiting behind its own chat). With chat_filter, group
+    updates from chats it rejects are dropped on arrival, before any handler or
+    database work.
+    """
+
+    def __init__(self, max_concurrent_updates: int, admin_id: int = None, max_queue: int = 1000,
+                 shed_age: float = 10.0, chat_filter=None):
+        super().__init__(max_concurrent_updates)
+        self.admin_id = admin_id
+        self.max_queue = max_queue
+        self.shed_age = shed_age
+        self.chat_filter = chat_filter
+        # chat_id -> [lock, number of updates holding or waiting for it]
+        self._chat_locks = {}
+        self._active = 0
+        # One FIFO of _QueuedUpdate per priority class, for updates accepted but not running
+        # yet, whether waiting for their chat or for a slot
+        self._queued = [deque() for _ in PRIORITY_NAMES]
+        # The same entries, per priority class, once they wait for a slot
+        self._waiting = [deque() for _ in PRIORITY_NAMES]
+        # (reason, priority name) -> updates shed
+        self._shed_counts = {}
+
+    @asynccontextmanager
+    async def _chat_lock(self, update):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            yield
+            return
+
+        entry = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat.id]
+
+    def _shed(self, reason: str, priority: int):
+        key = (reason, PRIORITY_NAMES[priority])
+        self._shed_counts[key] = self._shed_counts.get(key, 0) + 1
+        UPDATES_SHED.inc(reason=reason, priority=PRIORITY_NAMES[priority])
+
+    def _is_unauthorized(self, update, priority: int) -> bool:
+        if self.chat_filter is None or priority == PRIORITY_HIGH or not isinstance(update, Update):
+            return False
+        chat = update.effective_chat
+        return chat is not None and chat.type in (Chat.GROUP, Chat.SUPERGROUP) and not self.chat_filter(chat.id)
+
+    @property
+    def _pending(self) -> int:
+        return sum(len(queued) for queued in self._queued)
+
+    def _make_room(self, priority: int) -> bool:
+        """
+        Sheds the newest queued update of a lower class than priority; False if there is
+        none. An update still waiting for its chat is marked and gives up once its turn comes;
+        one whose slot wait already ended (handed a slot or shed) has not resumed yet and is skipped.
+        """
+        for lower in range(len(self._queued) - 1, priority, -1):
+            entry = next((entry for entry in reversed(self._queued[lower]) if entry.future is None or not entry.future.done()), None)
+            if entry is None:
+                continue
+            self._queued[lower].remove(entry)
+            entry.shed = True
+            if entry.future is not None:
+                self._waiting[lower].remove(entry)
+                entry.future.set_result(False)
+            self._shed("queue_full", lower)
+            return True
+        return False
+
+    def _is_stale(self, priority: int, arrival: float) -> bool:
+        return priority == PRIORITY_LOW and time.monotonic() - arrival > self.shed_age
+
+    async def _acquire(self, priority: int, entry: _QueuedUpdate) -> bool:
+        """Waits for a processing slot; False if the update was shed while waiting."""
+        if self._is_stale(priority, entry.arrival):
+            self._shed("stale", priority)
+            return False
+        if self._active < self.max_concurrent_updates and not any(self._waiting):
+            self._active += 1
+            return True
+
+        entry.future = asyncio.get_running_loop().create_future()
+        self._waiting[priority].append(entry)
+        try:
+            return await entry.future
+        except asyncio.CancelledError:
+            if entry.future.done() and not entry.future.cancelled() and entry.future.result():
+                # The slot was handed over just as the update was cancelled
+                self._release()
+            elif entry in self._waiting[priority]:
+                self._waiting[priority].remove(entry)
+            raise
+
+    def _release(self):
+        """Frees a slot and hands it to the most urgent waiting update."""
+        self._active -= 1
+        while self._active < self.max_concurrent_updates:
+            waiting = next((waiting for waiting in self._waiting if waiting), None)
+            if waiting is None:
+                return
+            priority = self._waiting.index(waiting)
+            entry = waiting.popleft()
+            if entry.future.done():
+                continue
+            if self._is_stale(priority, entry.arrival):
+                self._shed("stale", priority)
+                entry.future.set_result(False)
+                continue
+            self._active += 1
+            entry.future.set_result(True)
+
+    async def process_update(self, update, coroutine):
+        UPDATES_RECEIVED.inc()
+        priority = classify_update(update, self.admin_id)
+        reason = None
+        if self._is_unauthorized(update, priority):
+            reason = "unauthorized"
+        elif self._pending >= self.max_queue and priority != PRIORITY_HIGH and not self._make_room(priority):
+            reason = "queue_full"
+        if reason:
+            self._shed(reason, priority)
+            coroutine.close()
+            return
+
+        entry = _QueuedUpdate(time.monotonic())
+        self._queued[priority].append(entry)
+        waiting = True
+        try:
+            # Wait for the chat's turn before taking a concurrency slot, so a busy chat
+            # cannot fill every slot with updates that are only waiting on each other
+            async with self._chat_lock(update):
+                admitted = not entry.shed and await self._acquire(priority, entry)
+                waiting = False
+                if not entry.shed:
+                    self._queued[priority].remove(entry)
+                if not admitted:
+                    coroutine.close()
+                    return
+                try:
+                    await self.do_process_update(update, coroutine)
+                finally:
+                    self._release()
+        finally:
+            # Cancelled before its turn: the handler never runs
+            if waiting:
+                if not entry.shed:
+                    self._queued[priority].remove(entry)
+                coroutine.close()
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    def stats(self) -> dict:
+        """Returns the updates running, queued (for their chat or a slot) per priority class and shed per reason."""
+        shed = {}
+        for (reason, _), count in self._shed_counts.items():
+            shed[reason] = shed.get(reason, 0) + count
+        return {
+            "active": self._active,
+            "pending": self._pending,
+            "waiting": {name: len(queued) for name, queued in zip(PRIORITY_NAMES, self._queued)},
+            "shed": shed,
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass